@@ -1,7 +1,7 @@
 
 # app.py
 ########
-from flask import Flask, jsonify, request 
+from flask import Flask, jsonify, request, Response, send_file
 # import mysql.connector
 import os
 
@@ -12,10 +12,25 @@ from datetime import datetime, timedelta
 from flask_cors import CORS
 import base as b
 import storage as s
+import search_index
+import storage_ledger
+from cache import TTLCache
+from botocore.exceptions import ClientError
+from playback_buffer import WriteBehindBuffer
+from disk_cache import DiskCache
+import media
+import audio_meta
+import migrations
 # from storage import backblaze_store
 import math
 from datetime import datetime, timezone, timedelta  #
 import re
+import json
+import base64
+import time
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 # def handler(event, context):
 #     return handle_request(app, event, context)
@@ -32,6 +47,43 @@ app = Flask(__name__)
 CORS(app) 
 
 bz = s.backblaze_store()
+
+# Chapter inserts, GET /books and the catalogue index use columns added by migrations.py
+if os.getenv('MIGRATE_ON_START', 'true').lower() == 'true':
+    try:
+        migrations.run_migrations()
+        pending = migrations.pending_migrations()
+        if pending:
+            print(f"❌ Pending migrations: {pending} - run python migrations.py")
+    except Exception as e:
+        print(f"❌ Migrations at startup failed: {e}")
+search_index.start()
+
+@app.teardown_request
+def release_db_connection(exc=None):
+    # All base.py helper calls in a request share one pooled connection
+    b.release_request_connection(exc)
+###################
+######## User identity cache ########
+# id/name/email/role per user_id for admin_required and /api/verify-token.
+# update_user_role/delete_user invalidate this worker's entry; other workers pick the
+# change up within USER_CACHE_TTL seconds (default 30).
+user_cache = TTLCache(max_size=int(os.getenv('USER_CACHE_SIZE', '10000')),
+                      ttl=float(os.getenv('USER_CACHE_TTL', '30')))
+
+def get_user_identity(user_id):
+    """{id, name, email, role} of a user, or None if the user does not exist"""
+    user = user_cache.get(user_id)
+    if user is None:
+        rows = b.universal_db_select(
+            "SELECT id, name, email, role FROM users WHERE id = %s", 
+            (user_id,)
+        )
+        if not rows:
+            return None
+        user = dict(rows[0])
+        user_cache.set(user_id, user)
+    return dict(user)
 ###################
 from functools import wraps
 def admin_required(f):
@@ -49,12 +101,9 @@ def admin_required(f):
             decoded = jwt.decode(token, os.getenv('JWT_SECRET'), algorithms=['HS256'])
             
             # Check if user is admin using the existing role column
-            user = b.universal_db_select(
-                "SELECT id, role FROM users WHERE id = %s", 
-                (decoded['user_id'],)
-            )
+            user = get_user_identity(decoded['user_id'])
             
-            if not user or user[0]['role'] != 'admin':
+            if not user or user['role'] != 'admin':
                 return jsonify({"error": "Admin access required"}), 403
                 
         except jwt.ExpiredSignatureError:
@@ -92,18 +141,15 @@ def verify_token():
             if exp_timestamp and datetime.now(timezone.utc).timestamp() > exp_timestamp:
                 return jsonify({"valid": False, "error": "Token expired"}), 401
             
-            # Get user info from database
-            user = b.universal_db_select(
-                "SELECT id, name, email, role FROM users WHERE id = %s", 
-                (decoded['user_id'],)
-            )
+            # Get user info (cached per user_id)
+            user = get_user_identity(decoded['user_id'])
             
             if not user:
                 return jsonify({"valid": False, "error": "User not found"}), 401
             
             return jsonify({
                 "valid": True,
-                "user": user[0],
+                "user": user,
                 "expires_in": exp_timestamp - datetime.now(timezone.utc).timestamp() if exp_timestamp else None
             })
             
@@ -127,10 +173,21 @@ def add_book():
             INSERT INTO books (title, author, publisher, isbn, description, category_id)
             VALUES (%s, %s, %s, %s, %s, %s)
         """
+        if DB_TYPE == 'postgresql':
+            query += " RETURNING id"
         result = b.db_insert (query, (
             data['title'], data['author'], data['publisher'], 
             data['isbn'], data['description'], data['category_id']
         ))
+
+        if result:
+            bump_dashboard_counters(total_books=1)
+            search_index.book_added({
+                'id': result,
+                'title': data['title'],
+                'author': data['author'],
+                'category_id': data['category_id'],
+            })
         
         return jsonify({"book_id": result, "message": "Book added successfully"}), 201
         
@@ -159,14 +216,20 @@ def api_upload_audio():
             }), 200
 
         # Get book details
-        book = b.universal_db_select("SELECT title, author FROM books WHERE id = %s", (book_id,))
-        if not book:
+        folder_name = get_book_folder(int(book_id))
+        if not folder_name:
             return jsonify({"success": False, "error": "Book not found"}), 404
-        book = book[0]
-
-        folder_name = f"{book['title']} By {book['author']}"
         file_path = f"{folder_name}/{file.filename}"
 
+        # Size for the storage ledger (werkzeug has already spooled the upload)
+        file.stream.seek(0, os.SEEK_END)
+        file_size = file.stream.tell()
+        file.stream.seek(0)
+        audio = audio_meta.probe_file(file.stream, file_size)
+
+        # Do not hold a pooled DB connection during the transfer
+        b.release_request_connection()
+
         # Upload to Backblaze
         # s3 = s.backblaze_store()
         bucket = os.getenv("B2_BUCKET")
@@ -174,15 +237,493 @@ def api_upload_audio():
         # s3.upload_fileobj(file, bucket, file_path, ExtraArgs={'ContentType': 'audio/mpeg'})
 
         # Insert into chapters
-        # chapter_number = extract_chapter_number(file.filename)
-        
-        query = "INSERT INTO chapters (book_id, title, chapter_number) VALUES (%s, %s, %s)"
-        b.db_insert(query, (book_id, file.filename, chapter_number))
+        register_uploaded_chapter(int(book_id), file.filename, chapter_number, file_size, audio)
 
         return jsonify({"success": True, "file_path": file_path}), 200
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+
+# Audio metadata from audio_meta (None for files that are not MP3) goes into these columns
+AUDIO_FIELDS = ('duration_seconds', 'bitrate_kbps', 'sample_rate', 'channels')
+CHAPTER_INSERT_COLUMNS = "book_id, title, chapter_number, " + ", ".join(AUDIO_FIELDS)
+
+def chapter_row(book_id, filename, chapter_number, audio):
+    return (book_id, filename, chapter_number, *((audio or {}).get(field) for field in AUDIO_FIELDS))
+
+def register_uploaded_chapter(book_id, filename, chapter_number, size, audio=None):
+    """Book-keeping after an audio file is in B2: storage ledger, chapters row,
+    dashboard counters and search index. Returns the new chapter id."""
+    storage_ledger.record_upload(book_id, size)
+    forget_cached_audio(book_id, [filename])
+
+    query = f"INSERT INTO chapters ({CHAPTER_INSERT_COLUMNS}) VALUES (%s, %s, %s, %s, %s, %s, %s)"
+    if DB_TYPE == 'postgresql':
+        query += " RETURNING id"
+    chapter_id = b.db_insert(query, chapter_row(book_id, filename, chapter_number, audio))
+
+    if chapter_id:
+        bump_dashboard_counters(total_chapters=1)
+        search_index.chapter_added(book_id, {
+            'id': chapter_id,
+            'chapter_number': chapter_number,
+            'title': filename,
+            'duration': (audio or {}).get('duration_seconds'),
+        })
+        queue_media_jobs(book_id, {filename: chapter_id})
+    return chapter_id
+
+
+######## Bulk upload ########
+# POST /api/upload_audio/bulk - form field book_id plus any number of "files".
+# The book is looked up once, files go to B2 on UPLOAD_BULK_WORKERS threads (default 4)
+# and all chapter rows are inserted in one batch. Returns a status per file.
+if DB_TYPE == 'postgresql':
+    BULK_CHAPTER_INSERT = f"INSERT INTO chapters ({CHAPTER_INSERT_COLUMNS}) VALUES %s RETURNING id"
+    BULK_CHAPTER_TEMPLATE = "(%s, %s, %s, %s, %s, %s, %s)"
+else:
+    # db_insert_many sends this as one multi-row INSERT and derives the ids from
+    # lastrowid; check_chapter_ids confirms them against the rows
+    BULK_CHAPTER_INSERT = f"INSERT INTO chapters ({CHAPTER_INSERT_COLUMNS}) VALUES (%s, %s, %s, %s, %s, %s, %s)"
+    BULK_CHAPTER_TEMPLATE = None
+
+def check_chapter_ids(book_id, chapter_numbers, ids):
+    """MySQL ids derived from lastrowid are only certain when the rows behind them match;
+    otherwise the newest chapter row for each (book_id, chapter_number) is used."""
+    placeholders = ", ".join(["%s"] * len(ids))
+    rows = b.universal_db_select(
+        f"SELECT id, chapter_number FROM chapters WHERE book_id = %s AND id IN ({placeholders})",
+        (book_id, *ids), raise_errors=True)
+    found = {row['id']: row['chapter_number'] for row in rows}
+    if all(found.get(chapter_id) == number for chapter_id, number in zip(ids, chapter_numbers)):
+        return ids
+
+    print(f"⚠️ Bulk insert ids for book {book_id} did not match the rows - re-selecting by chapter number")
+    placeholders = ", ".join(["%s"] * len(chapter_numbers))
+    rows = b.universal_db_select(
+        f"SELECT id, chapter_number FROM chapters WHERE book_id = %s AND chapter_number IN ({placeholders}) "
+        "ORDER BY id", (book_id, *chapter_numbers), raise_errors=True)
+    newest = {row['chapter_number']: row['id'] for row in rows}
+    return [newest.get(number) for number in chapter_numbers]
+
+def register_uploaded_chapters(book_id, uploaded):
+    """register_uploaded_chapter for many files: uploaded is a list of
+    (filename, chapter_number, size, audio). Returns {filename: chapter id}."""
+    storage_ledger.record_upload(book_id, sum(size for _, _, size, _ in uploaded), objects=len(uploaded))
+    forget_cached_audio(book_id, [filename for filename, _, _, _ in uploaded])
+
+    rows = [chapter_row(book_id, filename, chapter_number, audio) for filename, chapter_number, _, audio in uploaded]
+    ids = b.db_insert_many(BULK_CHAPTER_INSERT, rows, values_template=BULK_CHAPTER_TEMPLATE)
+    if ids is None or len(ids) != len(rows):
+        raise RuntimeError("Inserting chapters failed")
+    if DB_TYPE == 'mysql':
+        ids = check_chapter_ids(book_id, [chapter_number for _, chapter_number, _, _ in uploaded], ids)
+    chapter_ids = {filename: chapter_id for (filename, _, _, _), chapter_id in zip(uploaded, ids)}
+
+    bump_dashboard_counters(total_chapters=len(uploaded))
+    search_index.chapters_added(book_id, [
+        {'id': chapter_ids.get(filename), 'chapter_number': chapter_number, 'title': filename,
+         'duration': (audio or {}).get('duration_seconds')}
+        for filename, chapter_number, _, audio in uploaded if chapter_ids.get(filename)
+    ])
+    queue_media_jobs(book_id, chapter_ids)
+    return chapter_ids
+
+def finish_upload_batch(book_id, results):
+    """Register the files with status "uploaded" and build the per-file response"""
+    uploaded = [r for r in results if r["status"] == "uploaded"]
+    if uploaded:
+        try:
+            chapter_ids = register_uploaded_chapters(
+                book_id, [(r["filename"], r["chapter_number"], r["bytes"], r.pop("audio", None)) for r in uploaded]
+            )
+            for r in uploaded:
+                r["chapter_id"] = chapter_ids.get(r["filename"])
+        except Exception as e:
+            for r in uploaded:
+                r["status"] = "failed"
+                r["error"] = f"Uploaded to B2 but not saved in DB: {e}"
+
+    return {
+        "success": all(r["status"] != "failed" for r in results),
+        "book_id": book_id,
+        "uploaded": sum(1 for r in results if r["status"] == "uploaded"),
+        "failed": sum(1 for r in results if r["status"] == "failed"),
+        "skipped": sum(1 for r in results if r["status"] == "skipped"),
+        "files": results
+    }
+
+@app.route('/api/upload_audio/bulk', methods=['POST'])
+def api_upload_audio_bulk():
+    try:
+        book_id = request.form.get("book_id", type=int)
+        files = request.files.getlist("files")
+
+        if not book_id or not files:
+            return jsonify({"success": False, "error": "Missing book_id or files"}), 400
+
+        folder_name = get_book_folder(book_id)
+        if not folder_name:
+            return jsonify({"success": False, "error": "Book not found"}), 404
+
+        bucket = os.getenv("B2_BUCKET")
+        results = []
+        to_upload = []
+        for file in files:
+            result = {"filename": file.filename, "chapter_number": extract_chapter_number(file.filename)}
+            results.append(result)
+            if result["chapter_number"] is None:
+                result["status"] = "skipped"
+                result["note"] = "Non-chapter audio (not uploaded)"
+            else:
+                to_upload.append((file, result))
+
+        def upload_one(file, result):
+            try:
+                file.stream.seek(0, os.SEEK_END)
+                result["bytes"] = file.stream.tell()
+                file.stream.seek(0)
+                result["audio"] = audio_meta.probe_file(file.stream, result["bytes"])
+                result["file_path"] = f"{folder_name}/{file.filename}"
+                bz.upload_fileobj(file.stream, bucket, result["file_path"], ExtraArgs={'ContentType': 'audio/mpeg'})
+                result["status"] = "uploaded"
+            except Exception as e:
+                result["status"] = "failed"
+                result["error"] = str(e)
+
+        # Do not hold a pooled DB connection during the transfers
+        b.release_request_connection()
+        workers = int(os.getenv('UPLOAD_BULK_WORKERS', '4'))
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(to_upload) or 1))) as executor:
+            for future in [executor.submit(upload_one, file, result) for file, result in to_upload]:
+                future.result()
+
+        return jsonify(finish_upload_batch(book_id, results)), 200
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+######## Direct-to-B2 upload ########
+# 1. POST /api/upload_audio/initiate  {book_id, files: [{filename, size}]}
+#    -> a presigned PUT URL per file, or for files above the multipart part size a
+#       multipart upload id with one presigned URL per part
+# 2. the client uploads the bytes straight to B2 (Flask never sees them)
+# 3. POST /api/upload_audio/finalize  {book_id, files: [{filename, size, upload_id?, parts?}]}
+#    -> completes multipart uploads, HEADs every object and inserts the chapters
+# POST /api/upload_audio/abort {book_id, filename, upload_id} drops an unfinished multipart upload.
+UPLOAD_URL_EXPIRATION = int(os.getenv('UPLOAD_URL_EXPIRATION', '3600'))
+
+@app.route('/api/upload_audio/initiate', methods=['POST'])
+@admin_required
+def api_upload_audio_initiate():
+    try:
+        data = request.get_json(silent=True) or {}
+        book_id = data.get("book_id")
+        files = data.get("files") or []
+        if not book_id or not files:
+            return jsonify({"success": False, "error": "Missing book_id or files"}), 400
+        try:
+            book_id = int(book_id)
+            sizes = [int(entry.get("size") or 0) for entry in files]
+        except (AttributeError, TypeError, ValueError):
+            return jsonify({"success": False, "error": "book_id and each file's size must be integers"}), 400
+
+        folder_name = get_book_folder(book_id)
+        if not folder_name:
+            return jsonify({"success": False, "error": "Book not found"}), 404
+
+        bucket = os.getenv("B2_BUCKET")
+        part_size = s.upload_transfer_config().multipart_chunksize
+        results = []
+        for entry, size in zip(files, sizes):
+            filename = os.path.basename(entry.get("filename") or "")
+            result = {"filename": filename, "chapter_number": extract_chapter_number(filename)}
+            results.append(result)
+            if result["chapter_number"] is None:
+                result["status"] = "skipped"
+                result["note"] = "Non-chapter audio (not uploaded)"
+                continue
+
+            key = f"{folder_name}/{filename}"
+            try:
+                if size > part_size:
+                    upload = bz.create_multipart_upload(Bucket=bucket, Key=key, ContentType='audio/mpeg')
+                    result.update({
+                        "status": "ready",
+                        "method": "multipart",
+                        "upload_id": upload["UploadId"],
+                        "part_size": part_size,
+                        "parts": [{
+                            "part_number": part_number,
+                            "url": bz.generate_presigned_url(
+                                'upload_part',
+                                Params={'Bucket': bucket, 'Key': key,
+                                        'UploadId': upload["UploadId"], 'PartNumber': part_number},
+                                ExpiresIn=UPLOAD_URL_EXPIRATION
+                            )
+                        } for part_number in range(1, math.ceil(size / part_size) + 1)]
+                    })
+                else:
+                    result.update({
+                        "status": "ready",
+                        "method": "put",
+                        "url": bz.generate_presigned_url(
+                            'put_object',
+                            Params={'Bucket': bucket, 'Key': key, 'ContentType': 'audio/mpeg'},
+                            ExpiresIn=UPLOAD_URL_EXPIRATION,
+                            HttpMethod='PUT'
+                        ),
+                        "headers": {"Content-Type": "audio/mpeg"}
+                    })
+            except Exception as e:
+                result["status"] = "failed"
+                result["error"] = str(e)
+
+        return jsonify({"success": True, "book_id": book_id, "expires_in": UPLOAD_URL_EXPIRATION, "files": results})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/upload_audio/finalize', methods=['POST'])
+@admin_required
+def api_upload_audio_finalize():
+    try:
+        data = request.get_json(silent=True) or {}
+        book_id = data.get("book_id")
+        files = data.get("files") or []
+        if not book_id or not files:
+            return jsonify({"success": False, "error": "Missing book_id or files"}), 400
+        try:
+            book_id = int(book_id)
+            for entry in files:
+                if entry.get("size") is not None:
+                    entry["size"] = int(entry["size"])
+                entry["parts"] = [{"part_number": int(part["part_number"]), "etag": str(part["etag"])}
+                                  for part in entry.get("parts") or []]
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return jsonify({"success": False,
+                            "error": "book_id and size must be integers, parts need part_number and etag"}), 400
+
+        folder_name = get_book_folder(book_id)
+        if not folder_name:
+            return jsonify({"success": False, "error": "Book not found"}), 404
+
+        bucket = os.getenv("B2_BUCKET")
+        results = []
+        for entry in files:
+            filename = os.path.basename(entry.get("filename") or "")
+            result = {"filename": filename, "chapter_number": extract_chapter_number(filename)}
+            results.append(result)
+            if result["chapter_number"] is None:
+                result["status"] = "skipped"
+                continue
+
+            key = f"{folder_name}/{filename}"
+            try:
+                if entry.get("upload_id"):
+                    parts = sorted(entry.get("parts") or [], key=lambda part: part["part_number"])
+                    bz.complete_multipart_upload(
+                        Bucket=bucket, Key=key, UploadId=entry["upload_id"],
+                        MultipartUpload={'Parts': [{'PartNumber': part["part_number"], 'ETag': part["etag"]}
+                                                   for part in parts]}
+                    )
+                head = bz.head_object(Bucket=bucket, Key=key)
+                result["bytes"] = head["ContentLength"]
+                expected = entry.get("size")
+                if not result["bytes"] or (expected is not None and expected != result["bytes"]):
+                    result["status"] = "failed"
+                    result["error"] = f"Object has {result['bytes']} bytes, expected {expected}"
+                else:
+                    result["status"] = "uploaded"
+                    result["file_path"] = key
+                    result["audio"] = probe_stored_audio(key, result["bytes"])
+            except Exception as e:
+                result["status"] = "failed"
+                result["error"] = f"Object not found or incomplete: {e}"
+
+        return jsonify(finish_upload_batch(book_id, results)), 200
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/upload_audio/abort', methods=['POST'])
+@admin_required
+def api_upload_audio_abort():
+    try:
+        data = request.get_json(silent=True) or {}
+        filename = os.path.basename(data.get("filename") or "")
+        if not data.get("book_id") or not filename or not data.get("upload_id"):
+            return jsonify({"success": False, "error": "Missing book_id, filename or upload_id"}), 400
+        try:
+            book_id = int(data["book_id"])
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "error": "book_id must be an integer"}), 400
+
+        folder_name = get_book_folder(book_id)
+        if not folder_name:
+            return jsonify({"success": False, "error": "Book not found"}), 404
+
+        bz.abort_multipart_upload(Bucket=os.getenv("B2_BUCKET"), Key=f"{folder_name}/{filename}",
+                                  UploadId=data["upload_id"])
+        return jsonify({"success": True})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+######## Audio metadata ########
+AUDIO_PROBE_BYTES = 64 * 1024
+
+def probe_stored_audio(key, size):
+    """audio_meta for an object already in B2, from ranged reads of its head (None on failure)"""
+    bucket = os.getenv("B2_BUCKET")
+
+    def read_range(offset, length):
+        obj = bz.get_object(Bucket=bucket, Key=key, Range=f"bytes={offset}-{offset + length - 1}")
+        return obj['Body'].read()
+
+    try:
+        return audio_meta.probe_ranges(read_range, size, chunk_size=AUDIO_PROBE_BYTES)
+    except Exception as e:
+        print(f"❌ Could not read audio metadata of {key}: {e}")
+        return None
+
+@app.route('/api/audio-meta/backfill', methods=['POST'])
+@admin_required
+def api_audio_meta_backfill():
+    """Fill the audio columns of up to ?limit= (50) chapters without a duration, starting
+    after ?after_id=. Only the head of each file is read. Returns last_id for the next call."""
+    try:
+        limit = min(request.args.get('limit', 50, type=int), 500)
+        after_id = request.args.get('after_id', 0, type=int)
+        rows = b.universal_db_select(
+            "SELECT id, book_id, title FROM chapters WHERE duration_seconds IS NULL AND id > %s ORDER BY id LIMIT %s",
+            (after_id, limit)
+        )
+        bucket = os.getenv("B2_BUCKET")
+        updated = []
+        for row in rows:
+            folder_name = get_book_folder(row['book_id'])
+            if not folder_name:
+                continue
+            key = f"{folder_name}/{row['title']}"
+            try:
+                size = bz.head_object(Bucket=bucket, Key=key)['ContentLength']
+            except ClientError:
+                continue
+            audio = probe_stored_audio(key, size)
+            if audio:
+                updated.append((*(audio[field] for field in AUDIO_FIELDS), row['id']))
+        if updated:
+            assignments = ", ".join(f"{field} = %s" for field in AUDIO_FIELDS)
+            b.db_update(f"UPDATE chapters SET {assignments} WHERE id = %s", batch_data=updated)
+            search_index.invalidate()
+        return jsonify({
+            "success": True,
+            "checked": len(rows),
+            "updated": len(updated),
+            "last_id": rows[-1]['id'] if rows else None
+        })
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+######## Streaming upload ########
+# POST/PUT /api/upload_audio/stream?book_id=&filename=[&upload_id=] with the raw file as
+# the request body. The body is read in chunks straight into a B2 multipart upload
+# (part size/concurrency from s.upload_transfer_config()), so the file is never held
+# in memory or spooled to disk. Progress can be polled at /api/upload_audio/progress/<upload_id>.
+upload_progress = TTLCache(max_size=1000, ttl=3600)
+_upload_progress_lock = threading.Lock()
+UPLOAD_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+def upload_progress_callback(progress):
+    def callback(bytes_transferred):
+        with _upload_progress_lock:
+            progress["bytes_uploaded"] += bytes_transferred
+    return callback
+
+@app.route('/api/upload_audio/stream', methods=['POST', 'PUT'])
+def api_upload_audio_stream():
+    upload_id = request.args.get("upload_id") or uuid.uuid4().hex
+    progress = None
+    try:
+        book_id = request.args.get("book_id")
+        filename = os.path.basename(request.args.get("filename", ""))
+
+        if not book_id or not filename:
+            return jsonify({"success": False, "error": "Missing book_id or filename"}), 400
+        try:
+            book_id = int(book_id)
+        except (TypeError, ValueError):
+            book_id = 0
+        if book_id <= 0:
+            return jsonify({"success": False, "error": "book_id must be a positive integer"}), 400
+        if not UPLOAD_ID_RE.match(upload_id):
+            return jsonify({"success": False, "error": "upload_id may only contain letters, digits, - and _ (max 64)"}), 400
+        if request.content_length == 0:
+            return jsonify({"success": False, "error": "Empty upload"}), 400
+
+        chapter_number = extract_chapter_number(filename)
+        if chapter_number is None:
+            # skip inserting into chapters
+            return jsonify({
+                "success": True,
+                "file_path": filename,
+                "note": "Uploaded non-chapter audio (not saved in DB)"
+            }), 200
+
+        folder_name = get_book_folder(book_id)
+        if not folder_name:
+            return jsonify({"success": False, "error": "Book not found"}), 404
+        file_path = f"{folder_name}/{filename}"
+
+        progress = {
+            "upload_id": upload_id,
+            "file_path": file_path,
+            "total_bytes": request.content_length,
+            "bytes_uploaded": 0,
+            "status": "uploading",
+            "error": None,
+        }
+        upload_progress.set(upload_id, progress)
+
+        # On any error (including a client disconnect while reading the body)
+        # boto3 aborts the multipart upload, so no orphaned parts are left in B2
+        # The MP3 headers are parsed from the body as it passes through
+        probe = audio_meta.Mp3Probe()
+        body = s.CountingReader(request.stream, on_read=probe.feed)
+        b.release_request_connection()   # not held during the transfer
+        bz.upload_fileobj(
+            body, os.getenv("B2_BUCKET"), file_path,
+            ExtraArgs={'ContentType': request.content_type or 'audio/mpeg'},
+            Config=s.upload_transfer_config(),
+            Callback=upload_progress_callback(progress)
+        )
+
+        audio = probe.result()
+        chapter_id = register_uploaded_chapter(book_id, filename, chapter_number, body.bytes_read, audio)
+        progress["status"] = "done"
+
+        return jsonify({
+            "success": True,
+            "file_path": file_path,
+            "chapter_id": chapter_id,
+            "bytes": body.bytes_read,
+            "audio": audio,
+            "upload_id": upload_id
+        }), 200
+    except Exception as e:
+        if progress is not None:
+            progress["status"] = "failed"
+            progress["error"] = str(e)
+        return jsonify({"success": False, "error": str(e), "upload_id": upload_id}), 500
+
+@app.route('/api/upload_audio/progress/<upload_id>', methods=['GET'])
+def api_upload_audio_progress(upload_id):
+    progress = upload_progress.get(upload_id)
+    if progress is None:
+        return jsonify({"success": False, "error": "Unknown upload"}), 404
+    with _upload_progress_lock:
+        return jsonify(dict(progress, success=True))
+
 def extract_chapter_number(filename):
     """Extract chapter number from filename"""
     try:
@@ -284,6 +825,8 @@ def update_user_role(user_id):
             "UPDATE users SET role = %s WHERE id = %s",
             (new_role, user_id)
         )
+        user_cache.delete(user_id)
+        invalidate_dashboard_counters()
         
         if result:
             return jsonify({"success": True, "message": "User role updated"})
@@ -311,6 +854,8 @@ def delete_user(user_id):
         result = b.db_execute (
             "DELETE FROM users WHERE id = %s", (user_id,)
         )
+        user_cache.delete(user_id)
+        invalidate_dashboard_counters()
         
         if result:
             return jsonify({"success": True, "message": "User deleted successfully"})
@@ -324,27 +869,15 @@ def delete_user(user_id):
 @admin_required
 def get_user_analytics():
     try:
-        # Get total user count
-        total_users = b.universal_db_select("SELECT COUNT(*) as count FROM users")[0]['count']
-        
-        # Get users by role
-        role_counts = b.universal_db_select(
-            "SELECT role, COUNT(*) as count FROM users GROUP BY role"
-        )
-        
-        # Get recent signups (last 30 days)
-        recent_signups = b.universal_db_select(
-            "SELECT COUNT(*) as count FROM users WHERE created_at >= DATE_SUB(NOW(), INTERVAL 30 DAY)"
-        )[0]['count']
-        
-        # Convert role counts to dictionary
-        role_dict = {item['role']: item['count'] for item in role_counts}
+        counters = get_dashboard_counters()
+        if counters is None:
+            return jsonify({"success": False, "error": "Database unavailable"}), 500
         
         analytics = {
-            'total_users': total_users,
-            'admin_count': role_dict.get('admin', 0),
-            'member_count': role_dict.get('member', 0),
-            'recent_signups': recent_signups
+            'total_users': counters['total_users'],
+            'admin_count': counters['admin_count'],
+            'member_count': counters['member_count'],
+            'recent_signups': counters['recent_signups']
         }
         
         return jsonify({
@@ -358,13 +891,79 @@ def get_user_analytics():
 ###################
 
 
+######## Dashboard counters ########
+# All dashboard counts come from one query and are cached for DASHBOARD_STATS_TTL
+# seconds (default 60). Write paths in this worker adjust the cached numbers
+# (bump_dashboard_counters) or drop them (invalidate_dashboard_counters).
+if DB_TYPE == "postgresql":
+    RECENT_SIGNUP_CONDITION = "created_at >= NOW() - INTERVAL '30 days'"
+else:
+    RECENT_SIGNUP_CONDITION = "created_at >= DATE_SUB(NOW(), INTERVAL 30 DAY)"
+
+DASHBOARD_COUNTERS_QUERY = f"""
+    SELECT
+        (SELECT COUNT(*) FROM books) as total_books,
+        (SELECT COUNT(*) FROM chapters) as total_chapters,
+        (SELECT COUNT(*) FROM users) as total_users,
+        (SELECT COUNT(*) FROM users WHERE role = 'admin') as admin_count,
+        (SELECT COUNT(*) FROM users WHERE role = 'member') as member_count,
+        (SELECT COUNT(*) FROM users WHERE {RECENT_SIGNUP_CONDITION}) as recent_signups
+"""
+
+dashboard_counters_cache = TTLCache(max_size=1, ttl=float(os.getenv('DASHBOARD_STATS_TTL', '60')))
+_dashboard_counters_lock = threading.Lock()
+
+def get_dashboard_counters():
+    """Dict of dashboard counts, or None if the database could not be queried"""
+    with _dashboard_counters_lock:
+        counters = dashboard_counters_cache.get('counters')
+        if counters is None:
+            rows = b.universal_db_select(DASHBOARD_COUNTERS_QUERY)
+            if not rows:
+                return None
+            counters = {name: int(value or 0) for name, value in rows[0].items()}
+            dashboard_counters_cache.set('counters', counters)
+        return dict(counters)
+
+def bump_dashboard_counters(**deltas):
+    with _dashboard_counters_lock:
+        counters = dashboard_counters_cache.get('counters')
+        if counters is not None:
+            for name, delta in deltas.items():
+                counters[name] += delta
+
+def invalidate_dashboard_counters():
+    dashboard_counters_cache.delete('counters')
+
+
+@app.route("/api/dashboard-stats", methods=["GET"])
+@admin_required
+def api_dashboard_stats():
+    """All admin dashboard counters and health checks in one call"""
+    try:
+        counters = get_dashboard_counters()
+        return jsonify({
+            "success": True,
+            "counts": counters or {},
+            # A live check - the counters may come from the cache
+            "database_connected": check_database_status(),
+            "backblaze_connected": bool(bz)
+        })
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+def counter_response(name):
+    counters = get_dashboard_counters()
+    if counters is None:
+        return jsonify({"success": False, "error": "Database unavailable"}), 500
+    return jsonify({"success": True, "count": counters[name]})
+
 ###################
 @app.route("/api/get-total-books", methods=["GET"])
 def api_get_total_books():
     try:
-        result = b.universal_db_select("SELECT COUNT(1) as count FROM books")
-        count = result[0]['count'] if result else 0
-        return jsonify({"success": True, "count": count})
+        return counter_response('total_books')
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 ###################
@@ -373,9 +972,7 @@ def api_get_total_books():
 @app.route("/api/get-total-users", methods=["GET"])
 def api_get_total_users():
     try:
-        result = b.universal_db_select("SELECT COUNT(1) as count FROM users")
-        count = result[0]['count'] if result else 0
-        return jsonify({"success": True, "count": count})
+        return counter_response('total_users')
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 ###################
@@ -383,9 +980,7 @@ def api_get_total_users():
 @app.route("/api/get-total-chapters", methods=["GET"])
 def api_get_total_chapters():
     try:
-        result = b.universal_db_select("SELECT COUNT(1) as count FROM chapters")
-        count = result[0]['count'] if result else 0
-        return jsonify({"success": True, "count": count})
+        return counter_response('total_chapters')
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
@@ -395,7 +990,7 @@ def api_get_total_chapters():
 def check_database_status():
     try:
         result = b.universal_db_select("SELECT 1 as test")
-        return result is not None
+        return bool(result)   # [] when the query failed
     except:
         return False
     
@@ -422,22 +1017,14 @@ def api_get_storage_usage():
         if not s3 or not bucket_name:
             return jsonify({"success": False, "error": "Storage not configured"}), 500
 
-        total_size = 0
-        continuation_token = None
-
-        while True:
-            if continuation_token:
-                resp = s3.list_objects_v2(Bucket=bucket_name, ContinuationToken=continuation_token)
-            else:
-                resp = s3.list_objects_v2(Bucket=bucket_name)
-
-            for obj in resp.get("Contents", []):
-                total_size += obj["Size"]
-
-            if resp.get("IsTruncated"):
-                continuation_token = resp.get("NextContinuationToken")
-            else:
-                break
+        # Answer from the storage ledger; fall back to listing the bucket if it is not migrated
+        usage = storage_ledger.get_usage()
+        if usage is not None:
+            total_size = usage["bytes"]
+            if storage_ledger.reconcile_due(usage):
+                storage_ledger.start_reconcile(s3, bucket_name)
+        else:
+            total_size = sum(size for size, _ in s.bucket_usage_by_folder(s3, bucket_name).values())
 
         quota_gb = float(os.getenv("B2_STORAGE_QUOTA_GB", "10"))
         used_gb = round(total_size / (1024**3), 2)
@@ -447,36 +1034,86 @@ def api_get_storage_usage():
             "success": True,
             "used_gb": used_gb,
             "quota_gb": quota_gb,
-            "usage_ratio": usage_ratio
+            "usage_ratio": usage_ratio,
+            "source": "ledger" if usage is not None else "bucket_listing",
+            "objects": usage["objects"] if usage is not None else None,
+            "reconciled_at": usage["reconciled_at"] if usage is not None else None,
+            "reconcile": storage_ledger.reconcile_status()
         })
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route("/api/storage-usage/reconcile", methods=["POST"])
+@admin_required
+def api_reconcile_storage_usage():
+    """Re-scan the bucket in the background and reset the storage ledger"""
+    bucket_name = os.getenv("B2_BUCKET")
+    if not bz or not bucket_name:
+        return jsonify({"success": False, "error": "Storage not configured"}), 500
+    started = storage_ledger.start_reconcile(bz, bucket_name)
+    return jsonify({
+        "success": True,
+        "started": started,
+        "message": "Reconciliation started" if started else "Reconciliation already running"
+    }), 202
 ################### admin_dashboard.py
 
 
+def get_book_folder(book_id):
+    """'<title> By <author>' folder of a book in the bucket (cached), None if the book does not exist"""
+    folder_name = book_folder_cache.get(book_id)
+    if folder_name is None:
+        book_result = b.universal_db_select("SELECT title, author FROM books WHERE id = %s", (book_id,))
+        if not book_result or len(book_result) == 0:
+            return None
+        book = book_result[0]
+        folder_name = f"{book['title']} By {book['author']}"
+        book_folder_cache.set(book_id, folder_name)
+    return folder_name
+
 @app.route('/api/audio-url/<int:book_id>/<path:chapter_title>')
 def get_audio_url(book_id, chapter_title):
     try:
-        book_result = b.universal_db_select("SELECT title, author FROM books WHERE id = %s", (book_id,))
-        if not book_result or len(book_result) == 0:
+        folder_name = get_book_folder(book_id)
+        if not folder_name:
             return jsonify({"error": "Book not found"}), 404
-        
-        book = book_result[0]
 
-        folder_name = f"{book['title']} By {book['author']}"
         file_path = f"{folder_name}/{chapter_title}"
 
         import urllib.parse
         file_path = urllib.parse.unquote(file_path)
 
-        signed_url = generate_signed_url(
+        # ?download=1[&filename=...] signs the URL with Content-Disposition: attachment,
+        # so the browser downloads straight from B2
+        download_name = None
+        if request.args.get('download'):
+            download_name = request.args.get('filename') or os.path.basename(file_path)
+
+        # Lower bitrate rendition for ?quality=/?kbps= or the Save-Data/ECT hints
+        rendition = None
+        kbps = requested_kbps()
+        if kbps:
+            rendition = choose_rendition(get_chapter_renditions(book_id, urllib.parse.unquote(chapter_title)), kbps)
+            if rendition:
+                file_path = rendition['object_key']
+
+        signed_url, expires_in = get_signed_url(
             os.getenv('B2_BUCKET'),
             file_path,
-            expiration=3600  # 1 hour expiry
+            expiration=3600,  # 1 hour expiry
+            download_name=download_name
         )
         
         if signed_url:
-            return jsonify({"url": signed_url})
+            response = jsonify({
+                "url": signed_url,
+                "expires_in": expires_in,
+                "kbps": rendition['kbps'] if rendition else None,
+                "size": rendition['size_bytes'] if rendition else None
+            })
+            response.headers['Accept-CH'] = 'Save-Data, ECT'
+            response.headers['Vary'] = 'Save-Data, ECT'
+            return response
         else:
             return jsonify({"error": "Failed to generate audio URL"}), 500
             
@@ -485,6 +1122,504 @@ def get_audio_url(book_id, chapter_title):
 
 
 
+######## Audio streaming proxy ########
+# AUDIO_STREAM_PROXY=true enables GET /api/stream/<chapter_id>: the chapter is read
+# from B2 with get_object(Range=...) and passed through in STREAM_CHUNK_SIZE chunks
+# (default 64 KiB), never held in memory as a whole. Supports Range (single range),
+# If-Range, If-None-Match and ETags, so players can seek with small range fetches.
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', str(64 * 1024)))
+chapter_key_cache = TTLCache(max_size=int(os.getenv('CHAPTER_KEY_CACHE_SIZE', '5000')), ttl=300)
+
+def get_chapter_key(chapter_id):
+    """Bucket key of a chapter's audio (cached), None if the chapter does not exist"""
+    key = chapter_key_cache.get(chapter_id)
+    if key is None:
+        rows = b.universal_db_select("SELECT book_id, title FROM chapters WHERE id = %s", (chapter_id,))
+        if not rows:
+            return None
+        folder_name = get_book_folder(rows[0]['book_id'])
+        if not folder_name:
+            return None
+        key = f"{folder_name}/{rows[0]['title']}"
+        chapter_key_cache.set(chapter_id, key)
+    return key
+
+######## Disk cache ########
+# AUDIO_DISK_CACHE_DIR              - enable the local disk tier for chapter audio
+# AUDIO_DISK_CACHE_MB (1024)        - byte budget (LRU eviction)
+# AUDIO_DISK_CACHE_MAX_OBJECT_MB    - larger objects are not cached (default: a quarter of the budget)
+# AUDIO_DISK_CACHE_REVALIDATE_SECONDS (60) - an entry's ETag is re-checked with a HEAD to B2
+#                                     once it is this old, so other workers' copies expire too
+# A miss is served from B2 as usual while a background fill copies the object to disk.
+disk_cache = None
+if os.getenv('AUDIO_DISK_CACHE_DIR'):
+    disk_cache = DiskCache(
+        os.getenv('AUDIO_DISK_CACHE_DIR'),
+        max_bytes=int(float(os.getenv('AUDIO_DISK_CACHE_MB', '1024')) * 1024 * 1024),
+        max_object_bytes=int(float(os.getenv('AUDIO_DISK_CACHE_MAX_OBJECT_MB', '0')) * 1024 * 1024) or None,
+        revalidate_seconds=float(os.getenv('AUDIO_DISK_CACHE_REVALIDATE_SECONDS', '60')),
+    )
+
+def fetch_for_disk_cache(key):
+    obj = bz.get_object(Bucket=os.getenv('B2_BUCKET'), Key=key)
+    last_modified = obj['LastModified'].timestamp() if obj.get('LastModified') else None
+    return stream_body(obj['Body']), obj.get('ETag'), last_modified
+
+def current_b2_etag(key):
+    """ETag of the object in B2, None if it is gone"""
+    try:
+        return bz.head_object(Bucket=os.getenv('B2_BUCKET'), Key=key).get('ETag')
+    except ClientError as e:
+        if error_status(e) == 404:
+            return None
+        raise
+
+def forget_cached_audio(book_id, filenames):
+    """Drop re-uploaded chapters from this worker's disk cache (other workers notice
+    on their next revalidation)"""
+    if disk_cache is None:
+        return
+    folder_name = get_book_folder(book_id)
+    for filename in filenames:
+        disk_cache.delete(f"{folder_name}/{filename}")
+
+def send_cached_audio(entry, download_name=None):
+    """Serve a disk cache entry; Range/If-Range/If-None-Match are handled by send_file"""
+    response = send_file(
+        entry['path'],
+        mimetype='audio/mpeg',
+        conditional=True,
+        etag=(entry['etag'] or '').strip('"') or False,
+        last_modified=entry['last_modified'],
+        max_age=3600,
+        as_attachment=download_name is not None,
+        download_name=download_name
+    )
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    if response.status_code != 304:
+        disk_cache.record_served(response.content_length or 0)
+    return response
+
+def stream_body(body):
+    try:
+        for chunk in body.iter_chunks(STREAM_CHUNK_SIZE):
+            yield chunk
+    finally:
+        body.close()
+
+def error_status(error):
+    return error.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+
+@app.route('/api/stream/<int:chapter_id>', methods=['GET'])
+def stream_chapter(chapter_id):
+    if os.getenv('AUDIO_STREAM_PROXY', 'false').lower() != 'true':
+        return jsonify({"error": "Streaming proxy disabled"}), 404
+    try:
+        key = get_chapter_key(chapter_id)
+        if not key:
+            return jsonify({"error": "Chapter not found"}), 404
+        # The response streams for as long as the client listens - give the DB connection back now
+        b.release_request_connection()
+
+        # ?download=1[&filename=] sends the chapter as an attachment
+        download_name = None
+        if request.args.get('download'):
+            download_name = request.args.get('filename') or os.path.basename(key)
+
+        if disk_cache is not None:
+            cached = disk_cache.get(key, lambda: current_b2_etag(key))
+            if cached:
+                try:
+                    return send_cached_audio(cached, download_name)
+                except FileNotFoundError:
+                    pass   # evicted by another worker just now - serve from B2
+            disk_cache.prefetch(key, lambda: fetch_for_disk_cache(key))
+
+        params = {'Bucket': os.getenv('B2_BUCKET'), 'Key': key}
+        if request.headers.get('If-None-Match'):
+            params['IfNoneMatch'] = request.headers['If-None-Match']
+
+        # Only a single byte range is supported; anything else gets the whole file
+        byte_range = request.range
+        if byte_range and byte_range.units == 'bytes' and len(byte_range.ranges) == 1:
+            params['Range'] = request.headers['Range']
+            # If-Range: the range only applies while the object is unchanged. A weak ETag
+            # (or an unparsable date) never matches there, so the full file is sent
+            if_range = request.headers.get('If-Range')
+            if if_range:
+                if if_range.startswith('"'):
+                    params['IfMatch'] = if_range
+                elif not if_range.startswith('W/') and request.if_range.date:
+                    params['IfUnmodifiedSince'] = request.if_range.date
+                else:
+                    del params['Range']
+
+        try:
+            obj = bz.get_object(**params)
+        except ClientError as e:
+            status = error_status(e)
+            if status == 304:
+                headers = {'ETag': e.response.get('Error', {}).get('ETag') or request.headers['If-None-Match']}
+                return Response(status=304, headers=headers)
+            if status == 412 and 'Range' in params:
+                # If-Range did not match - send the current object in full
+                for name in ('Range', 'IfMatch', 'IfUnmodifiedSince'):
+                    params.pop(name, None)
+                obj = bz.get_object(**params)
+            elif status == 416:
+                size = bz.head_object(Bucket=params['Bucket'], Key=key)['ContentLength']
+                return Response(status=416, headers={'Content-Range': f"bytes */{size}"})
+            elif status == 404:
+                return jsonify({"error": "Audio file not found"}), 404
+            else:
+                raise
+
+        headers = {
+            'Accept-Ranges': 'bytes',
+            'Content-Length': str(obj['ContentLength']),
+            'ETag': obj.get('ETag', ''),
+            'Cache-Control': 'private, max-age=3600',
+        }
+        if obj.get('LastModified'):
+            headers['Last-Modified'] = obj['LastModified'].strftime('%a, %d %b %Y %H:%M:%S GMT')
+        if download_name:
+            safe_name = re.sub(r'[^\w.\- ]', '_', download_name, flags=re.ASCII)
+            headers['Content-Disposition'] = f'attachment; filename="{safe_name}"'
+        status = 200
+        if obj.get('ContentRange'):
+            headers['Content-Range'] = obj['ContentRange']
+            status = 206
+
+        return Response(stream_body(obj['Body']), status=status, headers=headers,
+                        mimetype=obj.get('ContentType') or 'audio/mpeg', direct_passthrough=True)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+######## HLS ########
+# HLS_SEGMENTING=true (and ffmpeg installed) segments every uploaded chapter in the
+# background - see media.py. HLS_WORKERS (2) jobs run at a time, HLS_SEGMENT_SECONDS (6).
+# chapters.hls_playlist holds the playlist key once the segments are in B2, and
+# GET /api/hls/<chapter_id>/index.m3u8 serves it with signed segment URLs.
+# The signed playlist is cached per chapter (hls_signed_playlist_cache), so the
+# segment URLs never go through signed_url_cache and cannot evict the play URLs.
+HLS_URL_EXPIRATION = int(os.getenv('HLS_URL_EXPIRATION', '3600'))
+hls_playlist_cache = TTLCache(max_size=int(os.getenv('HLS_PLAYLIST_CACHE_SIZE', '1000')), ttl=300)
+hls_signed_playlist_cache = TTLCache(max_size=int(os.getenv('HLS_PLAYLIST_CACHE_SIZE', '1000')))
+
+def on_hls_ready(chapter_id, playlist_key, bytes_added, objects_added):
+    b.db_update("UPDATE chapters SET hls_playlist = %s WHERE id = %s", (playlist_key, chapter_id))
+    hls_playlist_cache.delete(chapter_id)
+    hls_signed_playlist_cache.delete(chapter_id)
+    rows = b.universal_db_select("SELECT book_id FROM chapters WHERE id = %s", (chapter_id,))
+    if rows and (bytes_added or objects_added):
+        storage_ledger.record_upload(rows[0]['book_id'], bytes_added, objects=objects_added)
+
+hls_segmenter = None
+if os.getenv('HLS_SEGMENTING', 'false').lower() == 'true':
+    if media.ffmpeg_path():
+        hls_segmenter = media.HlsSegmenter(
+            bz, os.getenv('B2_BUCKET'), on_hls_ready,
+            workers=int(os.getenv('HLS_WORKERS', '2')),
+            segment_seconds=int(os.getenv('HLS_SEGMENT_SECONDS', '6'))
+        )
+    else:
+        print("❌ HLS_SEGMENTING is enabled but ffmpeg was not found")
+
+def get_hls_playlist(chapter_id):
+    """(playlist key, playlist text) of a chapter (cached), None if it has not been segmented"""
+    playlist = hls_playlist_cache.get(chapter_id)
+    if playlist is None:
+        rows = b.universal_db_select("SELECT hls_playlist FROM chapters WHERE id = %s", (chapter_id,))
+        if not rows or not rows[0]['hls_playlist']:
+            return None
+        playlist_key = rows[0]['hls_playlist']
+        obj = bz.get_object(Bucket=os.getenv('B2_BUCKET'), Key=playlist_key)
+        playlist = (playlist_key, obj['Body'].read().decode('utf-8'))
+        hls_playlist_cache.set(chapter_id, playlist)
+    return playlist
+
+@app.route('/api/hls/<int:chapter_id>/index.m3u8', methods=['GET'])
+def hls_chapter_playlist(chapter_id):
+    try:
+        cached = hls_signed_playlist_cache.get(chapter_id)
+        if cached:
+            body, expires_at = cached
+        else:
+            playlist = get_hls_playlist(chapter_id)
+            if not playlist:
+                return jsonify({"error": "HLS playlist not available for this chapter"}), 404
+            playlist_key, text = playlist
+
+            bucket = os.getenv('B2_BUCKET')
+            base = playlist_key.rsplit('/', 1)[0] + '/'
+
+            def sign(uri):
+                url = generate_signed_url(bucket, base + uri, expiration=HLS_URL_EXPIRATION)
+                if not url:
+                    raise RuntimeError(f"Failed to sign {uri}")
+                return url
+
+            expires_at = time.time() + HLS_URL_EXPIRATION
+            body = media.rewrite_playlist(text, sign)
+            min_remaining = float(os.getenv('SIGNED_URL_MIN_REMAINING', '0.5'))
+            hls_signed_playlist_cache.set(chapter_id, (body, expires_at), ttl=HLS_URL_EXPIRATION * (1 - min_remaining))
+
+        # Clients must not reuse the playlist after its segment URLs expire
+        max_age = max(int(expires_at - time.time()) - 60, 0)
+        return Response(body, mimetype='application/vnd.apple.mpegurl',
+                        headers={'Cache-Control': f'private, max-age={max_age}'})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+######## Renditions ########
+# TRANSCODING=true (and ffmpeg installed) encodes every uploaded chapter at
+# TRANSCODE_BITRATES kbps (32,64,128) in the background - see media.Transcoder.
+# TRANSCODE_WORKERS (2) ffmpeg processes run at a time. The renditions are listed in
+# chapter_renditions, and /api/audio-url picks one from the client's hints.
+if DB_TYPE == 'postgresql':
+    RENDITIONS_UPSERT = """
+        INSERT INTO chapter_renditions (chapter_id, kbps, object_key, size_bytes) VALUES %s
+        ON CONFLICT (chapter_id, kbps) DO UPDATE SET object_key = EXCLUDED.object_key,
+                                                     size_bytes = EXCLUDED.size_bytes,
+                                                     created_at = CURRENT_TIMESTAMP
+    """
+    RENDITIONS_TEMPLATE = "(%s, %s, %s, %s)"
+else:
+    RENDITIONS_UPSERT = """
+        INSERT INTO chapter_renditions (chapter_id, kbps, object_key, size_bytes) VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE object_key = VALUES(object_key),
+                                size_bytes = VALUES(size_bytes),
+                                created_at = CURRENT_TIMESTAMP
+    """
+    RENDITIONS_TEMPLATE = None
+
+rendition_cache = TTLCache(max_size=int(os.getenv('RENDITION_CACHE_SIZE', '5000')), ttl=300)
+
+def on_renditions_ready(chapter_id, renditions):
+    # A re-run overwrites the same keys - only the change in size goes to the ledger.
+    # Bitrates not produced this time (dropped from TRANSCODE_BITRATES, or no longer
+    # smaller than the original) are removed from the table, B2 and the ledger.
+    previous = {row['kbps']: row for row in b.universal_db_select(
+        "SELECT kbps, object_key, size_bytes FROM chapter_renditions WHERE chapter_id = %s", (chapter_id,))}
+    if renditions:
+        b.db_update(RENDITIONS_UPSERT, values_template=RENDITIONS_TEMPLATE,
+                    batch_data=[(chapter_id, kbps, key, size) for kbps, key, size in renditions])
+
+    produced = {kbps for kbps, _, _ in renditions}
+    stale = [row for kbps, row in previous.items() if kbps not in produced]
+    deleted = []
+    if stale:
+        placeholders = ", ".join(["%s"] * len(stale))
+        b.db_update(f"DELETE FROM chapter_renditions WHERE chapter_id = %s AND kbps IN ({placeholders})",
+                    (chapter_id, *[row['kbps'] for row in stale]))
+        try:
+            bz.delete_objects(Bucket=os.getenv('B2_BUCKET'), Delete={
+                'Objects': [{'Key': row['object_key']} for row in stale],
+                'Quiet': True,
+            })
+            deleted = stale
+        except Exception as e:
+            # The objects stay in the ledger until the next reconcile finds them
+            print(f"❌ Could not delete old renditions of chapter {chapter_id}: {e}")
+
+    rows = b.universal_db_select("SELECT book_id, title FROM chapters WHERE id = %s", (chapter_id,))
+    if rows:
+        rendition_cache.delete((rows[0]['book_id'], rows[0]['title']))
+        added = [(kbps, size) for kbps, _, size in renditions]
+        bytes_added = sum(size - ((previous[kbps]['size_bytes'] or 0) if kbps in previous else 0) for kbps, size in added)
+        objects_added = sum(1 for kbps, _ in added if kbps not in previous)
+        if bytes_added or objects_added:
+            storage_ledger.record_upload(rows[0]['book_id'], bytes_added, objects=objects_added)
+        if deleted:
+            storage_ledger.record_delete(rows[0]['book_id'], sum(row['size_bytes'] or 0 for row in deleted),
+                                         objects=len(deleted))
+
+transcoder = None
+if os.getenv('TRANSCODING', 'false').lower() == 'true':
+    if media.ffmpeg_path():
+        transcoder = media.Transcoder(
+            bz, os.getenv('B2_BUCKET'), on_renditions_ready,
+            bitrates=[int(kbps) for kbps in os.getenv('TRANSCODE_BITRATES', '32,64,128').split(',') if kbps.strip()],
+            workers=int(os.getenv('TRANSCODE_WORKERS', '2'))
+        )
+    else:
+        print("❌ TRANSCODING is enabled but ffmpeg was not found")
+
+def get_chapter_renditions(book_id, title):
+    """[{kbps, object_key, size_bytes}] of a chapter, lowest bitrate first (cached)"""
+    renditions = rendition_cache.get((book_id, title))
+    if renditions is None:
+        renditions = b.universal_db_select("""
+            SELECT r.kbps, r.object_key, r.size_bytes
+            FROM chapter_renditions r
+            JOIN chapters c ON c.id = r.chapter_id
+            WHERE c.book_id = %s AND c.title = %s
+            ORDER BY r.kbps
+        """, (book_id, title))
+        rendition_cache.set((book_id, title), renditions)
+    return renditions
+
+QUALITY_KBPS = {'low': 32, 'medium': 64, 'high': 128}
+ECT_KBPS = {'slow-2g': 32, '2g': 32, '3g': 64}   # 4g gets the original
+
+def requested_kbps():
+    """Target bitrate from ?quality=low|medium|high|original, ?kbps= or the
+    Save-Data / ECT client hints; None means the original upload"""
+    quality = request.args.get('quality', '').lower()
+    if quality in QUALITY_KBPS or quality == 'original':
+        return QUALITY_KBPS.get(quality)
+    kbps = request.args.get('kbps', type=int)
+    if kbps:
+        return kbps
+    if request.headers.get('Save-Data', '').lower() == 'on':
+        return QUALITY_KBPS['low']
+    return ECT_KBPS.get(request.headers.get('ECT', '').lower())
+
+def choose_rendition(renditions, kbps):
+    """Highest rendition at or below kbps, else the lowest one; None if there are none"""
+    if not renditions:
+        return None
+    below = [r for r in renditions if r['kbps'] <= kbps]
+    return below[-1] if below else renditions[0]
+
+
+######## Media jobs ########
+def queue_media_jobs(book_id, chapter_ids):
+    """Queue {filename: chapter id} of a book for HLS segmenting and transcoding (when enabled)"""
+    if hls_segmenter is None and transcoder is None:
+        return
+    folder_name = get_book_folder(book_id)
+    for filename, chapter_id in chapter_ids.items():
+        if folder_name and chapter_id:
+            for jobs in (hls_segmenter, transcoder):
+                if jobs is not None:
+                    jobs.submit(chapter_id, f"{folder_name}/{filename}")
+
+
+def backfill_media_jobs(jobs, condition):
+    """Queue up to ?limit= (50) chapters matching condition on jobs"""
+    try:
+        if jobs is None:
+            return jsonify({"success": False, "error": "This media job is disabled"}), 400
+        limit = min(request.args.get('limit', 50, type=int), 1000)
+        rows = b.universal_db_select(
+            f"SELECT c.id, c.book_id, c.title FROM chapters c WHERE {condition} ORDER BY c.id LIMIT %s",
+            (limit,)
+        )
+        queued = 0
+        for row in rows:
+            folder_name = get_book_folder(row['book_id'])
+            if folder_name and jobs.submit(row['id'], f"{folder_name}/{row['title']}"):
+                queued += 1
+        return jsonify({"success": True, "queued": queued})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/hls/backfill', methods=['POST'])
+@admin_required
+def api_hls_backfill():
+    """Queue chapters that have no HLS playlist yet"""
+    return backfill_media_jobs(hls_segmenter, "c.hls_playlist IS NULL")
+
+@app.route('/api/renditions/backfill', methods=['POST'])
+@admin_required
+def api_renditions_backfill():
+    """Queue chapters that have no renditions yet"""
+    return backfill_media_jobs(
+        transcoder, "NOT EXISTS (SELECT 1 FROM chapter_renditions r WHERE r.chapter_id = c.id)"
+    )
+
+
+###################
+@app.route('/api/metrics', methods=['GET'])
+@admin_required
+def api_metrics():
+    """Runtime metrics for the API process"""
+    return jsonify({
+        "success": True,
+        "db_pool": b.pool_stats(),
+        "catalogue_index": search_index.stats(),
+        "signed_url_cache": signed_url_cache.stats(),
+        "book_folder_cache": book_folder_cache.stats(),
+        "chapter_key_cache": chapter_key_cache.stats(),
+        "disk_cache": disk_cache.stats() if disk_cache is not None else {"enabled": False},
+        "hls_segmenter": hls_segmenter.stats() if hls_segmenter is not None else {"enabled": False},
+        "hls_playlist_cache": hls_playlist_cache.stats(),
+        "hls_signed_playlist_cache": hls_signed_playlist_cache.stats(),
+        "transcoder": transcoder.stats() if transcoder is not None else {"enabled": False},
+        "rendition_cache": rendition_cache.stats(),
+        "user_cache": user_cache.stats(),
+        "dashboard_counters_cache": dashboard_counters_cache.stats(),
+        "playback_buffer": playback_buffer.stats() if playback_buffer is not None else {"enabled": False}
+    })
+###################
+
+@app.route('/api/books/<int:book_id>/audio-urls', methods=['GET', 'POST'])
+def get_book_audio_urls(book_id):
+    """Signed URLs for all chapters of a book (or the chapters listed in chapter_ids) in one call"""
+    try:
+        if request.method == 'POST':
+            chapter_ids = (request.get_json(silent=True) or {}).get('chapter_ids')
+        else:
+            raw_ids = request.args.get('chapter_ids', '')
+            chapter_ids = [part for part in raw_ids.split(',') if part.strip()] or None
+        try:
+            chapter_ids = [int(chapter_id) for chapter_id in chapter_ids] if chapter_ids else None
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "error": "chapter_ids must be a list of integers"}), 400
+
+        folder_name = get_book_folder(book_id)
+        if not folder_name:
+            return jsonify({"success": False, "error": "Book not found"}), 404
+
+        query = "SELECT id, title, chapter_number FROM chapters WHERE book_id = %s"
+        params = [book_id]
+        if chapter_ids:
+            query += f" AND id IN ({', '.join(['%s'] * len(chapter_ids))})"
+            params.extend(chapter_ids)
+        query += " ORDER BY chapter_number"
+        chapters = b.universal_db_select(query, tuple(params))
+
+        # ?quality= / client hints pick a lower bitrate rendition, as in /api/audio-url
+        kbps = requested_kbps()
+        renditions = {}
+        if kbps and chapters:
+            rows = b.universal_db_select("""
+                SELECT r.chapter_id, r.kbps, r.object_key, r.size_bytes
+                FROM chapter_renditions r
+                JOIN chapters c ON c.id = r.chapter_id
+                WHERE c.book_id = %s
+                ORDER BY r.kbps
+            """, (book_id,))
+            for row in rows:
+                renditions.setdefault(row['chapter_id'], []).append(row)
+
+        bucket = os.getenv('B2_BUCKET')
+        urls = []
+        for chapter in chapters:
+            rendition = choose_rendition(renditions.get(chapter['id']), kbps) if kbps else None
+            key = rendition['object_key'] if rendition else f"{folder_name}/{chapter['title']}"
+            signed_url, expires_in = get_signed_url(bucket, key, expiration=3600)
+            urls.append({
+                "chapter_id": chapter['id'],
+                "chapter_number": chapter['chapter_number'],
+                "title": chapter['title'],
+                "url": signed_url,
+                "expires_in": expires_in,
+                "kbps": rendition['kbps'] if rendition else None
+            })
+
+        response = jsonify({"success": True, "book_id": book_id, "urls": urls})
+        response.headers['Accept-CH'] = 'Save-Data, ECT'
+        response.headers['Vary'] = 'Save-Data, ECT'
+        return response
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
 @app.route('/health')
 def health():
     return jsonify({"status": "healthy", "db": "ok" if b.MySQL_db() else "down"})
@@ -584,46 +1719,56 @@ def api_register():
         
         hashed_password = hashlib.sha256(password.encode()).hexdigest()
         
-        # Check for duplicates
-        email_check = b.universal_db_select("SELECT id FROM users WHERE email = %s", (email,))
-        if email_check and len(email_check) > 0:
-            return jsonify({"success": False, "error": "Email already exists"}), 409
-        
-        if membership_number:
-            member_check = b.universal_db_select("SELECT id FROM users WHERE membership_number = %s", (membership_number,))
-            if member_check and len(member_check) > 0:
-                return jsonify({"success": False, "error": "Membership number already exists"}), 409
-        
-        # Insert user (works for both databases)
-        insert_query = """
-            INSERT INTO users (name, email, password, membership_number, role)
-            VALUES (%s, %s, %s, %s, %s)
-        """
-        # -- VALUES (%s, %s, %s, %s, 'member')
+        # Duplicate checks, insert and read-back share one connection and transaction
+        try:
+            with b.transaction():
+                # Check for duplicates
+                email_check = b.universal_db_select("SELECT id FROM users WHERE email = %s", (email,))
+                if email_check and len(email_check) > 0:
+                    return jsonify({"success": False, "error": "Email already exists"}), 409
+            
+                if membership_number:
+                    member_check = b.universal_db_select("SELECT id FROM users WHERE membership_number = %s", (membership_number,))
+                    if member_check and len(member_check) > 0:
+                        return jsonify({"success": False, "error": "Membership number already exists"}), 409
+            
+                # Insert user (works for both databases)
+                insert_query = """
+                    INSERT INTO users (name, email, password, membership_number, role)
+                    VALUES (%s, %s, %s, %s, %s)
+                """
+                # -- VALUES (%s, %s, %s, %s, 'member')
 
-        insert_result = b.db_insert(insert_query, (name, email, hashed_password, membership_number or None, role))
-        
-        # Check if insert was successful
-        if insert_result is None or insert_result <= 0:
-            return jsonify({"success": False, "error": "Registration failed - duplicate entry or database error"}), 409
-        
-        # Get the newly created user by email (most reliable method)
-        new_user = b.universal_db_select(
-            "SELECT id, name, email, role, membership_number FROM users WHERE email = %s", 
-            (email,)
-        )
-        
-        if not new_user or len(new_user) == 0:
-            # If query by email fails, try a broader search
-            new_user = b.universal_db_select(
-                "SELECT id, name, email, role, membership_number FROM users WHERE email = %s OR name = %s ORDER BY id DESC LIMIT 1", 
-                (email, name)
-            )
+                insert_result = b.db_insert(insert_query, (name, email, hashed_password, membership_number or None, role))
             
+                # Check if insert was successful
+                if insert_result is None or insert_result <= 0:
+                    return jsonify({"success": False, "error": "Registration failed - duplicate entry or database error"}), 409
+            
+                # Get the newly created user by email (most reliable method)
+                new_user = b.universal_db_select(
+                    "SELECT id, name, email, role, membership_number FROM users WHERE email = %s", 
+                    (email,)
+                )
+            
+                if not new_user or len(new_user) == 0:
+                    # If query by email fails, try a broader search
+                    new_user = b.universal_db_select(
+                        "SELECT id, name, email, role, membership_number FROM users WHERE email = %s OR name = %s ORDER BY id DESC LIMIT 1", 
+                        (email, name)
+                    )
+        except b.TransactionFailed:
+            # The insert failed (e.g. the same email registered concurrently) and was rolled back
+            return jsonify({"success": False, "error": "Registration failed - duplicate entry or database error"}), 409
+
         if not new_user or len(new_user) == 0:
             return jsonify({"success": False, "error": "User created but could not be retrieved from database"}), 500
         
         user_data = new_user[0]
+        if user_data.get('role') in ('admin', 'member'):
+            bump_dashboard_counters(total_users=1, recent_signups=1, **{f"{user_data['role']}_count": 1})
+        else:
+            invalidate_dashboard_counters()
         
         from datetime import datetime, timezone, timedelta
         
@@ -648,73 +1793,73 @@ def api_register():
         return jsonify({"success": False, "error": f"Registration failed: {str(e)}"}), 500
     
 
+######## GET /books ########
+# Pages are built in two phases: first the page of books (LIMIT applies to books,
+# not to joined chapter rows), then all chapters of those books in one query.
+BOOK_COLUMNS = """
+    b.id as book_id,
+    b.title as book_title,
+    b.author,
+    b.category_id,
+    cat.name as category_name
+"""
+
+# PostgreSQL search: books.search_vector (title, author, category name - kept up to
+# date by a trigger) matched with a prefix tsquery, plus pg_trgm word similarity on
+# title/author for typos. Columns, triggers and GIN indexes come from migrations.py.
+POSTGRES_SEARCH_WHERE = """
+    b.search_vector @@ to_tsquery('simple', %s)
+    OR %s <%% b.title::text
+    OR %s <%% b.author::text
+"""
+
+def postgres_tsquery(search_term):
+    """Search box text -> prefix tsquery, e.g. 'harry pot' -> 'harry:* & pot:*'"""
+    # Split on whitespace and tsquery operators; keeps non-latin words intact
+    tokens = re.findall(r"[^\s&|!():*<>'\\]+", search_term.lower())
+    return ' & '.join(f"{token}:*" for token in tokens)
+
 def get_books_with_search(search_term, limit, offset):
-    """Universal search that works with both MySQL and PostgreSQL"""
+    """Universal search that works with both MySQL and PostgreSQL - returns one row per book"""
     
     if b.DB_TYPE == 'mysql':
-        query = """
-            SELECT 
-                b.id as book_id,
-                b.title as book_title,
-                b.author,
-                b.category_id,
-                cat.name as category_name,
-                c.id as chapter_id,
-                c.chapter_number,
-                c.title as chapter_title
+        query = f"""
+            SELECT {BOOK_COLUMNS}
             FROM books b
             LEFT JOIN categories cat ON b.category_id = cat.id
-            LEFT JOIN chapters c ON b.id = c.book_id 
             WHERE MATCH(b.title) AGAINST (%s IN BOOLEAN MODE)
                OR MATCH(b.author) AGAINST (%s IN BOOLEAN MODE)
                OR MATCH(cat.name) AGAINST (%s IN BOOLEAN MODE)
-            ORDER BY b.title, c.chapter_number
+            ORDER BY b.title, b.id
             LIMIT %s OFFSET %s
         """
         # Use the search term as-is (full-text handles it)
         params = (search_term, search_term, search_term, limit, offset)
         
     elif b.DB_TYPE == 'postgresql':
-        # PostgreSQL with citext (simple LIKE is now case-insensitive)
-        query = """
-            SELECT 
-                b.id as book_id,
-                b.title as book_title,
-                b.author,
-                b.category_id,
-                cat.name as category_name,
-                c.id as chapter_id,
-                c.chapter_number,
-                c.title as chapter_title
+        # Full-text search on books.search_vector + pg_trgm, ranked by relevance
+        tsquery = postgres_tsquery(search_term)
+        query = f"""
+            SELECT {BOOK_COLUMNS},
+                ts_rank(b.search_vector, to_tsquery('simple', %s))
+                    + word_similarity(%s, b.title::text) as rank
             FROM books b
             LEFT JOIN categories cat ON b.category_id = cat.id
-            LEFT JOIN chapters c ON b.id = c.book_id 
-            WHERE b.title LIKE %s OR b.author LIKE %s OR cat.name LIKE %s
-            ORDER BY b.title, c.chapter_number
+            WHERE {POSTGRES_SEARCH_WHERE}
+            ORDER BY rank DESC, b.title, b.id
             LIMIT %s OFFSET %s
         """
-        # Use pattern matching for LIKE
-        search_pattern = f'%{search_term}%'
-        params = (search_pattern, search_pattern, search_pattern, limit, offset)
+        params = (tsquery, search_term, tsquery, search_term, search_term, limit, offset)
         # print("get_books_with_search() 1111")
     else: 
         # Fallback for other databases
         print("Fallback for other databases")
-        query = """
-            SELECT 
-                b.id as book_id,
-                b.title as book_title,
-                b.author,
-                b.category_id,
-                cat.name as category_name,
-                c.id as chapter_id,
-                c.chapter_number,
-                c.title as chapter_title
+        query = f"""
+            SELECT {BOOK_COLUMNS}
             FROM books b
             LEFT JOIN categories cat ON b.category_id = cat.id
-            LEFT JOIN chapters c ON b.id = c.book_id 
             WHERE b.title LIKE %s OR b.author LIKE %s OR cat.name LIKE %s
-            ORDER BY b.title, c.chapter_number
+            ORDER BY b.title, b.id
             LIMIT %s OFFSET %s
         """
         search_pattern = f'%{search_term}%'
@@ -722,6 +1867,92 @@ def get_books_with_search(search_term, limit, offset):
     
     return b.universal_db_select(query, params)
 
+def get_books_page(limit, offset):
+    """Page of books ordered by title - one row per book"""
+    query = f"""
+        SELECT {BOOK_COLUMNS}
+        FROM books b
+        LEFT JOIN categories cat ON b.category_id = cat.id
+        ORDER BY b.title, b.id
+        LIMIT %s OFFSET %s
+    """
+    return b.universal_db_select(query, (limit, offset))
+
+def encode_books_cursor(title, book_id):
+    """Opaque keyset cursor for GET /books - (title, book_id) of the last book on a page"""
+    raw = json.dumps([title, book_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_books_cursor(cursor):
+    """Returns (title, book_id), or None for an empty cursor (first page)"""
+    if not cursor:
+        return None
+    padded = cursor + '=' * (-len(cursor) % 4)
+    title, book_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    return str(title), int(book_id)
+
+def get_books_after_cursor(after, limit):
+    """Keyset page of books ordered by (title, id) - fetches limit + 1 rows to detect a next page"""
+    seek = "WHERE (b.title, b.id) > (%s, %s)" if after else ""
+    query = f"""
+        SELECT {BOOK_COLUMNS}
+        FROM books b
+        LEFT JOIN categories cat ON b.category_id = cat.id
+        {seek}
+        ORDER BY b.title, b.id
+        LIMIT %s
+    """
+    params = (after[0], after[1], limit + 1) if after else (limit + 1,)
+    return b.universal_db_select(query, params)
+
+def get_chapters_for_books(book_ids):
+    """All chapters of the given books in one query"""
+    if not book_ids:
+        return []
+    placeholders = ", ".join(["%s"] * len(book_ids))
+    query = f"""
+        SELECT id as chapter_id, book_id, chapter_number, title as chapter_title,
+               duration_seconds as chapter_duration
+        FROM chapters
+        WHERE book_id IN ({placeholders})
+        ORDER BY book_id, chapter_number
+    """
+    # Raises on error - a failed query must not look like books without chapters
+    return b.universal_db_select(query, tuple(book_ids), raise_errors=True)
+
+def build_books_page(book_rows):
+    """Book rows (in page order) + their chapters -> list of book dicts for the response"""
+    books = {}
+    for row in book_rows:
+        book_id = row['book_id']
+        books[book_id] = {
+            'id': book_id,
+            'title': row['book_title'],
+            'author': row.get('author', ''),
+            'category_id': row.get('category_id'),
+            'category_name': row.get('category_name', ''),
+            'chapters': []
+        }
+
+    for row in get_chapters_for_books(list(books.keys())) or []:
+        book = books.get(row['book_id'])
+        if book is not None and row.get('chapter_id'):
+            book['chapters'].append({
+                'id': row['chapter_id'],
+                'chapter_number': row['chapter_number'],
+                'title': row['chapter_title'],
+                'duration': row.get('chapter_duration')
+            })
+
+    return list(books.values())
+
+def add_book_durations(books):
+    """book['duration']: total seconds of the chapters with a known duration (None if none)"""
+    for book in books:
+        durations = [c['duration'] for c in book.get('chapters', []) if c.get('duration') is not None]
+        book['duration'] = round(sum(durations), 3) if durations else None
+    return books
+
 @app.route('/books', methods=['GET'])
 def get_books():
     try:
@@ -732,12 +1963,41 @@ def get_books():
         search = request.args.get('search', '', type=str)
         offset = (page - 1) * limit
 
+        books_list = None
+
+        # Keyset mode: ?cursor= (empty for the first page, then next_cursor from the response)
+        use_cursor = 'cursor' in request.args and not search
+        next_cursor = None
+        if use_cursor:
+            try:
+                after = decode_books_cursor(request.args.get('cursor', ''))
+            except (ValueError, TypeError):
+                return jsonify({"success": False, "error": "Invalid cursor"}), 400
+
         # Build query based on search
-        if search:
+        if use_cursor:
+            book_rows = get_books_after_cursor(after, limit) or []
+
+            # One extra book was fetched to find out whether there is a next page
+            if len(book_rows) > limit:
+                book_rows = book_rows[:limit]
+                last = book_rows[-1]
+                next_cursor = encode_books_cursor(last['book_title'], last['book_id'])
+
+            total_count = b.universal_db_select("SELECT COUNT(*) as total FROM books")
+
+        elif search and search_index.ready():
+            # In-memory catalogue index - no database round trips
+            book_ids = search_index.search(search)
+            books_list = search_index.get_books(book_ids[offset:offset + limit])
+            book_rows = []
+            total_count = [{'total': len(book_ids)}]
+
+        elif search:
             # Use the universal search function
             
-            results = get_books_with_search(search, limit, offset)
-            # print(results)
+            book_rows = get_books_with_search(search, limit, offset)
+            # print(book_rows)
 
             # Get total count for search
             if b.DB_TYPE == 'mysql':
@@ -751,89 +2011,39 @@ def get_books():
                 """
                 total_count = b.universal_db_select(count_query, (search, search, search))
             else: # postgesql
-                count_query = """
-                    SELECT COUNT(DISTINCT b.id) as total
+                count_query = f"""
+                    SELECT COUNT(*) as total
                     FROM books b
-                    LEFT JOIN categories cat ON b.category_id = cat.id
-                    WHERE b.title LIKE %s OR b.author LIKE %s OR cat.name LIKE %s
+                    WHERE {POSTGRES_SEARCH_WHERE}
                 """
-                search_pattern = f'%{search}%'
-                total_count = b.universal_db_select(count_query, (search_pattern, search_pattern, search_pattern))
+                total_count = b.universal_db_select(count_query, (postgres_tsquery(search), search, search))
         
         else:
-            query = """
-                SELECT 
-                    b.id as book_id,
-                    b.title as book_title,
-                    b.author,
-                    b.category_id,
-                    cat.name as category_name,
-                    c.id as chapter_id,
-                    c.chapter_number,
-                    c.title as chapter_title
-                FROM books b
-                LEFT JOIN categories cat ON b.category_id = cat.id
-                LEFT JOIN chapters c ON b.id = c.book_id 
-                ORDER BY b.title, c.chapter_number
-                LIMIT %s OFFSET %s
-            """
-            results = b.universal_db_select(query, (limit, offset))
-
-
-            # books_results = b.universal_db_select(books_query, (limit, offset))
-            # books_with_chapters_results = b.universal_db_select(books_with_chapters_query, (limit, offset))
-
+            book_rows = get_books_page(limit, offset)
             total_count = b.universal_db_select("SELECT COUNT(*) as total FROM books")
 
-        # Process results (same as before)
-        if results is None:
-            results = []
-
-        # if results is None:
-        #     return jsonify({
-        #         "success": True,
-        #         "books": [],
-        #         "pagination": {
-        #             "page": page,
-        #             "limit": limit,
-        #             "total": 0,
-        #             "pages": 0
-        #         }
-        #     })
-        
         # Process results
-        books = {}
-        for row in results:
-            book_id = row['book_id']
-            if book_id not in books:
-                books[book_id] = {
-                    'id': book_id,
-                    'title': row['book_title'],
-                    'author': row.get('author', ''),
-                    'category_id': row.get('category_id'),
-                    'category_name': row.get('category_name', ''),
-                    'chapters': []
-                }
-            
-            if row.get('chapter_id'):
-                books[book_id]['chapters'].append({
-                    'id': row['chapter_id'],
-                    'chapter_number': row['chapter_number'],
-                    'title': row['chapter_title']
-                })
-        
-        books_list = list(books.values())
+        if book_rows is None:
+            book_rows = []
+
+        if books_list is None:
+            books_list = build_books_page(book_rows)
+        add_book_durations(books_list)
         total = total_count[0]['total'] if total_count and len(total_count) > 0 else 0
         
+        pagination = {
+            "page": page,
+            "limit": limit,
+            "total": total,
+            "pages": math.ceil(total / limit) if total > 0 else 0
+        }
+        if use_cursor:
+            pagination["next_cursor"] = next_cursor
+
         response = jsonify({
             "success": True,
             "books": books_list,
-            "pagination": {
-                "page": page,
-                "limit": limit,
-                "total": total,
-                "pages": math.ceil(total / limit) if total > 0 else 0
-            }
+            "pagination": pagination
         })
         response.headers["Cache-Control"] = "public, max-age=300"
         return response
@@ -844,21 +2054,49 @@ def get_books():
             "success": False,
             "error": "Internal server error"
         }), 500
-        
-
-
-def generate_signed_url(bucket_name, file_path, expiration=3600):
-    """Generate a signed URL for private Backblaze B2 files"""
+######## GET /books ########
+        
+
+
+######## Signed URL cache ########
+# A signed URL is handed out again while more than SIGNED_URL_MIN_REMAINING (fraction
+# of its lifetime, default 0.5) is left, so repeated plays/reruns get the same URL.
+signed_url_cache = TTLCache(max_size=int(os.getenv('SIGNED_URL_CACHE_SIZE', '5000')))
+book_folder_cache = TTLCache(max_size=int(os.getenv('BOOK_FOLDER_CACHE_SIZE', '2000')), ttl=300)
+
+def get_signed_url(bucket_name, file_path, expiration=3600, download_name=None):
+    """(url, seconds until it expires) - served from signed_url_cache when possible"""
+    key = (bucket_name, file_path, download_name)
+    cached = signed_url_cache.get(key)
+    if cached:
+        url, expires_at = cached
+        return url, int(expires_at - time.time())
+
+    url = generate_signed_url(bucket_name, file_path, expiration, download_name)
+    if url:
+        min_remaining = float(os.getenv('SIGNED_URL_MIN_REMAINING', '0.5'))
+        signed_url_cache.set(key, (url, time.time() + expiration), ttl=expiration * (1 - min_remaining))
+    return url, expiration
+######## Signed URL cache ########
+
+def generate_signed_url(bucket_name, file_path, expiration=3600, download_name=None):
+    """Generate a signed URL for private Backblaze B2 files
+    (download_name: served as an attachment with that file name)"""
     try:
         # s3 = s.backblaze_store()
         s3 = bz
+
+        params = {
+            'Bucket': bucket_name, 
+            'Key': file_path
+        }
+        if download_name:
+            safe_name = re.sub(r'[^\w.\- ]', '_', download_name, flags=re.ASCII)
+            params['ResponseContentDisposition'] = f'attachment; filename="{safe_name}"'
         
         url = s3.generate_presigned_url(
             'get_object',
-            Params={
-                'Bucket': bucket_name, 
-                'Key': file_path
-            },
+            Params=params,
             ExpiresIn=expiration,
             HttpMethod='GET'  # Explicitly specify GET
         )
@@ -868,73 +2106,66 @@ def generate_signed_url(bucket_name, file_path, expiration=3600):
         return None
 
 ##########
+# Plays of the same chapter within one RECORD_PLAY_WINDOW (seconds) share one
+# access_history row, keyed by session_bucket (see migrations.py)
+RECORD_PLAY_WINDOW = int(os.getenv('RECORD_PLAY_WINDOW', '300'))
+
+if DB_TYPE == "postgresql":
+    RECORD_PLAY_QUERY = """
+        INSERT INTO access_history
+        (user_id, book_id, chapter_id, progress, duration, session_bucket, accessed_at)
+        VALUES (%s, %s, %s, %s, %s, %s, NOW())
+        ON CONFLICT (user_id, book_id, chapter_key, session_bucket) DO UPDATE
+        SET progress = EXCLUDED.progress,
+            duration = GREATEST(access_history.duration, EXCLUDED.duration),
+            accessed_at = NOW()
+        WHERE EXCLUDED.progress > access_history.progress
+        RETURNING (xmax = 0) AS inserted
+    """
+else:
+    # Assignments run left to right, so progress is updated last.
+    # LAST_INSERT_ID(0) leaves lastrowid at 0 when an existing row is hit (see b.db_upsert)
+    RECORD_PLAY_QUERY = """
+        INSERT INTO access_history
+        (user_id, book_id, chapter_id, progress, duration, session_bucket, accessed_at)
+        VALUES (%s, %s, %s, %s, %s, %s, NOW())
+        ON DUPLICATE KEY UPDATE
+            id = id + LAST_INSERT_ID(0),
+            accessed_at = IF(VALUES(progress) > progress, NOW(), accessed_at),
+            duration = IF(VALUES(progress) > progress, GREATEST(duration, VALUES(duration)), duration),
+            progress = GREATEST(progress, VALUES(progress))
+    """
+
+# Used when the upsert fails, e.g. while the access_history_session_bucket migration
+# (session_bucket column and uq_access_history_session index) is not applied yet
+RECORD_PLAY_FALLBACK_QUERY = """
+    INSERT INTO access_history
+    (user_id, book_id, chapter_id, progress, duration, accessed_at)
+    VALUES (%s, %s, %s, %s, %s, NOW())
+"""
+
 def record_audio_play(user_id, book_id, chapter_id=None, duration=0, progress=0):
-# def record_audio_play(user_id, book_id, chapter_id=None, current_chapter=None, progress=0):
     """
-    Record audio play in access_history - but only if no recent record exists
+    Record audio play in access_history - one row per user/book/chapter and play window,
+    written with a single upsert (an existing row only moves forward in progress)
     Returns True if a new record was created, False if an existing record was updated
     """
     try:
-        # First, check if there's a recent record for this user/book/chapter combination
-        # (within the last 5 minutes) that we should update instead of creating a new one
-        if chapter_id:
-            check_query = """
-                SELECT id, duration, progress 
-                FROM access_history 
-                WHERE user_id = %s 
-                AND book_id = %s 
-                AND chapter_id = %s 
-                AND accessed_at >= NOW() - INTERVAL '5 minutes'
-                ORDER BY accessed_at DESC 
-                LIMIT 1
-            """
-            params = (user_id, book_id, chapter_id)
-        else:
-            check_query = """
-                SELECT id, duration, progress 
-                FROM access_history 
-                WHERE user_id = %s 
-                AND book_id = %s 
-                AND chapter_id IS NULL 
-                AND accessed_at >= NOW() - INTERVAL '5 minutes'
-                ORDER BY accessed_at DESC 
-                LIMIT 1
-            """
-            params = (user_id, book_id)
-        
-        existing_record = b.db_select(check_query, params, fetch_one=True)
-        
-        if existing_record:
-            # Update the existing record instead of creating a new one
-            record_id, current_duration, current_progress = existing_record
-            
-            # Only update if the new progress is greater than current progress
-            if progress > current_progress:
-                update_query = """
-                    UPDATE access_history 
-                    SET progress = %s, 
-                        duration = GREATEST(duration, %s),
-                        accessed_at = NOW()
-                    WHERE id = %s
-                """
-                b.db_update(update_query, (progress, progress, record_id))
-                print(f"✅ Updated existing record {record_id} with progress {progress}")
-                return False  # Indicate that we updated, not created
-            else:
-                print(f"ℹ️ Keeping existing record {record_id} (progress {current_progress} >= new {progress})")
+        session_bucket = int(time.time() // RECORD_PLAY_WINDOW)
+        params = (user_id, book_id, chapter_id, progress, duration, session_bucket)
+
+        inserted = b.db_upsert(RECORD_PLAY_QUERY, params)
+        if inserted is None:
+            # Don't lose the play - store it as its own row
+            if b.db_insert(RECORD_PLAY_FALLBACK_QUERY, params[:5]) is None:
                 return False
-        
-        # If no recent record exists, create a new one
-        query = """
-            INSERT INTO access_history 
-            (user_id, book_id, chapter_id, progress, duration, accessed_at)
-            VALUES (%s, %s, %s, %s, %s, NOW())
-        """
-        params = (user_id, book_id, chapter_id, duration, progress)
-        
-        b.db_insert(query, params)
-        print(f"✅ Created new record for user {user_id}, book {book_id}, chapter {chapter_id}")
-        return True
+            print(f"⚠️ Recorded play for user {user_id}, book {book_id} without a play window")
+            return True
+        if inserted:
+            print(f"✅ Created new record for user {user_id}, book {book_id}, chapter {chapter_id}")
+        else:
+            print(f"✅ Updated recent record for user {user_id}, book {book_id}, chapter {chapter_id}")
+        return inserted
         
     except Exception as e:
         print(f"❌ Error recording audio play: {e}")
@@ -1073,7 +2304,7 @@ def get_chapter_by_id(chapter_id):
         return None
     
 def get_book_chapters(book_id):
-    query = "SELECT title, chapter_number FROM chapters WHERE book_id = %s ORDER BY chapter_number"
+    query = "SELECT title, chapter_number, duration_seconds as duration FROM chapters WHERE book_id = %s ORDER BY chapter_number"
     return b.universal_db_select(query, (book_id,))
 
 ########
@@ -1250,6 +2481,11 @@ def update_playback(user_id, book_id, chapter_id=None, duration=0, progress=0):
         # Ensure integers
         duration = int(round(duration))
         progress = int(round(progress))
+
+        if playback_buffer is not None:
+            # Written by the flusher thread; only the latest position per chapter is kept
+            playback_buffer.put((user_id, book_id, chapter_id), (duration, progress))
+            return True
         
         # print(f"🔢 Final values - duration: {duration} (type: {type(duration)}), progress: {progress} (type: {type(progress)})")
 
@@ -1300,6 +2536,70 @@ def update_playback(user_id, book_id, chapter_id=None, duration=0, progress=0):
         return False
 
 
+######## playback write-behind ########
+# PLAYBACK_WRITE_BEHIND=true       - buffer /api/update-playback and write it in batches
+#                                    (long-running servers only - the flusher is a background thread)
+# PLAYBACK_FLUSH_SECONDS (2)       - how often the buffer is written
+# PLAYBACK_FLUSH_SIZE (500)        - write early once this many chapters are pending
+# PLAYBACK_FLUSH_ATTEMPTS (5)      - drop a row that failed to write this many times
+if DB_TYPE == "postgresql":
+    # One statement for the whole batch; each row updates the latest history entry of its chapter
+    PLAYBACK_BATCH_QUERY = """
+        UPDATE access_history ah
+        SET duration = v.duration,
+            progress = v.progress,
+            accessed_at = NOW()
+        FROM (VALUES %s) AS v(user_id, book_id, chapter_id, duration, progress)
+        WHERE ah.id = (
+            SELECT h.id
+            FROM access_history h
+            WHERE h.user_id = v.user_id
+              AND h.book_id = v.book_id
+              AND h.chapter_id IS NOT DISTINCT FROM v.chapter_id
+            ORDER BY h.accessed_at DESC
+            LIMIT 1
+        )
+    """
+    PLAYBACK_BATCH_TEMPLATE = "(%s::bigint, %s::bigint, %s::bigint, %s::integer, %s::integer)"
+else:
+    # MySQL has no UPDATE ... FROM VALUES with ORDER BY/LIMIT - executemany on one connection
+    PLAYBACK_BATCH_QUERY = """
+        UPDATE access_history 
+        SET duration = %s, progress = %s, accessed_at = NOW()
+        WHERE user_id = %s AND book_id = %s 
+          AND (chapter_id = %s OR (%s IS NULL AND chapter_id IS NULL))
+        ORDER BY accessed_at DESC
+        LIMIT 1
+    """
+    PLAYBACK_BATCH_TEMPLATE = None
+
+
+def write_playback_batch(items):
+    """Flush function for the playback buffer: items are ((user_id, book_id, chapter_id), (duration, progress))"""
+    if DB_TYPE == "postgresql":
+        rows = [(user_id, book_id, chapter_id, duration, progress)
+                for (user_id, book_id, chapter_id), (duration, progress) in items]
+    else:
+        rows = [(duration, progress, user_id, book_id, chapter_id, chapter_id)
+                for (user_id, book_id, chapter_id), (duration, progress) in items]
+    result = b.db_update(PLAYBACK_BATCH_QUERY, batch_data=rows, values_template=PLAYBACK_BATCH_TEMPLATE)
+    if result is None:
+        raise RuntimeError("batch update of access_history failed")
+    return result
+
+
+playback_buffer = None
+if os.getenv('PLAYBACK_WRITE_BEHIND', 'false').lower() == 'true':
+    playback_buffer = WriteBehindBuffer(
+        write_playback_batch,
+        flush_interval=float(os.getenv('PLAYBACK_FLUSH_SECONDS', '2')),
+        max_size=int(os.getenv('PLAYBACK_FLUSH_SIZE', '500')),
+        name="playback-write-behind",
+        max_attempts=int(os.getenv('PLAYBACK_FLUSH_ATTEMPTS', '5')),
+    )
+    playback_buffer.start()
+
+
 @app.route('/api/update-playback', methods=['POST'])
 def api_update_playback():
     """API endpoint to update playback progress"""
@@ -1313,6 +2613,16 @@ def api_update_playback():
         
         if not all([user_id, book_id]):
             return jsonify({"success": False, "error": "Missing required fields"}), 400
+
+        # Bad ids would otherwise only fail later, in the batched write
+        try:
+            user_id = int(user_id)
+            book_id = int(book_id)
+            chapter_id = int(chapter_id) if chapter_id is not None else None
+            duration = float(duration or 0)
+            progress = float(progress or 0)
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "error": "user_id, book_id and chapter_id must be integers, duration and progress numbers"}), 400
         
         success = update_playback(user_id, book_id, chapter_id, duration, progress)
         
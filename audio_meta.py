@@ -0,0 +1,236 @@
+# audio_meta.py
+# Duration, bitrate, sample rate and channels of an MP3 from its headers, parsed from
+# the bytes as they stream past - nothing is decoded and the file is never read twice.
+#   1. ID3v2 tags at the start are skipped (their size is in the tag header)
+#   2. the first frame header is found (and checked against the header of the frame after it)
+#   3. a Xing/Info or VBRI header in that frame gives the frame count of VBR files;
+#      without one the file is CBR and the duration follows from the byte count
+# Only the head of the file is buffered; after that the probe just counts bytes.
+import struct
+
+PROBE_LIMIT = 1024 * 1024   # give up when no frame is found within this many bytes of audio
+
+VERSIONS = {0: '2.5', 2: '2', 3: '1'}
+LAYERS = {1: 3, 2: 2, 3: 1}
+BITRATES = {   # kbps by (version 1 or not, layer)
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+SAMPLE_RATES = {
+    '1': [44100, 48000, 32000],
+    '2': [22050, 24000, 16000],
+    '2.5': [11025, 12000, 8000],
+}
+
+
+def parse_frame_header(data):
+    """dict for a valid 4-byte MPEG audio frame header, else None"""
+    if len(data) < 4 or data[0] != 0xFF or data[1] & 0xE0 != 0xE0:
+        return None
+    version = VERSIONS.get((data[1] >> 3) & 3)
+    layer = LAYERS.get((data[1] >> 1) & 3)
+    bitrate_index = data[2] >> 4
+    sample_rate_index = (data[2] >> 2) & 3
+    if version is None or layer is None or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    bitrate = BITRATES[(version == '1', layer)][bitrate_index]
+    sample_rate = SAMPLE_RATES[version][sample_rate_index]
+    padding = (data[2] >> 1) & 1
+    channels = 1 if data[3] >> 6 == 3 else 2
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate * 1000 // sample_rate + padding) * 4
+    else:
+        samples = 576 if layer == 3 and version != '1' else 1152
+        length = samples // 8 * bitrate * 1000 // sample_rate + padding
+    return {
+        'version': version,
+        'layer': layer,
+        'bitrate': bitrate,
+        'sample_rate': sample_rate,
+        'channels': channels,
+        'samples': samples,
+        'length': length,
+    }
+
+
+def same_stream(a, b):
+    return (a['version'], a['layer'], a['sample_rate']) == (b['version'], b['layer'], b['sample_rate'])
+
+
+def read_vbr_header(frame, header):
+    """(frames, bytes) from a Xing/Info or VBRI header in the first frame, (None, None) without one"""
+    if header['version'] == '1':
+        side_info = 17 if header['channels'] == 1 else 32
+    else:
+        side_info = 9 if header['channels'] == 1 else 17
+    xing = frame[4 + side_info:]
+    if xing[:4] in (b'Xing', b'Info') and len(xing) >= 8:
+        flags = struct.unpack('>I', xing[4:8])[0]
+        fields, offset = {}, 8
+        for flag, name in ((1, 'frames'), (2, 'bytes')):
+            if flags & flag and len(xing) >= offset + 4:
+                fields[name] = struct.unpack('>I', xing[offset:offset + 4])[0]
+                offset += 4
+        return fields.get('frames'), fields.get('bytes')
+    vbri = frame[36:]
+    if vbri[:4] == b'VBRI' and len(vbri) >= 18:
+        size, frames = struct.unpack('>II', vbri[10:18])
+        return frames, size
+    return None, None
+
+
+class Mp3Probe:
+    """Feed the bytes of an MP3 in order (feed), then call result()"""
+
+    def __init__(self):
+        self.position = 0          # offset of the next byte fed
+        self.audio_start = None    # offset of the first frame
+        self.header = None
+        self.done = False          # first frame found (or given up)
+        self._skip = 0             # bytes of an ID3 tag still to skip
+        self._tags_done = False
+        self._search_start = None  # offset where the frame search began
+        self._buffer = bytearray()
+        self._buffer_start = 0
+        self._tail = b''
+        self._vbr = (None, None)
+
+    @property
+    def next_offset(self):
+        """Where the probe needs data from next (past an ID3 tag it is skipping)"""
+        return self.position + self._skip
+
+    def seek(self, offset):
+        """Continue at offset, skipping the rest of an ID3 tag (only forward, up to next_offset)"""
+        if not self.position <= offset <= self.next_offset:
+            raise ValueError("Can only seek within the skipped tag")
+        self._skip -= offset - self.position
+        self.position = offset
+
+    def feed(self, chunk):
+        start = self.position
+        self.position += len(chunk)
+        self._tail = (self._tail + bytes(chunk[-128:]))[-128:]
+        if self.done or not chunk:
+            return
+        if self._skip:
+            skipped = min(self._skip, len(chunk))
+            self._skip -= skipped
+            chunk = chunk[skipped:]
+            start += skipped
+            if not chunk:
+                return
+        if not self._buffer:
+            self._buffer_start = start
+        self._buffer += chunk
+        self._parse(final=False)
+
+    def _parse(self, final):
+        buf = self._buffer
+        while not self._tags_done:
+            if len(buf) < 10 and not final:
+                return
+            if buf[:3] != b'ID3' or len(buf) < 10:
+                self._tags_done = True
+                self._search_start = self._buffer_start
+                break
+            size = 10 + ((buf[6] << 21) | (buf[7] << 14) | (buf[8] << 7) | buf[9])
+            if buf[5] & 0x10:
+                size += 10   # footer
+            if size > len(buf):
+                self._skip = size - len(buf)
+                self._buffer_start += size
+                buf.clear()
+                return
+            del buf[:size]
+            self._buffer_start += size
+
+        i = buf.find(b'\xff')
+        while i != -1:
+            header = parse_frame_header(buf[i:i + 4])
+            if header is None:
+                if len(buf) - i < 4 and not final:
+                    break     # header split across chunks
+                i = buf.find(b'\xff', i + 1)
+                continue
+            following = i + header['length']
+            if following + 4 > len(buf) and not final:
+                break         # wait for the next frame header
+            next_header = parse_frame_header(buf[following:following + 4])
+            if following + 4 > len(buf) or (next_header and same_stream(header, next_header)):
+                self.header = header
+                self.audio_start = self._buffer_start + i
+                self._vbr = read_vbr_header(bytes(buf[i:following]), header)
+                self.done = True
+                buf.clear()
+                return
+            i = buf.find(b'\xff', i + 1)
+
+        # Keep what may still be the start of a frame
+        keep = i if i != -1 else max(len(buf) - 3, 0)
+        del buf[:keep]
+        self._buffer_start += keep
+        if final or self._buffer_start - self._search_start > PROBE_LIMIT:
+            self.done = True
+            buf.clear()
+
+    def result(self, total_bytes=None):
+        """{duration_seconds, bitrate_kbps, sample_rate, channels}, or None if this is not an MP3.
+        total_bytes is the file size when not every byte was fed."""
+        if not self.done:
+            self._parse(final=True)
+        if self.header is None:
+            return None
+
+        header = self.header
+        audio_bytes = (total_bytes if total_bytes is not None else self.position) - self.audio_start
+        if total_bytes is None and len(self._tail) == 128 and self._tail[:3] == b'TAG':
+            audio_bytes -= 128   # ID3v1 tag at the end
+        frames, vbr_bytes = self._vbr
+        if frames:
+            duration = frames * header['samples'] / header['sample_rate']
+            bitrate = (vbr_bytes or audio_bytes) * 8 / duration / 1000 if duration else header['bitrate']
+        else:
+            duration = audio_bytes * 8 / (header['bitrate'] * 1000)
+            bitrate = header['bitrate']
+        return {
+            'duration_seconds': round(duration, 3),
+            'bitrate_kbps': int(round(bitrate)),
+            'sample_rate': header['sample_rate'],
+            'channels': header['channels'],
+        }
+
+
+def probe_ranges(read_range, size, chunk_size=64 * 1024, max_reads=8):
+    """Probe a stored file through read_range(offset, length) -> bytes, reading only
+    its head (and skipping over ID3 tags). Returns the same dict as Mp3Probe.result."""
+    probe = Mp3Probe()
+    reads = 0
+    while not probe.done and probe.next_offset < size and reads < max_reads:
+        probe.seek(probe.next_offset)
+        data = read_range(probe.position, chunk_size)
+        if not data:
+            break
+        probe.feed(data)
+        reads += 1
+    return probe.result(total_bytes=size)
+
+
+def probe_file(f, size):
+    """probe_ranges on a local seekable file; the file position is restored"""
+    position = f.tell()
+
+    def read_range(offset, length):
+        f.seek(offset)
+        return f.read(length)
+
+    try:
+        return probe_ranges(read_range, size)
+    finally:
+        f.seek(position)
@@ -4,9 +4,15 @@
 from urllib.parse import urlparse
 from mysql.connector import connect
 import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INERROR
+from psycopg2.extras import execute_values
 
 import os
+import threading
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from flask import g, has_request_context
+from db_pool import ConnectionPool
 
 load_dotenv()
 DB_TYPE = os.getenv('DB_TYPE').lower()   # MySQL / postgreSQL
@@ -92,26 +98,225 @@ def postgreSQL_db():
         print(f"❌ DB Error - postgreSQL: {str(e)}")
         return False
 
+######## Connection pool ########
+# Every helper below gets its connection from conn(); connection.close() in their
+# finally blocks hands the connection back to the pool instead of closing it.
+# DB_POOL_MIN / DB_POOL_MAX      - pool size
+# DB_POOL_MAX_AGE                - seconds before a connection is recycled
+# DB_POOL_TIMEOUT                - seconds to wait for a free connection
+# DB_POOL_PING_AFTER             - health check connections idle longer than this (seconds)
+_pool = None
+_pool_lock = threading.Lock()
+
+def _mysql_ping(connection):
+    return connection.is_connected()
+
+def _mysql_reset(connection):
+    if connection.in_transaction:
+        connection.rollback()
+
+def _postgresql_ping(connection):
+    if connection.closed:
+        return False
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT 1")
+        return True
+    finally:
+        cursor.close()
+        connection.rollback()
+
+def _postgresql_reset(connection):
+    if connection.closed:
+        raise ConnectionError("PostgreSQL connection closed")
+    if connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+        connection.rollback()
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if DB_TYPE == 'mysql':
+                    connect, ping, reset = MySQL_db, _mysql_ping, _mysql_reset
+                elif DB_TYPE == 'postgresql':
+                    connect, ping, reset = postgreSQL_db, _postgresql_ping, _postgresql_reset
+                else:
+                    raise ValueError(f"Unknown database type: {DB_TYPE}")
+                _pool = ConnectionPool(
+                    connect, ping, reset,
+                    min_size=int(os.getenv('DB_POOL_MIN', '1')),
+                    max_size=int(os.getenv('DB_POOL_MAX', '10')),
+                    max_age=float(os.getenv('DB_POOL_MAX_AGE', '1800')),
+                    timeout=float(os.getenv('DB_POOL_TIMEOUT', '10')),
+                    ping_after=float(os.getenv('DB_POOL_PING_AFTER', '30')),
+                )
+    return _pool
+
+def pool_stats():
+    """Pool size and checkout wait-time metrics"""
+    if _pool is None:
+        return {"initialized": False}
+    stats = _pool.stats()
+    stats["initialized"] = True
+    return stats
+######## Connection pool ########
+
+######## Request-scoped connection ########
+# Inside a Flask request every helper call shares one pooled connection, bound to
+# flask.g on first use and handed back by release_request_connection() from
+# app.teardown_request. `with transaction():` additionally runs the enclosed
+# helper calls as a single transaction (outside a request it binds a connection
+# to the current thread for the duration of the block).
+# Outside transaction() each helper call ends its own transaction (close() rolls back
+# whatever a SELECT or a failed statement left open), so the shared connection is
+# never left idle or aborted in a transaction between calls. Call
+# release_request_connection() before long non-DB work (B2 transfers) to hand the
+# connection back early - the next helper call takes a new one.
+_local = threading.local()
+
+class SharedConnection:
+    """Pooled connection shared by several helper calls; close() ends the helper's
+    statement but keeps the connection"""
+
+    def __init__(self, pooled):
+        self._pooled = pooled
+        self.transaction = False
+        self.failed = False
+
+    def __getattr__(self, name):
+        return getattr(self._pooled, name)
+
+    def commit(self):
+        # Inside transaction() the commit happens once, when the block exits
+        if not self.transaction:
+            self._pooled.commit()
+
+    def rollback(self):
+        self._pooled.rollback()
+        if self.transaction:
+            self.failed = True
+            if DB_TYPE == 'mysql':
+                # autocommit is on for MySQL, keep the rest of the block transactional
+                self._pooled.start_transaction()
+
+    def close(self):
+        if self.transaction:
+            # A failed statement aborts the whole PostgreSQL transaction - the block
+            # must roll back even if the helper did not report the error
+            if DB_TYPE == 'postgresql' and self._pooled.get_transaction_status() == TRANSACTION_STATUS_INERROR:
+                self.failed = True
+            return
+        try:
+            if DB_TYPE == 'mysql':
+                _mysql_reset(self._pooled)
+            else:
+                _postgresql_reset(self._pooled)
+        except Exception as e:
+            print(f"❌ DB Error - could not reset shared connection: {e}")
+
+    def release(self):
+        self._pooled.close()
+
+    def __bool__(self):
+        return True
+
+def _bound_connection():
+    if has_request_context():
+        return g.get('_db_connection')
+    return getattr(_local, 'connection', None)
+
+def _bind_connection(shared):
+    if has_request_context():
+        g._db_connection = shared
+    else:
+        _local.connection = shared
+
+def acquire_connection():
+    """Connection for one helper call - the request/thread bound one if any, else from the pool"""
+    shared = _bound_connection()
+    if shared is not None:
+        return shared
+    if has_request_context():
+        shared = SharedConnection(get_pool().acquire())
+        _bind_connection(shared)
+        return shared
+    return get_pool().acquire()
+
+def release_request_connection(exc=None):
+    """Return the request's connection to the pool (called from teardown_request)"""
+    if not has_request_context():
+        return
+    shared = g.pop('_db_connection', None)
+    if shared is not None:
+        shared.release()
+
+class TransactionFailed(Exception):
+    pass
+
+@contextmanager
+def transaction():
+    """Run the helper calls inside the block in one transaction. If any of them
+    failed, everything is rolled back and TransactionFailed is raised at the end."""
+    shared = _bound_connection()
+    owned = False
+    if shared is None:
+        shared = SharedConnection(get_pool().acquire())
+        _bind_connection(shared)
+        owned = not has_request_context()
+
+    if shared.transaction:
+        # Nested block joins the outer transaction
+        yield shared
+        return
+
+    try:
+        if DB_TYPE == 'mysql':
+            shared._pooled.start_transaction()
+        elif shared._pooled.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            shared._pooled.commit()
+        shared.transaction = True
+        shared.failed = False
+        yield shared
+        failed = shared.failed
+        if failed:
+            shared._pooled.rollback()
+        else:
+            shared._pooled.commit()
+    except Exception:
+        shared._pooled.rollback()
+        raise
+    finally:
+        shared.transaction = False
+        if owned:
+            _local.connection = None
+            shared.release()
+    if failed:
+        raise TransactionFailed("A statement in the transaction failed, all changes were rolled back")
+######## Request-scoped connection ########
+
 def conn():
     if DB_TYPE == 'mysql':
+        connection = None
         try:
-            connection = MySQL_db()
-            if connection is None or connection is False:
-                raise ConnectionError("Failed to connect to MySQL. Check credentials and network.")
+            connection = acquire_connection()
             cursor = connection.cursor(dictionary=True)
             return cursor, connection
         except Exception as e:
+            if connection:
+                connection.close()
             print(f"❌ DB Error - conn() - MySQL: {str(e)} Might be 'Trial expired'.")
             raise Exception("MySQL is not available.")
     elif DB_TYPE == 'postgresql':
+        connection = None
         try:
-            connection = postgreSQL_db()
-            if connection is None or connection is False:
-                raise ConnectionError("Failed to connect to PostgreSQL. Check credentials and network.")
+            connection = acquire_connection()
             from psycopg2.extras import DictCursor
             cursor = connection.cursor(cursor_factory=DictCursor)
             return cursor, connection
         except Exception as e:
+            if connection:
+                connection.close()
             print(f"❌ DB Error - conn() - postgreSQL: {str(e)}")
             raise Exception("PostgreSQL is not available.")
     else:
@@ -119,7 +324,11 @@ def conn():
 
 def check_database_status():
     try:
-        print(f"**Database : {'✅ Connected' if  conn() else '❌ Disconnected'}")
+        cursor, connection = conn()
+        cursor.close()
+        connection.close()
+        print("**Database : ✅ Connected")
+        return True
     except Exception as e:
         print(f"❌ Database check failed: {e}")
         return False
@@ -140,6 +349,7 @@ def db_select(query, params=None, fetch_one=False):
             return results
         except Exception as e:
             print(f"❌ MySQL SELECT Error: {e}")
+            connection.rollback()
             return None
         finally:
             cursor.close()
@@ -165,6 +375,7 @@ def db_select(query, params=None, fetch_one=False):
             return results
         except Exception as e:
             print(f"❌ PostgreSQL SELECT Error: {e}")
+            connection.rollback()
             return None
         finally:
             if cursor:
@@ -172,7 +383,9 @@ def db_select(query, params=None, fetch_one=False):
             if connection:
                 connection.close()
 
-def universal_db_select(query, params=None):
+def universal_db_select(query, params=None, raise_errors=False):
+    """List of row dicts; [] on error unless raise_errors (for callers that must tell
+    a failed query from an empty result)"""
     # Use the unified DB_TYPE variable
     if DB_TYPE == 'mysql':
         if isinstance(params, dict):
@@ -192,6 +405,9 @@ def universal_db_select(query, params=None):
             return results
         except Exception as e:
             print(f"❌ MySQL SELECT Error: {e}")
+            connection.rollback()
+            if raise_errors:
+                raise
             return []
         finally:
             cursor.close()
@@ -224,6 +440,9 @@ def universal_db_select(query, params=None):
             return [dict(row) for row in results]
         except Exception as e:
             print(f"❌ PostgreSQL SELECT Error: {e}")
+            connection.rollback()
+            if raise_errors:
+                raise
             return []
         finally:
             cursor.close()
@@ -296,7 +515,41 @@ def db_insert(query, params=None, batch_data=None):
         print(f"❌ Unknown database type: {DB_TYPE}")
         return None
 
-def db_update(query, params=None, batch_data=None):
+def db_insert_many(query, batch_data, values_template=None):
+    """Insert batch_data in one statement and return the new ids in row order, None on error.
+    PostgreSQL: the query holds a single VALUES %s and ends with RETURNING id.
+    MySQL: the query is a single-row INSERT ... VALUES (%s, ...); it is sent as one multi-row
+    INSERT whose ids are lastrowid (the first one) onwards, @@auto_increment_increment apart.
+    Under innodb_autoinc_lock_mode = 2 concurrent inserts can still interleave - callers
+    that need certainty check the ids against the rows."""
+    cursor, connection = conn()
+    try:
+        if DB_TYPE == 'mysql':
+            head, row = query.rsplit("VALUES", 1)
+            cursor.execute(f"{head}VALUES {', '.join([row.strip()] * len(batch_data))}",
+                           [value for values in batch_data for value in values])
+            first_id, inserted = cursor.lastrowid, cursor.rowcount
+            if inserted != len(batch_data):
+                raise RuntimeError(f"{inserted} of {len(batch_data)} rows inserted")
+            cursor.execute("SELECT @@auto_increment_increment AS step")
+            step = int(cursor.fetchone()['step'])
+            connection.commit()
+            return [first_id + i * step for i in range(inserted)]
+        rows = execute_values(cursor, query, batch_data, template=values_template,
+                              page_size=len(batch_data), fetch=True)
+        connection.commit()
+        return [row[0] for row in rows]
+    except Exception as e:
+        print(f"❌ INSERT Error: {e}")
+        connection.rollback()
+        return None
+    finally:
+        cursor.close()
+        connection.close()
+
+def db_update(query, params=None, batch_data=None, values_template=None):
+    """values_template (PostgreSQL): run batch_data as one statement with execute_values;
+    the query then holds a single VALUES %s"""
     if DB_TYPE == 'mysql':
         cursor, connection = conn()
         try:
@@ -323,7 +576,11 @@ def db_update(query, params=None, batch_data=None):
     elif DB_TYPE == 'postgresql':
         cursor, connection = conn()
         try:
-            if batch_data:
+            if batch_data and values_template:
+                execute_values(cursor, query, batch_data, template=values_template, page_size=len(batch_data))
+                connection.commit()
+                return cursor.rowcount
+            elif batch_data:
                 cursor.executemany(query, batch_data)
                 connection.commit()
                 return cursor.rowcount
@@ -350,6 +607,30 @@ def db_update(query, params=None, batch_data=None):
         print(f"❌ Unknown database type: {DB_TYPE}")
         return None
 
+def db_upsert(query, params):
+    """Single-row INSERT ... ON CONFLICT / ON DUPLICATE KEY UPDATE in one round trip.
+    PostgreSQL queries end in RETURNING (xmax = 0) so the inserted flag comes back.
+    MySQL queries start their UPDATE part with id = id + LAST_INSERT_ID(0), so lastrowid is
+    only set by an insert (rowcount depends on CLIENT_FOUND_ROWS and can't tell them apart).
+    Returns True if a row was inserted, False if an existing row was hit, None on error"""
+    cursor, connection = conn()     # BOTH : DB_TYPE == 'mysql'/'postgresql'
+    try:
+        cursor.execute(query, params)
+        if DB_TYPE == 'postgresql':
+            row = cursor.fetchone()     # no row when the DO UPDATE ... WHERE skipped the update
+            inserted = bool(row and row[0])
+        else:
+            inserted = bool(cursor.lastrowid)
+        connection.commit()
+        return inserted
+    except Exception as e:
+        print(f"❌ UPSERT Error: {e}")
+        connection.rollback()
+        return None
+    finally:
+        cursor.close()
+        connection.close()
+
 def db_execute(query, params=None):
     """Universal function for executing DDL statements (CREATE, DROP, ALTER, DELETE)"""
     cursor, connection = conn()     # BOTH : DB_TYPE == 'mysql'/'postgresql'
@@ -362,6 +643,7 @@ def db_execute(query, params=None):
         return True
     except Exception as e:
         print(f"❌ Execute Error: {e}")
+        connection.rollback()
         return False
     finally:
         cursor.close()
@@ -380,6 +662,7 @@ def db_execute2(query, params=None):
             return True
         except Exception as e:
             print(f"❌ MySQL Execute Error: {e}")
+            connection.rollback()
             return False
         finally:
             cursor.close()
@@ -397,6 +680,7 @@ def db_execute2(query, params=None):
             return True
         except Exception as e:
             print(f"❌ PostgreSQL Execute Error: {e}")
+            connection.rollback()
             return False
         finally:
             cursor.close()
@@ -0,0 +1,200 @@
+# db_pool.py
+# Connection pool used by base.conn() for both MySQL and postgreSQL.
+import threading
+import time
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection:
+    """Wraps a raw DB connection; close() hands it back to the pool instead of closing it."""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self._checked_out = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        if self._checked_out:
+            self._pool.release(self)
+
+    def __bool__(self):
+        return True
+
+
+class ConnectionPool:
+    """
+    Thread safe connection pool.
+    - connect: callable returning a new raw connection (or False/None on failure)
+    - ping: callable(raw) -> bool, health check run on checkout
+    - reset: callable(raw), run when a connection comes back (rollback etc.)
+    """
+
+    def __init__(self, connect, ping, reset=None, min_size=1, max_size=10,
+                 max_age=1800, timeout=10, ping_after=30):
+        self._connect = connect
+        self._ping = ping
+        self._reset = reset
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.max_age = max_age            # seconds, recycle connections older than this
+        self.timeout = timeout            # seconds to wait for a free connection
+        self.ping_after = ping_after      # only ping connections idle longer than this
+
+        self._idle = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+            'created': 0,
+            'recycled': 0,
+            'failed_health_checks': 0,
+        }
+        self.fill()
+
+    def fill(self):
+        """Open connections until min_size is reached"""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            pooled = self._open()
+            with self._cond:
+                if pooled is None:
+                    return
+                self._idle.append(pooled)
+                self._cond.notify()
+
+    def _open(self):
+        """Open a new connection; the caller has already reserved a slot in _size"""
+        try:
+            raw = self._connect()
+        except Exception as e:
+            print(f"❌ DB Pool - connect failed: {e}")
+            raw = None
+        if not raw:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            return None
+        with self._cond:
+            self._stats['created'] += 1
+        return PooledConnection(self, raw)
+
+    def _discard(self, pooled):
+        try:
+            pooled._raw.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _expired(self, pooled):
+        return self.max_age and time.monotonic() - pooled.created_at > self.max_age
+
+    def _healthy(self, pooled):
+        if time.monotonic() - pooled.last_used < self.ping_after:
+            return True
+        try:
+            return bool(self._ping(pooled._raw))
+        except Exception:
+            return False
+
+    def acquire(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+
+        while True:
+            pooled = None
+            reserve = False
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(f"No free DB connection after {self.timeout}s (max_size={self.max_size})")
+                    waited = True
+                    self._cond.wait(remaining)
+
+                if self._idle:
+                    pooled = self._idle.pop()
+                else:
+                    self._size += 1
+                    reserve = True
+
+            if reserve:
+                pooled = self._open()
+                if pooled is None:
+                    raise ConnectionError("Failed to open a new DB connection")
+            elif self._expired(pooled):
+                with self._cond:
+                    self._stats['recycled'] += 1
+                self._discard(pooled)
+                continue
+            elif not self._healthy(pooled):
+                with self._cond:
+                    self._stats['failed_health_checks'] += 1
+                self._discard(pooled)
+                continue
+
+            wait_time = time.monotonic() - start
+            with self._cond:
+                self._stats['checkouts'] += 1
+                if waited:
+                    self._stats['waits'] += 1
+                self._stats['wait_time_total'] += wait_time
+                self._stats['wait_time_max'] = max(self._stats['wait_time_max'], wait_time)
+            pooled._checked_out = True
+            return pooled
+
+    def release(self, pooled):
+        pooled._checked_out = False
+        if self._reset:
+            try:
+                self._reset(pooled._raw)
+            except Exception:
+                self._discard(pooled)
+                return
+        if self._expired(pooled):
+            with self._cond:
+                self._stats['recycled'] += 1
+            self._discard(pooled)
+            return
+        pooled.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(pooled)
+            self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            self._discard(pooled)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._size - len(self._idle)
+        stats['min_size'] = self.min_size
+        stats['max_size'] = self.max_size
+        checkouts = stats['checkouts'] or 1
+        stats['wait_time_avg_ms'] = round(stats['wait_time_total'] / checkouts * 1000, 3)
+        stats['wait_time_max_ms'] = round(stats.pop('wait_time_max') * 1000, 3)
+        stats['wait_time_total'] = round(stats['wait_time_total'], 3)
+        return stats
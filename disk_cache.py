@@ -0,0 +1,223 @@
+# disk_cache.py
+# Local disk tier for hot B2 objects (AUDIO_DISK_CACHE_DIR=/path to enable).
+# LRU within a byte budget; every object is written to a temp file and renamed into
+# place, so readers never see a partial file. Each object has a <name>.meta JSON file
+# (key, etag, last modified) so the index survives restarts. The index lives in this process -
+# worker processes sharing a directory each keep their own budget, and a file evicted
+# by another worker is simply a miss here.
+# With revalidate_seconds set, get() re-checks an entry's etag against the source once it
+# has not been checked for that long (and after a restart), so an object replaced in the
+# source - or deleted from the cache by another worker only - is served stale for at most that long.
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ObjectTooLarge(ValueError):
+    pass
+
+
+class DiskCache:
+    def __init__(self, directory, max_bytes, max_object_bytes=None, prefetch_workers=2,
+                 revalidate_seconds=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_object_bytes = max_object_bytes or max_bytes // 4
+        self.revalidate_seconds = revalidate_seconds
+        self._entries = OrderedDict()   # key -> {"path", "size", "etag", "last_modified", "checked_at"}
+        self._size = 0
+        self._lock = threading.Lock()
+        self._inflight = set()
+        self._too_large = set()         # keys never worth fetching again
+        self._executor = ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix="disk-cache-fill")
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'fills': 0,
+            'failed_fills': 0,
+            'evictions': 0,
+            'revalidations': 0,
+            'stale': 0,           # entries dropped because the source changed
+            'bytes_served': 0,    # bytes sent from disk instead of B2
+            'bytes_filled': 0,    # bytes downloaded from B2 into the cache
+        }
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def _load(self):
+        """Index what is already on disk, least recently used first"""
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.meta'):
+                continue
+            meta_path = os.path.join(self.directory, name)
+            try:
+                with open(meta_path, encoding='utf-8') as f:
+                    meta = json.load(f)
+                path = meta_path[:-len('.meta')]
+                found.append((os.path.getatime(path), meta['key'], {
+                    'path': path,
+                    'size': os.path.getsize(path),
+                    'etag': meta.get('etag'),
+                    'last_modified': meta.get('last_modified'),
+                    'checked_at': 0,     # not checked by this process yet
+                }))
+            except (OSError, ValueError, KeyError):
+                continue
+        for _, key, entry in sorted(found, key=lambda item: item[0]):
+            self._entries[key] = entry
+            self._size += entry['size']
+        with self._lock:
+            self._evict()
+
+    def _remove_files(self, path):
+        for name in (path, path + '.meta'):
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._size -= entry['size']
+            self._stats['evictions'] += 1
+            self._remove_files(entry['path'])
+
+    ######## lookups ########
+    def get(self, key, current_etag=None):
+        """Entry dict for a cached object, or None. current_etag() returns the source's
+        etag (None if the object is gone); it is called when the entry is due a revalidation."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not os.path.exists(entry['path']):
+                del self._entries[key]
+                self._size -= entry['size']
+                entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            entry = dict(entry)
+            due = (current_etag is not None and self.revalidate_seconds is not None
+                   and time.time() - entry['checked_at'] >= self.revalidate_seconds)
+
+        if due:
+            try:
+                etag = current_etag()
+            except Exception as e:
+                print(f"❌ Disk cache revalidation failed for {key}: {e}")
+                etag = entry['etag']     # serve the copy, check again next time
+            else:
+                with self._lock:
+                    self._stats['revalidations'] += 1
+                    if etag == entry['etag'] and key in self._entries:
+                        self._entries[key]['checked_at'] = time.time()
+            if etag != entry['etag']:
+                self.delete(key)
+                with self._lock:
+                    self._stats['stale'] += 1
+                    self._stats['misses'] += 1
+                return None
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+        return entry
+
+    def record_served(self, nbytes):
+        with self._lock:
+            self._stats['bytes_served'] += nbytes
+
+    ######## updates ########
+    def put(self, key, chunks, etag=None, last_modified=None):
+        """Store an object from an iterable of byte chunks; returns the entry"""
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.max_object_bytes:
+                        raise ObjectTooLarge(f"object larger than {self.max_object_bytes} bytes")
+                    f.write(chunk)
+            meta_fd, meta_tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+            with os.fdopen(meta_fd, 'w', encoding='utf-8') as f:
+                json.dump({'key': key, 'etag': etag, 'last_modified': last_modified}, f)
+            os.replace(tmp_path, path)
+            os.replace(meta_tmp, path + '.meta')
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        entry = {'path': path, 'size': size, 'etag': etag, 'last_modified': last_modified,
+                 'checked_at': time.time()}
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old['size']
+            self._entries[key] = entry
+            self._size += size
+            self._stats['fills'] += 1
+            self._stats['bytes_filled'] += size
+            self._evict()
+        return dict(entry)
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size -= entry['size']
+            self._too_large.discard(key)
+        self._remove_files(self._path(key))
+
+    def prefetch(self, key, fetch):
+        """Fill key in the background; fetch() -> (chunks, etag, last_modified).
+        Does nothing if the key is cached or already being fetched."""
+        with self._lock:
+            if key in self._entries or key in self._inflight or key in self._too_large:
+                return False
+            self._inflight.add(key)
+
+        def run():
+            try:
+                chunks, etag, last_modified = fetch()
+                self.put(key, chunks, etag, last_modified)
+            except ObjectTooLarge:
+                with self._lock:
+                    self._too_large.add(key)
+            except Exception as e:
+                with self._lock:
+                    self._stats['failed_fills'] += 1
+                print(f"❌ Disk cache fill failed for {key}: {e}")
+            finally:
+                with self._lock:
+                    self._inflight.discard(key)
+
+        self._executor.submit(run)
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'objects': len(self._entries),
+                'size_bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'prefetching': len(self._inflight),
+            })
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else None
+        return stats
@@ -0,0 +1,260 @@
+# media.py
+# Post-upload processing of chapter audio with ffmpeg. Output is stored next to the original:
+#   <book folder>/aud001.mp3
+#   <book folder>/aud001_hls/index.m3u8, seg_00000.ts, ...   HlsSegmenter (HLS_SEGMENTING=true)
+#   <book folder>/aud001_32k.mp3, aud001_64k.mp3, ...         Transcoder (TRANSCODING=true)
+# HLS segments are cut without re-encoding (-c:a copy); renditions are MP3 at fixed bitrates.
+# Jobs run on small thread pools in the background. The work happens in the ffmpeg child
+# processes, so the pool size is the number of ffmpeg processes running at once.
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+PLAYLIST_NAME = 'index.m3u8'
+CONTENT_TYPES = {
+    '.mp3': 'audio/mpeg',
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+}
+
+
+def ffmpeg_path():
+    """ffmpeg binary (FFMPEG_PATH or the one on PATH), None if not installed"""
+    return shutil.which(os.getenv('FFMPEG_PATH', 'ffmpeg'))
+
+
+def hls_prefix(key):
+    """'Book/aud001.mp3' -> 'Book/aud001_hls/'"""
+    return f"{os.path.splitext(key)[0]}_hls/"
+
+
+def run_ffmpeg(args, timeout):
+    """Run ffmpeg with args; raises RuntimeError with the end of stderr on failure"""
+    result = subprocess.run(
+        [ffmpeg_path() or 'ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin', '-y', *args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        timeout=timeout
+    )
+    if result.returncode != 0:
+        error = result.stderr.decode('utf-8', 'replace').strip()[-500:]
+        raise RuntimeError(f"ffmpeg exited with {result.returncode}: {error}")
+
+
+def segment_to_hls(source, out_dir, segment_seconds, timeout=None):
+    """Split source into out_dir/index.m3u8 + out_dir/seg_NNNNN.ts (stream copy, VOD playlist)"""
+    run_ffmpeg([
+        '-i', source,
+        '-vn', '-c:a', 'copy',
+        '-f', 'hls',
+        '-hls_time', str(segment_seconds),
+        '-hls_playlist_type', 'vod',
+        '-hls_list_size', '0',
+        '-hls_segment_filename', os.path.join(out_dir, 'seg_%05d.ts'),
+        os.path.join(out_dir, PLAYLIST_NAME),
+    ], timeout)
+    return os.path.join(out_dir, PLAYLIST_NAME)
+
+
+def rendition_key(key, kbps):
+    """'Book/aud001.mp3', 64 -> 'Book/aud001_64k.mp3'"""
+    return f"{os.path.splitext(key)[0]}_{kbps}k.mp3"
+
+
+def rendition_options(kbps):
+    """Extra encoder options for a bitrate - low bitrates are for speech, so go mono"""
+    if kbps <= 32:
+        return ['-ac', '1', '-ar', '22050']
+    if kbps < 96:
+        return ['-ac', '1']
+    return []
+
+
+def transcode_renditions(source, outputs, timeout=None):
+    """Encode source to MP3 once per (path, kbps) in outputs - a single ffmpeg run, decoding once"""
+    args = ['-i', source]
+    for path, kbps in outputs:
+        args += ['-map', '0:a', '-c:a', 'libmp3lame', '-b:a', f'{kbps}k', *rendition_options(kbps), path]
+    run_ffmpeg(args, timeout)
+
+
+def rewrite_playlist(text, sign):
+    """Replace every segment URI in a media playlist with sign(uri)"""
+    lines = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped and not stripped.startswith('#'):
+            line = sign(stripped)
+        lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+class MediaJobs(ABC):
+    """Background ffmpeg jobs on chapter audio stored in B2, one job per chapter.
+    Subclasses implement process(chapter_id, key) and call on_ready when done."""
+
+    name = 'media'
+
+    def __init__(self, s3, bucket, on_ready, workers=2, timeout=900):
+        self.s3 = s3
+        self.bucket = bucket
+        self.on_ready = on_ready
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=self.name)
+        self._lock = threading.Lock()
+        self._inflight = set()
+        self._stats = {
+            'queued': 0,
+            'done': 0,
+            'failed': 0,
+            'seconds': 0.0,    # wall time spent in finished jobs
+            'last_error': None,
+        }
+
+    def submit(self, chapter_id, key):
+        """Queue a chapter; does nothing if it is already queued or running"""
+        with self._lock:
+            if chapter_id in self._inflight:
+                return False
+            self._inflight.add(chapter_id)
+            self._stats['queued'] += 1
+        self._executor.submit(self._run, chapter_id, key)
+        return True
+
+    def _run(self, chapter_id, key):
+        started = time.time()
+        try:
+            summary = self.process(chapter_id, key)
+            with self._lock:
+                self._stats['done'] += 1
+                self._stats['seconds'] += time.time() - started
+            print(f"✅ {self.name} done for chapter {chapter_id}: {summary}")
+        except Exception as e:
+            with self._lock:
+                self._stats['failed'] += 1
+                self._stats['last_error'] = f"chapter {chapter_id}: {e}"
+            print(f"❌ {self.name} failed for chapter {chapter_id}: {e}")
+        finally:
+            with self._lock:
+                self._inflight.discard(chapter_id)
+
+    @abstractmethod
+    def process(self, chapter_id, key):
+        """Do the job for one chapter; returns a short summary for the log"""
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._stats[name] = self._stats.get(name, 0) + n
+
+    def download(self, key, work_dir):
+        """Copy the original to work_dir, returns the local path"""
+        source = os.path.join(work_dir, 'source' + (os.path.splitext(key)[1] or '.mp3'))
+        self.s3.download_file(self.bucket, key, source)
+        return source
+
+    def upload(self, path, key):
+        content_type = CONTENT_TYPES.get(os.path.splitext(key)[1], 'application/octet-stream')
+        self.s3.upload_file(path, self.bucket, key, ExtraArgs={'ContentType': content_type})
+
+    def list_objects(self, prefix):
+        """{key: size} of the objects stored under prefix"""
+        objects = {}
+        for page in self.s3.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                objects[obj['Key']] = obj['Size']
+        return objects
+
+    def delete(self, keys):
+        keys = list(keys)
+        for start in range(0, len(keys), 1000):   # delete_objects takes up to 1000 keys
+            self.s3.delete_objects(Bucket=self.bucket, Delete={
+                'Objects': [{'Key': key} for key in keys[start:start + 1000]],
+                'Quiet': True,
+            })
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['running'] = len(self._inflight)
+        stats['seconds'] = round(stats['seconds'], 2)
+        return stats
+
+
+class HlsSegmenter(MediaJobs):
+    """on_ready(chapter_id, playlist_key, bytes_added, objects_added) is called once the
+    playlist and segments are uploaded. Segmenting a chapter again overwrites its
+    segments and deletes the ones left over, so the counts are the net change."""
+
+    name = 'hls-segment'
+
+    def __init__(self, s3, bucket, on_ready, workers=2, segment_seconds=6,
+                 timeout=900, upload_workers=8):
+        super().__init__(s3, bucket, on_ready, workers, timeout)
+        self.segment_seconds = segment_seconds
+        self.upload_workers = upload_workers
+
+    def process(self, chapter_id, key):
+        """Download, segment and upload one chapter"""
+        prefix = hls_prefix(key)
+        previous = self.list_objects(prefix)
+        # Only a finished run (the playlist is uploaded last) was reported to on_ready -
+        # the leftovers of a failed one never were
+        previous_bytes = sum(previous.values()) if prefix + PLAYLIST_NAME in previous else 0
+        previous_objects = len(previous) if prefix + PLAYLIST_NAME in previous else 0
+        with tempfile.TemporaryDirectory(prefix='hls-') as work_dir:
+            source = self.download(key, work_dir)
+            out_dir = os.path.join(work_dir, 'out')
+            os.makedirs(out_dir)
+            segment_to_hls(source, out_dir, self.segment_seconds, self.timeout)
+
+            names = sorted(name for name in os.listdir(out_dir) if name != PLAYLIST_NAME)
+            with ThreadPoolExecutor(max_workers=self.upload_workers) as uploads:
+                list(uploads.map(lambda name: self.upload(os.path.join(out_dir, name), prefix + name), names))
+            # The playlist goes last, so it never points at a segment that is not there yet
+            self.upload(os.path.join(out_dir, PLAYLIST_NAME), prefix + PLAYLIST_NAME)
+
+            total_bytes = sum(os.path.getsize(os.path.join(out_dir, name)) for name in names + [PLAYLIST_NAME])
+        stale = set(previous) - {prefix + name for name in names + [PLAYLIST_NAME]}
+        if stale:
+            self.delete(stale)
+            self.count('deleted', len(stale))
+        self.on_ready(chapter_id, prefix + PLAYLIST_NAME, total_bytes - previous_bytes,
+                      len(names) + 1 - previous_objects)
+        self.count('segments', len(names))
+        return f"{len(names)} segments"
+
+
+class Transcoder(MediaJobs):
+    """MP3 renditions of a chapter at fixed bitrates (kbps). A rendition that is not
+    smaller than the original is dropped. on_ready(chapter_id, [(kbps, key, size)])
+    is called with the renditions that were uploaded."""
+
+    name = 'transcode'
+
+    def __init__(self, s3, bucket, on_ready, bitrates=(32, 64, 128), workers=2, timeout=1800):
+        super().__init__(s3, bucket, on_ready, workers, timeout)
+        self.bitrates = sorted(bitrates)
+
+    def process(self, chapter_id, key):
+        with tempfile.TemporaryDirectory(prefix='transcode-') as work_dir:
+            source = self.download(key, work_dir)
+            source_size = os.path.getsize(source)
+            outputs = [(os.path.join(work_dir, f'{kbps}k.mp3'), kbps) for kbps in self.bitrates]
+            transcode_renditions(source, outputs, self.timeout)
+
+            renditions = []
+            for path, kbps in outputs:
+                size = os.path.getsize(path)
+                if size >= source_size:
+                    self.count('skipped')
+                    continue
+                self.upload(path, rendition_key(key, kbps))
+                renditions.append((kbps, rendition_key(key, kbps), size))
+        self.on_ready(chapter_id, renditions)
+        self.count('renditions', len(renditions))
+        return f"{[kbps for kbps, _, _ in renditions]} kbps"
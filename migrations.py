@@ -0,0 +1,276 @@
+# migrations.py
+# Schema additions (indexes, columns, triggers) used by app.py.
+# Each migration runs once and is recorded in schema_migrations.
+# app.py applies pending migrations at startup (MIGRATE_ON_START=true, the default);
+# they can also be run by hand:
+#   python migrations.py
+from contextlib import contextmanager
+
+import base as b
+
+MIGRATION_LOCK_KEY = 7301   # pg_advisory_lock key / GET_LOCK name suffix
+
+MIGRATIONS = {
+    'mysql': [
+        ("books_title_id_index", [
+            # Keyset pagination on GET /books seeks on (title, id)
+            "CREATE INDEX idx_books_title_id ON books (title, id)",
+        ]),
+        ("chapters_book_id_number_index", [
+            # GET /books fetches the chapters of a page with WHERE book_id IN (...)
+            "CREATE INDEX idx_chapters_book_id_number ON chapters (book_id, chapter_number)",
+        ]),
+        ("app_state", [
+            # Shared counters/timestamps, e.g. catalogue_version for search_index.py
+            """
+            CREATE TABLE IF NOT EXISTS app_state (
+                name VARCHAR(100) PRIMARY KEY,
+                counter BIGINT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            "INSERT INTO app_state (name, counter) VALUES ('catalogue_version', 0)",
+        ]),
+        ("storage_ledger", [
+            # Bytes per book in B2 for /api/get-storage-usage - see storage_ledger.py
+            """
+            CREATE TABLE IF NOT EXISTS storage_ledger (
+                book_id BIGINT PRIMARY KEY,
+                bytes BIGINT NOT NULL DEFAULT 0,
+                objects INT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            "INSERT INTO app_state (name, counter, updated_at) VALUES ('storage_reconciled_at', 0, NULL)",
+        ]),
+        ("access_history_session_bucket", [
+            # record_audio_play upserts one row per user/book/chapter and play window;
+            # chapter_key maps a NULL chapter to 0 so it takes part in the unique key.
+            # Older rows keep session_bucket NULL and never conflict.
+            "ALTER TABLE access_history ADD COLUMN session_bucket BIGINT NULL",
+            "ALTER TABLE access_history ADD COLUMN chapter_key BIGINT AS (COALESCE(chapter_id, 0)) STORED",
+            """
+            CREATE UNIQUE INDEX uq_access_history_session
+            ON access_history (user_id, book_id, chapter_key, session_bucket)
+            """,
+        ]),
+        ("chapters_hls_playlist", [
+            # Bucket key of the chapter's HLS playlist, NULL until media.py has segmented it
+            "ALTER TABLE chapters ADD COLUMN hls_playlist VARCHAR(1024) NULL",
+        ]),
+        ("chapter_renditions", [
+            # Lower bitrate copies of a chapter made by media.Transcoder
+            """
+            CREATE TABLE IF NOT EXISTS chapter_renditions (
+                chapter_id BIGINT NOT NULL,
+                kbps INT NOT NULL,
+                object_key VARCHAR(1024) NOT NULL,
+                size_bytes BIGINT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (chapter_id, kbps)
+            )
+            """,
+        ]),
+        ("chapters_audio_metadata", [
+            # Filled from the MP3 headers at upload time - see audio_meta.py
+            """
+            ALTER TABLE chapters
+                ADD COLUMN duration_seconds DOUBLE NULL,
+                ADD COLUMN bitrate_kbps INT NULL,
+                ADD COLUMN sample_rate INT NULL,
+                ADD COLUMN channels SMALLINT NULL
+            """,
+        ]),
+        ("storage_reconcile_lock", [
+            # Cross-worker lock of storage_ledger.reconcile (updated_at NULL = free)
+            "INSERT INTO app_state (name, counter, updated_at) VALUES ('storage_reconcile_lock', 0, NULL)",
+        ]),
+    ],
+    'postgresql': [
+        ("books_title_id_index", [
+            "CREATE INDEX IF NOT EXISTS idx_books_title_id ON books (title, id)",
+        ]),
+        ("chapters_book_id_number_index", [
+            "CREATE INDEX IF NOT EXISTS idx_chapters_book_id_number ON chapters (book_id, chapter_number)",
+        ]),
+        ("books_full_text_search", [
+            # get_books_with_search: tsvector over title, author and category name
+            "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+            "ALTER TABLE books ADD COLUMN IF NOT EXISTS search_vector tsvector",
+            """
+            CREATE OR REPLACE FUNCTION books_search_vector_update() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector :=
+                    setweight(to_tsvector('simple', coalesce(NEW.title::text, '')), 'A') ||
+                    setweight(to_tsvector('simple', coalesce(NEW.author::text, '')), 'B') ||
+                    setweight(to_tsvector('simple', coalesce(
+                        (SELECT name::text FROM categories WHERE id = NEW.category_id), '')), 'C');
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+            """,
+            "DROP TRIGGER IF EXISTS books_search_vector_trigger ON books",
+            """
+            CREATE TRIGGER books_search_vector_trigger
+            BEFORE INSERT OR UPDATE OF title, author, category_id ON books
+            FOR EACH ROW EXECUTE FUNCTION books_search_vector_update()
+            """,
+            # Renaming a category refreshes the vectors of its books
+            """
+            CREATE OR REPLACE FUNCTION categories_search_vector_update() RETURNS trigger AS $$
+            BEGIN
+                UPDATE books SET category_id = category_id WHERE category_id = NEW.id;
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+            """,
+            "DROP TRIGGER IF EXISTS categories_search_vector_trigger ON categories",
+            """
+            CREATE TRIGGER categories_search_vector_trigger
+            AFTER UPDATE OF name ON categories
+            FOR EACH ROW EXECUTE FUNCTION categories_search_vector_update()
+            """,
+            # Backfill existing rows through the trigger
+            "UPDATE books SET category_id = category_id",
+            "CREATE INDEX IF NOT EXISTS idx_books_search_vector ON books USING GIN (search_vector)",
+            "CREATE INDEX IF NOT EXISTS idx_books_title_trgm ON books USING GIN ((title::text) gin_trgm_ops)",
+            "CREATE INDEX IF NOT EXISTS idx_books_author_trgm ON books USING GIN ((author::text) gin_trgm_ops)",
+        ]),
+        ("app_state", [
+            # Shared counters/timestamps, e.g. catalogue_version for search_index.py
+            """
+            CREATE TABLE IF NOT EXISTS app_state (
+                name VARCHAR(100) PRIMARY KEY,
+                counter BIGINT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            "INSERT INTO app_state (name, counter) VALUES ('catalogue_version', 0)",
+        ]),
+        ("storage_ledger", [
+            # Bytes per book in B2 for /api/get-storage-usage - see storage_ledger.py
+            """
+            CREATE TABLE IF NOT EXISTS storage_ledger (
+                book_id BIGINT PRIMARY KEY,
+                bytes BIGINT NOT NULL DEFAULT 0,
+                objects INT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            "INSERT INTO app_state (name, counter, updated_at) VALUES ('storage_reconciled_at', 0, NULL)",
+        ]),
+        ("access_history_session_bucket", [
+            "ALTER TABLE access_history ADD COLUMN IF NOT EXISTS session_bucket BIGINT",
+            """
+            ALTER TABLE access_history ADD COLUMN IF NOT EXISTS chapter_key BIGINT
+            GENERATED ALWAYS AS (COALESCE(chapter_id, 0)) STORED
+            """,
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_access_history_session
+            ON access_history (user_id, book_id, chapter_key, session_bucket)
+            """,
+        ]),
+        ("chapters_hls_playlist", [
+            "ALTER TABLE chapters ADD COLUMN IF NOT EXISTS hls_playlist TEXT",
+        ]),
+        ("chapter_renditions", [
+            """
+            CREATE TABLE IF NOT EXISTS chapter_renditions (
+                chapter_id BIGINT NOT NULL,
+                kbps INT NOT NULL,
+                object_key TEXT NOT NULL,
+                size_bytes BIGINT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (chapter_id, kbps)
+            )
+            """,
+        ]),
+        ("chapters_audio_metadata", [
+            """
+            ALTER TABLE chapters
+                ADD COLUMN IF NOT EXISTS duration_seconds DOUBLE PRECISION,
+                ADD COLUMN IF NOT EXISTS bitrate_kbps INTEGER,
+                ADD COLUMN IF NOT EXISTS sample_rate INTEGER,
+                ADD COLUMN IF NOT EXISTS channels SMALLINT
+            """,
+        ]),
+        ("storage_reconcile_lock", [
+            "INSERT INTO app_state (name, counter, updated_at) VALUES ('storage_reconcile_lock', 0, NULL)",
+        ]),
+    ],
+}
+
+
+def applied_migrations():
+    b.db_execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            name VARCHAR(100) PRIMARY KEY,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    rows = b.universal_db_select("SELECT name FROM schema_migrations")
+    return {row['name'] for row in rows}
+
+
+@contextmanager
+def migration_lock():
+    """Session lock on a dedicated connection, so workers starting together apply
+    the migrations one after the other"""
+    connection = b.get_pool().acquire()
+    cursor = connection.cursor()
+    try:
+        if b.DB_TYPE == 'postgresql':
+            cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        else:
+            cursor.execute("SELECT GET_LOCK(%s, 600)", (f"schema_migrations_{MIGRATION_LOCK_KEY}",))
+        cursor.fetchall()
+        connection.commit()
+        yield
+    finally:
+        try:
+            if b.DB_TYPE == 'postgresql':
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+            else:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (f"schema_migrations_{MIGRATION_LOCK_KEY}",))
+            cursor.fetchall()
+            connection.commit()
+        finally:
+            cursor.close()
+            connection.close()
+
+
+def run_migrations():
+    """Apply pending migrations for the configured DB_TYPE. Returns the names applied."""
+    migrations = MIGRATIONS.get(b.DB_TYPE)
+    if migrations is None:
+        print(f"❌ No migrations for database type: {b.DB_TYPE}")
+        return []
+
+    with migration_lock():
+        return _apply(migrations)
+
+
+def pending_migrations():
+    """Names of the migrations not applied yet"""
+    done = applied_migrations()
+    return [name for name, _ in MIGRATIONS.get(b.DB_TYPE, []) if name not in done]
+
+
+def _apply(migrations):
+    done = applied_migrations()
+    applied = []
+    for name, statements in migrations:
+        if name in done:
+            continue
+        for statement in statements:
+            if not b.db_execute(statement):
+                print(f"❌ Migration failed: {name}")
+                return applied
+        b.db_insert("INSERT INTO schema_migrations (name) VALUES (%s)", (name,))
+        print(f"✅ Migration applied: {name}")
+        applied.append(name)
+    return applied
+
+
+if __name__ == "__main__":
+    run_migrations()
@@ -0,0 +1,132 @@
+# playback_buffer.py
+# Write-behind buffer for playback progress (PLAYBACK_WRITE_BEHIND=true).
+# Keeps only the latest update per key and writes them in one batch from a
+# background thread - on a timer, when the buffer fills up, and at shutdown.
+# When a batch fails its rows are retried one by one; a row that keeps failing
+# is dropped after max_attempts flushes instead of being re-queued forever.
+import atexit
+import threading
+import time
+
+
+class WriteBehindBuffer:
+    def __init__(self, flush_fn, flush_interval=5.0, max_size=500, name="write-behind", max_attempts=5):
+        """flush_fn(list of (key, value)) writes one batch; it raises on failure"""
+        self.flush_fn = flush_fn
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.max_attempts = max_attempts
+        self.name = name
+        self._pending = {}
+        self._attempts = {}   # key -> failed flushes of its pending value
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stats = {
+            'updates': 0,
+            'coalesced': 0,
+            'flushes': 0,
+            'rows_flushed': 0,
+            'failed_flushes': 0,
+            'failed_rows': 0,
+            'dropped_rows': 0,
+            'last_flush_ms': None,
+            'max_flush_ms': 0.0,
+            'last_flush_at': None,
+        }
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._pending:
+                self._stats['coalesced'] += 1
+            self._pending[key] = value
+            self._attempts.pop(key, None)   # a new value gets a fresh set of attempts
+            self._stats['updates'] += 1
+            full = len(self._pending) >= self.max_size
+        if full:
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Write everything pending; returns the number of rows written"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+
+            started = time.monotonic()
+            items = list(batch.items())
+            failed = []
+            try:
+                self.flush_fn(items)
+                written = len(items)
+            except Exception as e:
+                print(f"❌ {self.name} flush failed ({len(items)} rows): {e}")
+                with self._lock:
+                    self._stats['failed_flushes'] += 1
+                if len(items) == 1:
+                    failed = items
+                else:
+                    # One bad row fails the whole batch - find it by writing the rows one at a time
+                    failed = self._flush_rows(items)
+                written = len(items) - len(failed)
+
+            elapsed_ms = (time.monotonic() - started) * 1000
+            with self._lock:
+                self._requeue(failed)
+                if written:
+                    self._stats['flushes'] += 1
+                    self._stats['rows_flushed'] += written
+                    self._stats['last_flush_ms'] = round(elapsed_ms, 3)
+                    self._stats['max_flush_ms'] = round(max(self._stats['max_flush_ms'], elapsed_ms), 3)
+                    self._stats['last_flush_at'] = time.time()
+            return written
+
+    def _flush_rows(self, items):
+        """Write items one by one; returns the ones that failed"""
+        failed = []
+        for item in items:
+            try:
+                self.flush_fn([item])
+            except Exception as e:
+                print(f"❌ {self.name} row {item[0]} failed: {e}")
+                failed.append(item)
+        return failed
+
+    def _requeue(self, failed):
+        """Put failed rows back (unless a newer update arrived meanwhile) or drop them
+        once they have failed max_attempts times. Called with _lock held."""
+        for key, value in failed:
+            self._stats['failed_rows'] += 1
+            if key in self._pending:
+                continue
+            attempts = self._attempts.get(key, 0) + 1
+            if attempts >= self.max_attempts:
+                self._attempts.pop(key, None)
+                self._stats['dropped_rows'] += 1
+                print(f"⚠️ {self.name} dropped row {key} after {attempts} failed attempts")
+                continue
+            self._attempts[key] = attempts
+            self._pending[key] = value
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['depth'] = len(self._pending)
+        stats['flush_interval'] = self.flush_interval
+        stats['max_size'] = self.max_size
+        stats['max_attempts'] = self.max_attempts
+        return stats
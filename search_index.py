@@ -0,0 +1,356 @@
+# search_index.py
+# Optional in-memory catalogue index for GET /books?search= (CATALOGUE_INDEX=true).
+# Built from one bulk query, updated incrementally by add_book / api_upload_audio,
+# and rebuilt when app_state.catalogue_version shows another worker changed the catalogue.
+# Rebuilds run in a background thread; searches keep using the current index meanwhile.
+import bisect
+import os
+import re
+import threading
+import time
+
+import base as b
+
+TOKEN_RE = re.compile(r"[^\s\-_.,;:!?'\"()\[\]/\\&|]+")
+
+# Field weights - a title match outranks an author match, etc.
+FIELD_WEIGHTS = {'title': 8, 'author': 4, 'category': 2, 'chapter': 1}
+# Match quality multipliers
+EXACT, PREFIX, TYPO = 3, 2, 1
+TYPO_MIN_LENGTH = 4
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(str(text or '').lower())
+
+
+def deletion_variants(token):
+    """token plus every variant with one character removed (edit distance 1 lookups)"""
+    variants = {token}
+    if len(token) >= TYPO_MIN_LENGTH:
+        for i in range(len(token)):
+            variants.add(token[:i] + token[i + 1:])
+    return variants
+
+
+class CatalogueIndex:
+    """Inverted index over book title, author, category name and chapter titles"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.version = None
+        self.built_at = None
+        self.stale = False
+        self._reset()
+
+    def _reset(self):
+        self.books = {}        # book_id -> book dict as returned by GET /books
+        self.categories = {}   # category_id -> name
+        self.postings = {}     # token -> {book_id: best field weight}
+        self.sorted_tokens = []
+        self.deletes = {}      # deletion variant -> set(token)
+
+    def _add_token(self, token, book_id, weight):
+        postings = self.postings.get(token)
+        if postings is None:
+            postings = self.postings[token] = {}
+            bisect.insort(self.sorted_tokens, token)
+            for variant in deletion_variants(token):
+                self.deletes.setdefault(variant, set()).add(token)
+        if postings.get(book_id, 0) < weight:
+            postings[book_id] = weight
+
+    def _index_text(self, book_id, field, text):
+        weight = FIELD_WEIGHTS[field]
+        for token in tokenize(text):
+            self._add_token(token, book_id, weight)
+
+    ######## updates ########
+    def build(self, rows, version=None):
+        """rows: one per book/chapter pair (book_id, book_title, author, category_id,
+        category_name, chapter_id, chapter_number, chapter_title, chapter_duration)"""
+        # Indexed into a new object and swapped in, so searches are not blocked meanwhile
+        fresh = CatalogueIndex()
+        fresh.load(rows)
+        with self.lock:
+            self.books = fresh.books
+            self.categories = fresh.categories
+            self.postings = fresh.postings
+            self.sorted_tokens = fresh.sorted_tokens
+            self.deletes = fresh.deletes
+            self.version = version
+            self.built_at = time.time()
+            self.stale = False
+
+    def load(self, rows):
+        with self.lock:
+            for row in rows:
+                book = self.books.get(row['book_id'])
+                if book is None:
+                    self.add_book({
+                        'id': row['book_id'],
+                        'title': row['book_title'],
+                        'author': row.get('author', ''),
+                        'category_id': row.get('category_id'),
+                        'category_name': row.get('category_name', ''),
+                    })
+                if row.get('chapter_id'):
+                    self.add_chapter(row['book_id'], {
+                        'id': row['chapter_id'],
+                        'chapter_number': row['chapter_number'],
+                        'title': row['chapter_title'],
+                        'duration': row.get('chapter_duration'),
+                    })
+
+    def add_book(self, book):
+        with self.lock:
+            book = dict(book)
+            book.setdefault('chapters', [])
+            if book.get('category_id') is not None and book.get('category_name'):
+                self.categories[book['category_id']] = book['category_name']
+            self.books[book['id']] = book
+            self._index_text(book['id'], 'title', book.get('title'))
+            self._index_text(book['id'], 'author', book.get('author'))
+            self._index_text(book['id'], 'category', book.get('category_name'))
+
+    def add_chapter(self, book_id, chapter):
+        with self.lock:
+            book = self.books.get(book_id)
+            if book is None:
+                return False
+            book['chapters'].append(chapter)
+            book['chapters'].sort(key=lambda c: (c.get('chapter_number') is None, c.get('chapter_number') or 0))
+            self._index_text(book_id, 'chapter', chapter.get('title'))
+            return True
+
+    ######## lookups ########
+    def _matches(self, token):
+        """book_id -> score for one query token (exact, prefix and one-typo matches)"""
+        scores = {}
+
+        def add(tok, quality):
+            for book_id, weight in self.postings.get(tok, {}).items():
+                score = weight * quality
+                if scores.get(book_id, 0) < score:
+                    scores[book_id] = score
+
+        add(token, EXACT)
+
+        i = bisect.bisect_left(self.sorted_tokens, token)
+        while i < len(self.sorted_tokens) and self.sorted_tokens[i].startswith(token):
+            if self.sorted_tokens[i] != token:
+                add(self.sorted_tokens[i], PREFIX)
+            i += 1
+
+        if len(token) >= TYPO_MIN_LENGTH:
+            candidates = set()
+            for variant in deletion_variants(token):
+                candidates |= self.deletes.get(variant, set())
+            candidates.discard(token)
+            for candidate in candidates:
+                add(candidate, TYPO)
+        return scores
+
+    def search(self, text):
+        """Book ids matching every word of text, best matches first"""
+        tokens = tokenize(text)
+        if not tokens:
+            return []
+        with self.lock:
+            totals = None
+            for token in tokens:
+                scores = self._matches(token)
+                if totals is None:
+                    totals = scores
+                else:
+                    totals = {book_id: totals[book_id] + score
+                              for book_id, score in scores.items() if book_id in totals}
+                if not totals:
+                    return []
+            return sorted(totals, key=lambda book_id: (-totals[book_id],
+                                                       str(self.books[book_id]['title']).lower(),
+                                                       book_id))
+
+    def get_books(self, book_ids):
+        with self.lock:
+            return [dict(self.books[book_id], chapters=list(self.books[book_id]['chapters']))
+                    for book_id in book_ids if book_id in self.books]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "books": len(self.books),
+                "tokens": len(self.postings),
+                "version": self.version,
+                "stale": self.stale,
+                "built_at": self.built_at,
+            }
+
+
+######## module level index ########
+# CATALOGUE_INDEX=true                   - enable the index
+# CATALOGUE_INDEX_CHECK_SECONDS (30)     - how often to compare versions with the database
+_index = CatalogueIndex()
+_build_lock = threading.Lock()
+_last_check = 0.0
+
+BULK_QUERY = """
+    SELECT
+        b.id as book_id,
+        b.title as book_title,
+        b.author,
+        b.category_id,
+        cat.name as category_name,
+        c.id as chapter_id,
+        c.chapter_number,
+        c.title as chapter_title,
+        c.duration_seconds as chapter_duration
+    FROM books b
+    LEFT JOIN categories cat ON b.category_id = cat.id
+    LEFT JOIN chapters c ON b.id = c.book_id
+    ORDER BY b.id, c.chapter_number
+"""
+
+
+def enabled():
+    return os.getenv('CATALOGUE_INDEX', 'false').lower() == 'true'
+
+
+def get_version():
+    rows = b.universal_db_select("SELECT counter FROM app_state WHERE name = 'catalogue_version'")
+    return rows[0]['counter'] if rows else None
+
+
+def _build():
+    # A failed query raises and leaves the index as it was (unbuilt: searches use SQL)
+    started = time.time()
+    version = get_version()
+    rows = b.universal_db_select(BULK_QUERY, raise_errors=True)
+    _index.build(rows, version)
+    print(f"✅ Catalogue index built: {len(_index.books)} books in {time.time() - started:.2f}s")
+
+
+def rebuild():
+    """Rebuild the whole index from one bulk query; False if the query failed"""
+    with _build_lock:
+        try:
+            _build()
+            return True
+        except Exception as e:
+            print(f"❌ Catalogue index build failed: {e}")
+            return False
+
+
+def rebuild_in_background():
+    """Start a rebuild unless one is already running; False if one is"""
+    if not _build_lock.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            _build()
+        except Exception as e:
+            print(f"❌ Catalogue index rebuild failed: {e}")
+        finally:
+            _build_lock.release()
+
+    threading.Thread(target=run, name="catalogue-index-rebuild", daemon=True).start()
+    return True
+
+
+def start():
+    """Build the index in the background at startup"""
+    if enabled():
+        threading.Thread(target=rebuild, name="catalogue-index-build", daemon=True).start()
+
+
+def ready():
+    """True when the index can answer searches. If another worker changed the catalogue
+    a rebuild is started in the background and the current index answers until it is done."""
+    global _last_check
+    if not enabled():
+        return False
+
+    interval = float(os.getenv('CATALOGUE_INDEX_CHECK_SECONDS', '30'))
+    if _index.built_at is None:
+        # The build at startup failed - retry now and then, SQL answers meanwhile
+        if time.time() - _last_check >= interval:
+            _last_check = time.time()
+            rebuild_in_background()
+        return False
+
+    if time.time() - _last_check >= interval:
+        _last_check = time.time()
+        version = get_version()
+        if version is not None and version != _index.version:
+            _index.stale = True
+    if _index.stale:
+        rebuild_in_background()
+    return True
+
+
+def search(text):
+    return _index.search(text)
+
+
+def get_books(book_ids):
+    return _index.get_books(book_ids)
+
+
+def bump_version():
+    """Record a catalogue change so other workers rebuild; keeps this worker's index
+    current when nobody else changed the catalogue in between"""
+    b.db_update("UPDATE app_state SET counter = counter + 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'catalogue_version'")
+    version = get_version()
+    if version is None:
+        return   # app_state not migrated - no cross-worker versioning
+    with _index.lock:
+        if _index.version is not None and version == _index.version + 1:
+            _index.version = version
+        else:
+            _index.stale = True
+
+
+def book_added(book):
+    if not enabled():
+        return
+    if book.get('category_id') is not None and not book.get('category_name'):
+        name = _index.categories.get(book['category_id'])
+        if name is None:
+            rows = b.universal_db_select("SELECT name FROM categories WHERE id = %s", (book['category_id'],))
+            name = rows[0]['name'] if rows else ''
+        book = dict(book, category_name=name)
+    _index.add_book(book)
+    bump_version()
+
+
+def chapter_added(book_id, chapter):
+    if not enabled():
+        return
+    _index.add_chapter(book_id, chapter)
+    bump_version()
+
+
+def chapters_added(book_id, chapters):
+    """Several chapters of one book (bulk upload) - one version bump"""
+    if not enabled() or not chapters:
+        return
+    for chapter in chapters:
+        _index.add_chapter(book_id, chapter)
+    bump_version()
+
+
+def invalidate():
+    """Catalogue rows were changed in place (e.g. chapter durations filled in) -
+    every worker rebuilds, this one included"""
+    if not enabled():
+        return
+    bump_version()
+    with _index.lock:
+        _index.stale = True
+
+
+def stats():
+    if not enabled():
+        return {"enabled": False}
+    return dict(_index.stats(), enabled=True)
@@ -1,6 +1,7 @@
 
 import boto3
 import os
+from boto3.s3.transfer import TransferConfig
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -36,6 +37,74 @@ def check_backblaze_status():
         print(f"❌ Backblaze B2 check failed: {e}")
         return False
     
+def bucket_usage_by_folder(s3, bucket_name):
+    """Walk the whole bucket -> {top level folder: [bytes, objects]} ('' for objects at the root)"""
+    usage = {}
+    for folder, size, objects in iter_folder_usage(s3, bucket_name):
+        entry = usage.setdefault(folder, [0, 0])
+        entry[0] += size
+        entry[1] += objects
+    return usage
+
+def iter_folder_usage(s3, bucket_name):
+    """Walk the whole bucket, yielding (top level folder, bytes, objects) as soon as the
+    listing has moved past a folder. Keys are listed in order, so every folder comes
+    once - except '' (objects at the root), which is yielded once per run of root keys."""
+    continuation_token = None
+    folder, size, objects = None, 0, 0
+
+    while True:
+        if continuation_token:
+            resp = s3.list_objects_v2(Bucket=bucket_name, ContinuationToken=continuation_token)
+        else:
+            resp = s3.list_objects_v2(Bucket=bucket_name)
+
+        for obj in resp.get("Contents", []):
+            key_folder = obj["Key"].split("/", 1)[0] if "/" in obj["Key"] else ""
+            if key_folder != folder:
+                if folder is not None:
+                    yield folder, size, objects
+                folder, size, objects = key_folder, 0, 0
+            size += obj["Size"]
+            objects += 1
+
+        if resp.get("IsTruncated"):
+            continuation_token = resp.get("NextContinuationToken")
+        else:
+            break
+
+    if folder is not None:
+        yield folder, size, objects
+
+MIN_PART_SIZE = 5 * 1024 * 1024   # S3/B2 minimum for every part but the last
+
+def upload_transfer_config():
+    """Multipart settings for audio uploads - UPLOAD_PART_SIZE_MB (16) and UPLOAD_MAX_CONCURRENCY (4)"""
+    part_size = max(int(float(os.getenv('UPLOAD_PART_SIZE_MB', '16')) * 1024 * 1024), MIN_PART_SIZE)
+    return TransferConfig(
+        multipart_threshold=part_size,
+        multipart_chunksize=part_size,
+        max_concurrency=int(os.getenv('UPLOAD_MAX_CONCURRENCY', '4')),
+        use_threads=True
+    )
+
+
+class CountingReader:
+    """Read-only, non-seekable wrapper around a request body that counts the bytes read.
+    boto3 reads it one part at a time, in order; on_read(chunk) sees every chunk."""
+
+    def __init__(self, stream, on_read=None):
+        self.stream = stream
+        self.on_read = on_read
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size)
+        self.bytes_read += len(chunk)
+        if self.on_read is not None:
+            self.on_read(chunk)
+        return chunk
+
 # def check_file_exists(bucket_name, file_path):
 #     """Check if a file exists in Backblaze B2"""
 #     try:
@@ -0,0 +1,181 @@
+# storage_ledger.py
+# Bytes stored in B2 per book, kept up to date by the upload path so the admin
+# dashboard does not have to list the whole bucket. A reconciliation job re-scans
+# the bucket in the background and sets the ledger to the real totals.
+# Objects outside a known book folder are booked under book_id 0.
+# Each book's total is written as soon as the listing has passed its folder, so
+# record_upload calls made later add on top of the listed total. Only uploads
+# recorded while their own folder is being listed can be counted twice (or missed).
+# Only one reconcile runs at a time across all workers: app_state row
+# 'storage_reconcile_lock' is claimed with a conditional UPDATE and expires after
+# STORAGE_RECONCILE_LEASE_SECONDS (3600) in case the worker holding it died.
+import os
+import threading
+import time
+
+import base as b
+import storage as s
+
+_reconcile_lock = threading.Lock()
+_last_reconcile = {"started_at": None, "finished_at": None, "error": None}
+
+if b.DB_TYPE == 'mysql':
+    ADD_QUERY = """
+        INSERT INTO storage_ledger (book_id, bytes, objects, updated_at)
+        VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+        ON DUPLICATE KEY UPDATE bytes = bytes + VALUES(bytes),
+                                objects = objects + VALUES(objects),
+                                updated_at = CURRENT_TIMESTAMP
+    """
+    SET_QUERY = """
+        INSERT INTO storage_ledger (book_id, bytes, objects, updated_at)
+        VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+        ON DUPLICATE KEY UPDATE bytes = VALUES(bytes),
+                                objects = VALUES(objects),
+                                updated_at = CURRENT_TIMESTAMP
+    """
+else:
+    ADD_QUERY = """
+        INSERT INTO storage_ledger (book_id, bytes, objects, updated_at)
+        VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (book_id) DO UPDATE SET bytes = storage_ledger.bytes + EXCLUDED.bytes,
+                                            objects = storage_ledger.objects + EXCLUDED.objects,
+                                            updated_at = CURRENT_TIMESTAMP
+    """
+    SET_QUERY = """
+        INSERT INTO storage_ledger (book_id, bytes, objects, updated_at)
+        VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (book_id) DO UPDATE SET bytes = EXCLUDED.bytes,
+                                            objects = EXCLUDED.objects,
+                                            updated_at = CURRENT_TIMESTAMP
+    """
+
+
+def record_upload(book_id, size, objects=1):
+    """Add an uploaded object to the ledger"""
+    return b.db_update(ADD_QUERY, (book_id or 0, int(size), objects)) is not None
+
+
+def record_delete(book_id, size, objects=1):
+    """Remove a deleted object from the ledger"""
+    return b.db_update(ADD_QUERY, (book_id or 0, -int(size), -objects)) is not None
+
+
+if b.DB_TYPE == 'mysql':
+    RECONCILE_AGE = "TIMESTAMPDIFF(SECOND, updated_at, CURRENT_TIMESTAMP)"
+else:
+    RECONCILE_AGE = "EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - updated_at))"
+
+
+def get_usage():
+    """Totals from the ledger in one query, None if the ledger is not available"""
+    rows = b.universal_db_select(f"""
+        SELECT
+            (SELECT COALESCE(SUM(bytes), 0) FROM storage_ledger) as bytes,
+            (SELECT COALESCE(SUM(objects), 0) FROM storage_ledger) as objects,
+            (SELECT updated_at FROM app_state WHERE name = 'storage_reconciled_at') as reconciled_at,
+            (SELECT {RECONCILE_AGE} FROM app_state WHERE name = 'storage_reconciled_at') as reconcile_age
+    """)
+    if not rows:
+        return None
+    row = rows[0]
+    return {
+        "bytes": int(row['bytes']),
+        "objects": int(row['objects']),
+        "reconciled_at": row['reconciled_at'],
+        "reconcile_age": float(row['reconcile_age']) if row['reconcile_age'] is not None else None,
+    }
+
+
+def reconcile(s3, bucket_name):
+    """Re-scan the bucket and set the ledger to the real per-book totals"""
+    # Errors must stop the reconcile - an empty book list would book everything under 0
+    started_at = b.universal_db_select("SELECT CURRENT_TIMESTAMP as now", raise_errors=True)[0]['now']
+    books = b.universal_db_select("SELECT id, title, author FROM books", raise_errors=True)
+    folders = {f"{book['title']} By {book['author']}": book['id'] for book in books}
+
+    total = 0
+    other = [0, 0]   # objects outside a book folder
+    for folder, size, objects in s.iter_folder_usage(s3, bucket_name):
+        total += size
+        book_id = folders.get(folder)
+        if book_id is None:
+            other[0] += size
+            other[1] += objects
+        elif b.db_update(SET_QUERY, (book_id, size, objects)) is None:
+            raise RuntimeError(f"Could not update the ledger of book {book_id}")
+
+    with b.transaction():
+        b.db_update(SET_QUERY, (0, other[0], other[1]))
+        # Books with no objects left - rows written since the start (listed above, or
+        # recorded by uploads during the listing) are kept
+        b.db_update("UPDATE storage_ledger SET bytes = 0, objects = 0, updated_at = CURRENT_TIMESTAMP "
+                    "WHERE book_id <> 0 AND updated_at < %s", (started_at,))
+        b.db_update("UPDATE app_state SET updated_at = CURRENT_TIMESTAMP WHERE name = 'storage_reconciled_at'")
+
+    return total
+
+
+def _claim_reconcile():
+    """Take the cross-worker reconcile lock; the lock token, or None if another worker holds it"""
+    lease = float(os.getenv('STORAGE_RECONCILE_LEASE_SECONDS', '3600'))
+    claimed = b.db_update(f"""
+        UPDATE app_state SET counter = counter + 1, updated_at = CURRENT_TIMESTAMP
+        WHERE name = 'storage_reconcile_lock' AND (updated_at IS NULL OR {RECONCILE_AGE} > %s)
+    """, (lease,))
+    if not claimed:
+        return None
+    rows = b.universal_db_select("SELECT counter FROM app_state WHERE name = 'storage_reconcile_lock'")
+    return rows[0]['counter'] if rows else None
+
+
+def _release_reconcile(token):
+    # Only our own claim - after the lease ran out another worker may hold it
+    b.db_update("UPDATE app_state SET updated_at = NULL WHERE name = 'storage_reconcile_lock' AND counter = %s",
+                (token,))
+
+
+def _run_reconcile(s3, bucket_name):
+    token = None
+    try:
+        token = _claim_reconcile()
+        if token is None:
+            print("⚠️ Storage ledger reconcile already running in another worker")
+            return
+        _last_reconcile["started_at"] = time.time()
+        _last_reconcile["error"] = None
+        total = reconcile(s3, bucket_name)
+        print(f"✅ Storage ledger reconciled: {total} bytes")
+    except Exception as e:
+        _last_reconcile["error"] = str(e)
+        print(f"❌ Storage ledger reconcile failed: {e}")
+    finally:
+        if token is not None:
+            _release_reconcile(token)
+        _last_reconcile["finished_at"] = time.time()
+        _reconcile_lock.release()
+
+
+def start_reconcile(s3, bucket_name):
+    """Run reconcile() in a background thread; False if one is already running"""
+    if not _reconcile_lock.acquire(blocking=False):
+        return False
+    threading.Thread(target=_run_reconcile, args=(s3, bucket_name),
+                     name="storage-ledger-reconcile", daemon=True).start()
+    return True
+
+
+def reconcile_due(usage):
+    """True when the last reconciliation is older than STORAGE_RECONCILE_HOURS (default 24)"""
+    if usage["reconcile_age"] is None:
+        return True
+    return usage["reconcile_age"] > float(os.getenv('STORAGE_RECONCILE_HOURS', '24')) * 3600
+
+
+def reconcile_status():
+    return {
+        "running": _reconcile_lock.locked(),
+        "last_started_at": _last_reconcile["started_at"],
+        "last_finished_at": _last_reconcile["finished_at"],
+        "last_error": _last_reconcile["error"],
+    }
@@ -1,7 +1,7 @@
 # streamlit_app/admin/admin_dashboard.py
 import streamlit as st
-import requests
-from config import API_URL
+from concurrent.futures import ThreadPoolExecutor
+from components import api_client
 # from admin.uploads import upload_audio
 
 ###########
@@ -35,20 +35,20 @@ def admin_dashboard():
     #     user = st.session_state.admin_user
     #     st.success(f"Welcome back, {user['name']} ({user['email']})")
     
+    # All dashboard numbers in one concurrent fetch (cached for a few seconds)
+    metrics = load_dashboard_metrics(st.session_state.get('user_token', ''))
+
     # Quick stats cards
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        total_books = get_total_books()
-        st.metric("📚 Total Books", total_books)
+        st.metric("📚 Total Books", metrics["total_books"])
     
     with col2:
-        total_users = get_total_users()
-        st.metric("👥 Total Users", total_users)
+        st.metric("👥 Total Users", metrics["total_users"])
     
     with col3:
-        total_chapters = get_total_chapters()
-        st.metric("🎵 Total Chapters", total_chapters)
+        st.metric("🎵 Total Chapters", metrics["total_chapters"])
 
     # with col4:
     #     # pending_uploads = get_pending_uploads()
@@ -101,13 +101,13 @@ def admin_dashboard():
     with col_left:
         st.subheader("📈 System Health")
 
-        db_status = check_database_status()
+        db_status = metrics["db_status"]
         st.write(f"**Database:** {'✅ Connected' if db_status else '❌ Disconnected'}")
 
-        b2_status = check_backblaze_status()
+        b2_status = metrics["b2_status"]
         st.write(f"**Backblaze B2:** {'✅ Connected' if b2_status else '❌ Disconnected'}")
 
-        storage = get_storage_usage()
+        storage = metrics["storage"]
         if storage.get("success"):
             used = storage["used_gb"]
             quota = storage["quota_gb"]
@@ -145,60 +145,46 @@ def admin_dashboard():
 
 
 
-def get_total_books():
-    try:
-        resp = requests.get(f"{API_URL}/api/get-total-books", timeout=5)
-        data = resp.json()
-        return data.get("count", 0) if resp.status_code == 200 else 0
-    except Exception as e:
-        print(f"❌ Error fetching total books: {e}")
-        return 0
+# Dashboard metrics are fetched in parallel worker threads, so the fetchers
+# below must not call st.* - they log and return a default instead.
+DASHBOARD_CACHE_SECONDS = 15
 
-def get_total_users():
-    try:
-        resp = requests.get(f"{API_URL}/api/get-total-users", timeout=5)
-        data = resp.json()
-        return data.get("count", 0) if resp.status_code == 200 else 0
-    except Exception as e:
-        print(f"❌ Error fetching total users: {e}")
-        return 0
+@st.cache_data(ttl=DASHBOARD_CACHE_SECONDS, show_spinner=False)
+def load_dashboard_metrics(token):
+    """Counters/health from /api/dashboard-stats and storage usage, fetched concurrently.
+    token is passed in (session_state is not available in the worker threads) and is
+    part of the cache key, so cached admin figures are only returned for the same token."""
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        stats_future = executor.submit(get_dashboard_stats, token)
+        storage_future = executor.submit(get_storage_usage)
+        stats = stats_future.result()
+        storage = storage_future.result()
 
-def get_total_chapters():
-    try:
-        resp = requests.get(f"{API_URL}/api/get-total-chapters", timeout=5)
-        data = resp.json()
-        return data.get("count", 0) if resp.status_code == 200 else 0
-    except Exception as e:
-        print(f"❌ Error fetching total chapters: {e}")
-        return 0
+    counts = stats.get("counts", {})
+    return {
+        "total_books": counts.get("total_books", 0),
+        "total_users": counts.get("total_users", 0),
+        "total_chapters": counts.get("total_chapters", 0),
+        "db_status": stats.get("database_connected", False),
+        "b2_status": stats.get("backblaze_connected", False),
+        "storage": storage,
+    }
 
 
-def check_database_status():
-    """Streamlit function to check DB via API"""
+def get_dashboard_stats(token):
+    """All dashboard counters and health checks in one API call (admin only)"""
     try:
-        response = requests.get(f"{API_URL}/api/check_database_status")
-        if response.status_code == 200:
-            return response.json().get("database_connected", False)
-        return False
-    except Exception as e:
-        st.error(f"Error checking database status: {e}")
-        return False
-
-
-def check_backblaze_status():
-    """Streamlit function to check Backblaze via API"""
-    try:
-        response = requests.get(f"{API_URL}/api/check_backblaze_status")
-        if response.status_code == 200:
-            return response.json().get("backblaze_connected", False)
-        return False
+        resp = api_client.get("/api/dashboard-stats", headers={'Authorization': f"Bearer {token}"})
+        if resp.status_code == 200:
+            return resp.json()
+        return {}
     except Exception as e:
-        st.error(f"Error checking Backblaze status: {e}")
-        return False
+        print(f"❌ Error fetching dashboard stats: {e}")
+        return {}
 
 def get_storage_usage():
     try:
-        resp = requests.get(f"{API_URL}/api/get-storage-usage", timeout=10)
+        resp = api_client.get("/api/get-storage-usage")
         if resp.status_code == 200:
             return resp.json()
         else:
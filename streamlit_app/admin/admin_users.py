@@ -1,9 +1,9 @@
 # streamlit_app/admin/admin_users.py
 import streamlit as st
-import requests
 import pandas as pd
 from datetime import datetime
-from config import API_URL, DEBUG
+from config import DEBUG
+from components import api_client
 # import plotly.express as px
 from auth import register
 import os
@@ -102,8 +102,8 @@ def view_users():
 def delete_user_api(user_id):
     """Call API to delete user (backend only, no UI widgets here)"""
     try:
-        response = requests.delete(
-            f"{API_URL}/admin/users/{user_id}",
+        response = api_client.delete(
+            f"/admin/users/{user_id}",
             headers={'Authorization': f"Bearer {st.session_state.get('user_token', '')}"}
         )
         if response.status_code == 200:
@@ -131,8 +131,8 @@ def user_analytics():
     st.subheader("User Analytics")
     
     try:
-        response = requests.get(
-            f"{API_URL}/admin/users/analytics",
+        response = api_client.get(
+            "/admin/users/analytics",
             headers={'Authorization': f"Bearer {st.session_state.get('user_token', '')}"}
         )
         
@@ -197,8 +197,8 @@ def get_users_from_api(search_query=None, role_filter="All"):
         if role_filter != "All":
             params['role'] = role_filter
         
-        response = requests.get(
-            f"{API_URL}/admin/users",
+        response = api_client.get(
+            "/admin/users",
             headers={'Authorization': f"Bearer {st.session_state.get('user_token', '')}"},
             params=params
         )
@@ -212,7 +212,7 @@ def get_users_from_api(search_query=None, role_filter="All"):
         
         return []
     
-    except requests.exceptions.ConnectionError:
+    except api_client.exceptions.ConnectionError:
         st.error("❌ Cannot connect to server. Please check your connection.")
         return []
     except Exception as e:
@@ -222,8 +222,8 @@ def get_users_from_api(search_query=None, role_filter="All"):
 def update_user_role(user_id, new_role):
     """Update user role via API"""
     try:
-        response = requests.put(
-            f"{API_URL}/admin/users/{user_id}/role",
+        response = api_client.put(
+            f"/admin/users/{user_id}/role",
             headers={
                 'Authorization': f"Bearer {st.session_state.get('user_token', '')}",
                 'Content-Type': 'application/json'
@@ -244,7 +244,7 @@ def update_user_role(user_id, new_role):
 
         return False
     
-    except requests.exceptions.ConnectionError:
+    except api_client.exceptions.ConnectionError:
         st.error("❌ Cannot connect to server. Please check your connection.")
         return False
     except Exception as e:
@@ -279,8 +279,8 @@ def delete_user(user_id):
             if st.button("✅ Confirm Deletion", key=f"confirm_btn_{user_id}"):
                 try:
                     with st.spinner("🗑️ Deleting user..."):
-                        response = requests.delete(
-                            f"{API_URL}/admin/users/{user_id}",
+                        response = api_client.delete(
+                            f"/admin/users/{user_id}",
                             headers={'Authorization': f"Bearer {st.session_state.get('user_token', '')}"}
                         )
                     if response.status_code == 200:
@@ -299,7 +299,7 @@ def delete_user(user_id):
                         st.error("❌ User not found")
                     else:
                         st.error("❌ Server error occurred")
-                except requests.exceptions.ConnectionError:
+                except api_client.exceptions.ConnectionError:
                     st.error("❌ Cannot connect to server. Please check your connection.")
                 except Exception as e:
                     st.error(f"❌ Unexpected error: {str(e)}")
@@ -1,7 +1,7 @@
 # streamlit_app/admin/uploads.py
 import streamlit as st
-import requests
-from config import API_URL, DEBUG
+from config import DEBUG
+from components import api_client
 # import os
 # import base as b
 from components.helpers import extract_chapter_number
@@ -37,25 +37,25 @@ def upload_audio():
         
         progress_bar = st.progress(0)
         status_text = st.empty()
-        
-        for i, file in enumerate(uploaded_files):
-            status_text.text(f"Checking {i+1}/{total_count}: {file.name}")
-    
-            chapter_number = extract_chapter_number(file.name)
-            if chapter_number is None:
+
+        chapter_files = []
+        for file in uploaded_files:
+            if extract_chapter_number(file.name) is None:
                 st.info(f"⏭️ Skipped non-chapter file: {file.name}")
                 continue  # do not upload, do not save in DB
+            chapter_files.append(file)
 
-            status_text.text(f"Uploading {i+1}/{total_count}: {file.name}")
-            if upload_to_backblaze(file, selected_book_id):
-                success_count += 1
-
-            progress_bar.progress((i + 1) / total_count)
-
-            # status_text.text(f"Uploading {i+1}/{total_count}: {file.name}")
-            # if upload_to_backblaze(file, selected_book_id):
-            #     success_count += 1
-            # progress_bar.progress((i + 1) / total_count)
+        done = total_count - len(chapter_files)
+        for batch in make_upload_batches(chapter_files):
+            status_text.text(f"Uploading {done + 1}-{done + len(batch)}/{total_count}: "
+                             + ", ".join(file.name for file in batch))
+            uploaded = direct_upload_batch(batch, selected_book_id)
+            if uploaded is None:
+                # The API could not hand out upload URLs - send the bytes through the API
+                uploaded = upload_through_api(batch, selected_book_id)
+            success_count += uploaded
+            done += len(batch)
+            progress_bar.progress(done / total_count)
         
         progress_bar.empty()
         status_text.empty()
@@ -80,7 +80,7 @@ def upload_audio():
 def get_all_books():
     """Streamlit function to fetch books via API"""
     try:
-        response = requests.get(f"{API_URL}/api/get_all_books", timeout=5)
+        response = api_client.get("/api/get_all_books")
         if response.status_code == 200:
             data = response.json()
             if data.get("success"):
@@ -91,15 +91,154 @@ def get_all_books():
         return []
     
 
+# Files are handled in batches of up to BULK_UPLOAD_FILES files / BULK_UPLOAD_BYTES bytes.
+# Without direct upload, files above STREAM_UPLOAD_MIN_BYTES use the streaming endpoint.
+STREAM_UPLOAD_MIN_BYTES = 50 * 1024 * 1024
+BULK_UPLOAD_FILES = 10
+BULK_UPLOAD_BYTES = 100 * 1024 * 1024
+B2_UPLOAD_TIMEOUT = (10, 300)
+
+
+def auth_headers():
+    return {'Authorization': f"Bearer {st.session_state.get('user_token', '')}"}
+
+
+def report_upload_results(data):
+    """Show the per-file status of a bulk/finalize response; returns the number uploaded"""
+    for result in data.get("files", []):
+        if result["status"] == "uploaded":
+            st.success(f"✅ Uploaded: {result['filename']}")
+        elif result["status"] == "failed":
+            st.error(f"❌ Upload failed: {result['filename']} - {result.get('error')}")
+    return data.get("uploaded", 0)
+
+
+def put_to_b2(file, plan):
+    """Send a file to its presigned URL(s); returns its entry for /api/upload_audio/finalize"""
+    session = api_client.get_session()
+    entry = {"filename": file.name, "size": file.size}
+    if plan["method"] == "put":
+        resp = session.put(plan["url"], data=file.getvalue(), headers=plan.get("headers"),
+                           timeout=B2_UPLOAD_TIMEOUT)
+        resp.raise_for_status()
+    else:
+        file.seek(0)
+        parts = []
+        for part in plan["parts"]:
+            resp = session.put(part["url"], data=file.read(plan["part_size"]), timeout=B2_UPLOAD_TIMEOUT)
+            resp.raise_for_status()
+            parts.append({"part_number": part["part_number"], "etag": resp.headers["ETag"]})
+        entry.update(upload_id=plan["upload_id"], parts=parts)
+    return entry
+
+
+def direct_upload_batch(files, book_id):
+    """Upload straight to B2 with presigned URLs, then let the API register the chapters.
+    Returns the number uploaded, or None if the API could not start the upload."""
+    try:
+        response = api_client.post(
+            "/api/upload_audio/initiate",
+            headers=auth_headers(),
+            json={"book_id": book_id, "files": [{"filename": file.name, "size": file.size} for file in files]}
+        )
+        if response.status_code != 200:
+            print(f"❌ Upload initiate failed: {response.status_code} - {response.text}")
+            return None
+        plans = response.json().get("files", [])
+    except Exception as e:
+        print(f"❌ Upload initiate failed: {e}")
+        return None
+
+    files_by_name = {file.name: file for file in files}
+    to_finalize = []
+    for plan in plans:
+        if plan["status"] == "failed":
+            st.error(f"❌ Upload failed: {plan['filename']} - {plan.get('error')}")
+        if plan["status"] != "ready":
+            continue
+        try:
+            to_finalize.append(put_to_b2(files_by_name[plan["filename"]], plan))
+        except Exception as e:
+            st.error(f"❌ Upload failed: {plan['filename']} - {e}")
+            if plan.get("upload_id"):
+                api_client.post("/api/upload_audio/abort", headers=auth_headers(), json={
+                    "book_id": book_id, "filename": plan["filename"], "upload_id": plan["upload_id"]
+                })
+
+    if not to_finalize:
+        return 0
+    try:
+        response = api_client.post(
+            "/api/upload_audio/finalize",
+            headers=auth_headers(),
+            json={"book_id": book_id, "files": to_finalize}
+        )
+        if response.status_code != 200:
+            st.error(f"❌ Upload failed: {response.json().get('error')}")
+            return 0
+        return report_upload_results(response.json())
+    except Exception as e:
+        st.error(f"❌ API error: {str(e)}")
+        return 0
+
+
+def upload_through_api(files, book_id):
+    """Fallback: stream large files one by one, send the rest in one bulk request"""
+    uploaded = 0
+    small_files = []
+    for file in files:
+        if file.size > STREAM_UPLOAD_MIN_BYTES:
+            uploaded += 1 if upload_to_backblaze(file, book_id) else 0
+        else:
+            small_files.append(file)
+    if small_files:
+        uploaded += upload_batch_to_backblaze(small_files, book_id)
+    return uploaded
+
+
+def make_upload_batches(files):
+    batches, batch, batch_bytes = [], [], 0
+    for file in files:
+        if batch and (len(batch) >= BULK_UPLOAD_FILES or batch_bytes + file.size > BULK_UPLOAD_BYTES):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(file)
+        batch_bytes += file.size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def upload_batch_to_backblaze(files, book_id):
+    """Send several files in one bulk request; returns the number uploaded"""
+    try:
+        for file in files:
+            file.seek(0)
+        response = api_client.post(
+            "/api/upload_audio/bulk",
+            data={"book_id": book_id},
+            files=[("files", (file.name, file, "audio/mpeg")) for file in files]
+        )
+        data = response.json()
+        if response.status_code != 200:
+            st.error(f"❌ Upload failed: {data.get('error')}")
+            return 0
+        return report_upload_results(data)
+    except Exception as e:
+        st.error(f"❌ API error: {str(e)}")
+        return 0
+
+
 def upload_to_backblaze(file, book_id):
     """Send file to Flask API, which handles upload + DB insert"""
     try:
-        files = {"file": (file.name, file, "audio/mpeg")}
-        response = requests.post(
-            f"{API_URL}/api/upload_audio",
-            data={"book_id": book_id},
-            files=files,
-            timeout=30
+        # Raw body instead of multipart form data - the API streams it to B2 as it arrives
+        file.seek(0)
+        response = api_client.post(
+            "/api/upload_audio/stream",
+            params={"book_id": book_id, "filename": file.name},
+            data=file,
+            headers={"Content-Type": "audio/mpeg"}
         )
         data = response.json()
         if response.status_code == 200 and data.get("success"):
@@ -115,10 +254,9 @@ def upload_to_backblaze(file, book_id):
 def get_book_chapters(book_id):
     """Get all chapters for a book via API"""
     try:
-        response = requests.get(
-            f"{API_URL}/api/chapters",
-            params={"book_id": book_id},
-            timeout=5
+        response = api_client.get(
+            "/api/chapters",
+            params={"book_id": book_id}
         )
         
         if response.status_code == 200:
@@ -1,8 +1,10 @@
 # streamlit_app/auth.py
 import streamlit as st
-import requests
+import base64
+import json
 from datetime import datetime, timedelta
-from config import API_URL, DEBUG
+from config import API_URL, DEBUG, AUTH_REVALIDATE_SECONDS, AUTH_EXPIRY_MARGIN_SECONDS
+from components import api_client
 
 def auth_page():
     """Authentication page with login and register tabs"""
@@ -40,10 +42,9 @@ def login():
                 if DEBUG:
                     st.info(f"Attempting login to: {API_URL}/api/login")
 
-                response = requests.post(
-                    f"{API_URL}/api/login",
-                    json={"email": email, "password": password},
-                    timeout=10
+                response = api_client.post(
+                    "/api/login",
+                    json={"email": email, "password": password}
                 )
                 
                 if DEBUG:
@@ -63,6 +64,7 @@ def login():
                         # Store token expiry if provided
                         if 'expires_in' in data:
                             st.session_state.token_expiry = datetime.now() + timedelta(seconds=data['expires_in'])
+                        st.session_state.token_verified_at = datetime.now()
                         
                         st.success("Login successful!")
                         st.rerun()
@@ -181,7 +183,7 @@ def register(admin_mode=False, default_role="member"):
 
 def register_user(name, email, password, membership_number, role):
     try:
-        response = requests.post(f"{API_URL}/api/register", json={
+        response = api_client.post("/api/register", json={
             "name": name,
             "email": email,
             "password": password,
@@ -305,16 +307,16 @@ def register_user(name, email, password, membership_number, role):
                 try:
                     # Use different endpoints for admin vs public registration
                     if admin_mode:
-                        endpoint = f"{API_URL}/admin/users"
+                        endpoint = "/admin/users"
                         headers = {
                             'Authorization': f"Bearer {st.session_state.get('user_token', '')}",
                             'Content-Type': 'application/json'
                         }
                     else:
-                        endpoint = f"{API_URL}/api/register"
+                        endpoint = "/api/register"
                         headers = {'Content-Type': 'application/json'}
                     
-                    response = requests.post(
+                    response = api_client.post(
                         endpoint,
                         headers=headers,
                         json={
@@ -402,6 +404,17 @@ def register_user(name, email, password, membership_number, role):
 #                     st.error(f"Connection error: {str(e)}")
 
 # streamlit_app/auth.py
+def token_expiry_from_jwt(token):
+    """exp claim of a JWT as a datetime, read locally (the signature is checked by the API)"""
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get('exp')
+        return datetime.fromtimestamp(exp) if exp else None
+    except (IndexError, ValueError, TypeError, AttributeError):
+        return None
+
+
 def check_authentication():
     """Check if user is authenticated and token is valid"""
     
@@ -412,13 +425,29 @@ def check_authentication():
     token = st.session_state.get('user_token')
     if not token:
         return None
+
+    # Check expiry locally first
+    now = datetime.now()
+    expiry = st.session_state.get('token_expiry') or token_expiry_from_jwt(token)
+    if expiry:
+        st.session_state.token_expiry = expiry
+        if now >= expiry:
+            st.warning("Session expired. Please login again.")
+            logout()
+            return None
+
+    # Only ask the backend every AUTH_REVALIDATE_SECONDS, or when expiry is near
+    verified_at = st.session_state.get('token_verified_at')
+    near_expiry = expiry is not None and (expiry - now).total_seconds() <= AUTH_EXPIRY_MARGIN_SECONDS
+    if verified_at and not near_expiry and (now - verified_at).total_seconds() < AUTH_REVALIDATE_SECONDS:
+        st.session_state.auth_checks_skipped = st.session_state.get('auth_checks_skipped', 0) + 1
+        return st.session_state.user_info
     
     # Verify token with backend
     try:
-        response = requests.post(
-            f"{API_URL}/api/verify-token",
-            json={"token": token},
-            timeout=5
+        response = api_client.post(
+            "/api/verify-token",
+            json={"token": token}
         )
         
         if response.status_code == 200:
@@ -432,6 +461,7 @@ def check_authentication():
                 expires_in = data.get('expires_in')
                 if expires_in:
                     st.session_state.token_expiry = datetime.now() + timedelta(seconds=expires_in)
+                st.session_state.token_verified_at = datetime.now()
                 
                 return st.session_state.user_info
             else:
@@ -442,7 +472,7 @@ def check_authentication():
             # If token verification fails, continue with cached credentials
             return st.session_state.user_info
             
-    except requests.exceptions.RequestException:
+    except api_client.exceptions.RequestException:
         # If API is unavailable, continue with cached credentials
         return st.session_state.user_info
     
@@ -451,7 +481,7 @@ def check_authentication():
 
 def logout():
     """Clear user session data"""
-    keys_to_remove = ['user_token', 'user_info', 'user_id', 'token_expiry']
+    keys_to_remove = ['user_token', 'user_info', 'user_id', 'token_expiry', 'token_verified_at', 'auth_checks_skipped']
     for key in keys_to_remove:
         if key in st.session_state:
             del st.session_state[key]
@@ -545,15 +575,14 @@ def logout():
                 st.error("Please fill all required fields!")
             else:
                 try:
-                    response = requests.post(
-                        f"{API_URL}/api/register",
+                    response = api_client.post(
+                        "/api/register",
                         json={
                             "name": name,
                             "email": email,
                             "password": password,
                             "membership_number": membership_number
-                        },
-                        timeout=10
+                        }
                     )
                     
                     if response.status_code == 200:
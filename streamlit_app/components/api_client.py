@@ -0,0 +1,78 @@
+# streamlit_app/components/api_client.py
+# All calls to the Flask API go through one pooled requests.Session, so a page
+# that makes several API calls reuses warm keep-alive connections instead of
+# opening a new TCP/TLS connection per call.
+import requests
+import streamlit as st
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config import API_URL
+
+# (connect, read) timeouts in seconds - first matching path prefix wins
+TIMEOUTS = [
+    ("/api/upload_audio", (5, 300)),   # also /stream and /bulk
+    ("/api/get-storage-usage", (5, 30)),
+    ("/api/verify-token", (3, 5)),
+    ("/api/record-play", (3, 5)),
+    ("/api/get-total-", (3, 5)),
+    ("/api/dashboard-stats", (3, 10)),
+    ("/api/check_", (3, 10)),
+]
+DEFAULT_TIMEOUT = (5, 10)
+
+# Pages catch api_client.exceptions.ConnectionError etc. without importing requests
+exceptions = requests.exceptions
+
+# Retries cover connection errors and gateway errors. Only GET and HEAD are retried
+# once the request was sent - a PUT/DELETE/POST that timed out may already have run
+RETRY = Retry(
+    total=3,
+    connect=3,
+    read=2,
+    backoff_factor=0.3,
+    status_forcelist=(502, 503, 504),
+    allowed_methods=frozenset({"GET", "HEAD"}),
+    raise_on_status=False,
+)
+
+
+@st.cache_resource
+def get_session():
+    """Session shared by every user session of this Streamlit process - it must never
+    keep cookies, or one user's cookies would be sent with everyone's requests"""
+    session = requests.Session()
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=20, max_retries=RETRY)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def timeout_for(path):
+    for prefix, timeout in TIMEOUTS:
+        if path.startswith(prefix):
+            return timeout
+    return DEFAULT_TIMEOUT
+
+
+def request(method, path, **kwargs):
+    """method on API_URL + path; path is e.g. "/api/get_all_books" """
+    kwargs.setdefault("timeout", timeout_for(path))
+    return get_session().request(method, f"{API_URL}{path}", **kwargs)
+
+
+def get(path, **kwargs):
+    return request("GET", path, **kwargs)
+
+
+def post(path, **kwargs):
+    return request("POST", path, **kwargs)
+
+
+def put(path, **kwargs):
+    return request("PUT", path, **kwargs)
+
+
+def delete(path, **kwargs):
+    return request("DELETE", path, **kwargs)
@@ -1,7 +1,8 @@
 # streamlit_app/components/helpers.py
 #########################
 from config import API_URL
-import requests
+from components import api_client
+import time
 import streamlit as st
 from streamlit.components.v1 import html
 
@@ -15,6 +16,16 @@ def format_date(date_string):
         return date_obj.strftime('%b %d, %Y')
     except:
         return date_string
+
+def format_duration(seconds):
+    """Seconds -> 'M:SS' or 'H:MM:SS'"""
+    if seconds is None:
+        return "Unknown"
+    minutes, secs = divmod(int(round(float(seconds))), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes}:{secs:02d}"
     
 import re
 
@@ -32,8 +43,53 @@ def extract_chapter_number(filename: str):
     return None
     
 
+# Sidebar "Audio quality" setting -> ?quality= of the audio URL endpoints. The API
+# signs a lower bitrate rendition of the chapter when one has been transcoded.
+AUDIO_QUALITIES = {
+    "Original": "original",
+    "High (128 kbps)": "high",
+    "Medium (64 kbps)": "medium",
+    "Low (32 kbps, data saver)": "low",
+}
+
+def audio_quality():
+    """?quality= value for the audio URLs, from the sidebar setting"""
+    return AUDIO_QUALITIES.get(st.session_state.get('audio_quality'), 'original')
+
+def get_book_audio_urls(book_id):
+    """Signed URLs for every chapter of a book in one API call -> {chapter title: url}.
+    Kept in session_state until shortly before the URLs expire."""
+    url_cache = st.session_state.setdefault('audio_url_cache', {})
+    quality = audio_quality()
+    cached = url_cache.get((book_id, quality))
+    if cached and cached['expires_at'] > time.time():
+        return cached['urls']
+
+    try:
+        response = api_client.get(f"/api/books/{book_id}/audio-urls", params={"quality": quality})
+        if response.status_code != 200:
+            print(f"Failed to get audio URLs: {response.status_code} - {response.text}")
+            return {}
+
+        entries = [entry for entry in response.json().get('urls', []) if entry.get('url')]
+        urls = {entry['title']: entry['url'] for entry in entries}
+        # Refresh a minute before the first URL expires
+        expires_in = min((entry.get('expires_in') or 0 for entry in entries), default=0)
+        url_cache[(book_id, quality)] = {'urls': urls, 'expires_at': time.time() + expires_in - 60}
+        return urls
+
+    except Exception as e:
+        print(f"Exception: {str(e)}")
+        return {}
+
 def get_signed_audio_url(book_id, chapter_title):
     """Get signed URL from Flask API"""
+    # Use the URL from an earlier get_book_audio_urls() call when there is one
+    quality = audio_quality()
+    cached = st.session_state.get('audio_url_cache', {}).get((book_id, quality))
+    if cached and cached['expires_at'] > time.time() and chapter_title in cached['urls']:
+        return cached['urls'][chapter_title]
+
     try:
         # Use the original audio-url endpoint, NOT the streaming one
         # encoded_title = urllib.parse.quote(chapter_title)
@@ -41,8 +97,9 @@ def get_signed_audio_url(book_id, chapter_title):
         #     f"{API_URL}/api/audio-url/{book_id}/{encoded_title}",
         #     timeout=10
         # )
-        response = requests.get(
-            f"{API_URL}/api/audio-url/{book_id}/{chapter_title}",  # No encoding
+        response = api_client.get(
+            f"/api/audio-url/{book_id}/{chapter_title}",  # No encoding
+            params={"quality": quality},
             timeout=10
         )
         
@@ -72,9 +129,9 @@ def audio_player(user_id, book_id, chapter_id, audio_url):
     progress = 0
     duration = 0
     try:
-        resp = requests.get(
-            f"{API_URL}/api/get_recently-played",
-            params={"user_id": user_id, "limit": 20}, timeout=10
+        resp = api_client.get(
+            "/api/get_recently-played",
+            params={"user_id": user_id, "limit": 20}
         )
         if resp.status_code == 200:
             data = resp.json().get("data", [])
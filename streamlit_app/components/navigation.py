@@ -1,5 +1,6 @@
 # streamlit_app/components/navigation.py
 import streamlit as st
+from components.helpers import AUDIO_QUALITIES
 # from admin import admin_dashboard, uploads, books, users, analytics
 
 def user_navigation():
@@ -21,6 +22,9 @@ def user_navigation():
     if menu_option != st.session_state.menu_option:
         st.session_state.menu_option = menu_option
         st.rerun()
+
+    # Bitrate of the audio the player gets - lower saves mobile data
+    st.sidebar.selectbox("Audio quality", list(AUDIO_QUALITIES), key="audio_quality")
     
     return st.session_state.menu_option
 
@@ -20,6 +20,11 @@ except (KeyError, AttributeError):
     DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
     ENVIRONMENT = os.getenv('ENVIRONMENT', 'development')
 
+# check_authentication re-verifies the token with the API at most every
+# AUTH_REVALIDATE_SECONDS, and on every rerun once expiry is AUTH_EXPIRY_MARGIN_SECONDS away
+AUTH_REVALIDATE_SECONDS = int(os.getenv('AUTH_REVALIDATE_SECONDS', '300'))
+AUTH_EXPIRY_MARGIN_SECONDS = int(os.getenv('AUTH_EXPIRY_MARGIN_SECONDS', '120'))
+
 print(f"✅ Environment: {ENVIRONMENT}")
 print(f"✅ API_URL: {API_URL}")
 print(f"✅ Debug mode: {DEBUG}")
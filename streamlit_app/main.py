@@ -21,6 +21,8 @@ def main():
         st.sidebar.info(f"API: {API_URL}")
     
     user_info = check_authentication()
+    if DEBUG and user_info:
+        st.sidebar.info(f"Token checks skipped: {st.session_state.get('auth_checks_skipped', 0)}")
     if not user_info:
         auth_page()
     elif user_info.get('role') == 'admin':
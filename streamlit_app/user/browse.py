@@ -1,8 +1,8 @@
 # streamlit_app/user/browse.py
 import streamlit as st
-import requests
-from config import API_URL, DEBUG
-from components.helpers import format_date
+from config import DEBUG
+from components.helpers import format_date, format_duration, get_book_audio_urls, audio_quality
+from components import api_client
 
 
 
@@ -21,6 +21,11 @@ def browse_books():
     with col2:
         page_size = st.selectbox("Books per page", [10, 20, 50, 100], index=0)
     
+    # Cursor pages are only valid for one page size
+    if st.session_state.get('browse_page_size') != page_size:
+        st.session_state.browse_page_size = page_size
+        st.session_state.cursor_stack = ['']
+    
     try:
         page = st.session_state.get('current_page', 1)
         
@@ -31,8 +36,14 @@ def browse_books():
         
         if search_query:
             params['search'] = search_query
+        else:
+            # Browsing without search uses keyset pagination: cursor_stack holds the
+            # cursor of every page visited so far, the last one is the current page
+            cursor_stack = st.session_state.setdefault('cursor_stack', [''])
+            params['cursor'] = cursor_stack[-1]
+            params['page'] = len(cursor_stack)
 
-        response = requests.get(f"{API_URL}/books", params=params, timeout=10)
+        response = api_client.get("/books", params=params)
         
         if response.status_code == 200:
             data = response.json()
@@ -72,6 +83,10 @@ def display_books_grid(books, pagination):
 ######## browse_books - display_pagination_controls ########
 def display_pagination_controls(pagination):
     """Display pagination controls"""
+    if 'next_cursor' in pagination:
+        display_cursor_pagination_controls(pagination)
+        return
+
     current_page = pagination.get('page', 1)
     total_pages = pagination.get('pages', 1)
     
@@ -100,6 +115,33 @@ def display_pagination_controls(pagination):
                     st.rerun()
 
 
+######## browse_books - display_cursor_pagination_controls ########
+def display_cursor_pagination_controls(pagination):
+    """Next/Previous controls for keyset (cursor) pagination"""
+    cursor_stack = st.session_state.get('cursor_stack', [''])
+    current_page = len(cursor_stack)
+    total_pages = pagination.get('pages', 1)
+    next_cursor = pagination.get('next_cursor')
+
+    if current_page > 1 or next_cursor:
+        col_prev, col_info, col_next = st.columns([1, 2, 1])
+
+        with col_prev:
+            if current_page > 1:
+                if st.button("⬅️ Previous", use_container_width=True):
+                    st.session_state.cursor_stack = cursor_stack[:-1]
+                    st.rerun()
+
+        with col_info:
+            st.write(f"**Page {current_page} of {total_pages}**")
+
+        with col_next:
+            if next_cursor:
+                if st.button("Next ➡️", use_container_width=True):
+                    st.session_state.cursor_stack = cursor_stack + [next_cursor]
+                    st.rerun()
+
+
 ######## browse_books - display_book_details ########
 def display_book_details(book):
     """Display detailed information about a single book"""
@@ -117,6 +159,8 @@ def display_book_details(book):
     
     with col_meta:
         st.write(f"**Chapters:** {len(book.get('chapters', []))}")
+        if book.get('duration'):
+            st.write(f"**Length:** {format_duration(book['duration'])}")
         st.write(f"**Added:** {format_date(book.get('created_at'))}")
     
     # Display chapters
@@ -137,7 +181,7 @@ def display_chapter(book, chapter):
         st.write(f"**Chapter {chapter['chapter_number']}:** {chapter['title']}")
         # Show duration if available
         if chapter.get('duration'):
-            st.caption(f"Duration: {chapter['duration']}")
+            st.caption(f"Duration: {format_duration(chapter['duration'])}")
     
     with chapter_col2:
         audio_key = f"audio_{book['id']}_{chapter['id']}"
@@ -157,7 +201,10 @@ def handle_audio_play(book, chapter, audio_key):
         return
     
     with st.spinner("Loading audio..."):
-        audio_url = get_signed_audio_url(book['id'], chapter['title'])
+        # One call signs every chapter of the book; later plays of this book reuse it
+        audio_url = get_book_audio_urls(book['id']).get(chapter['title'])
+        if not audio_url:
+            audio_url = get_signed_audio_url(book['id'], chapter['title'])
     
     if audio_url:
         try:
@@ -176,21 +223,15 @@ def handle_audio_play(book, chapter, audio_key):
             with audio_container:
                 st.audio(audio_url, format="audio/mp3")
                 
-                # Download button
-                try:
-                    audio_response = requests.get(audio_url, timeout=30)
-                    if audio_response.status_code == 200:
-                        st.download_button(
-                            label="📥 Download MP3",
-                            data=audio_response.content,
-                            file_name=f"{sanitize_filename(book['title'])}_Chapter_{chapter['chapter_number']}.mp3",
-                            mime="audio/mp3",
-                            key=f"dl_{audio_key}",
-                            use_container_width=True
-                        )
-                    else:
-                        st.warning("Download temporarily unavailable")
-                except:
+                # Download link - the browser fetches the file from B2 itself,
+                # nothing is loaded into this Streamlit session
+                download_url = get_download_url(
+                    book['id'], chapter['title'],
+                    f"{sanitize_filename(book['title'])}_Chapter_{chapter['chapter_number']}.mp3"
+                )
+                if download_url:
+                    st.link_button("📥 Download MP3", download_url, use_container_width=True)
+                else:
                     st.warning("Download temporarily unavailable")
                     
         except Exception as audio_error:
@@ -210,8 +251,9 @@ def get_signed_audio_url(book_id, chapter_title):
         #     f"{API_URL}/api/audio-url/{book_id}/{encoded_title}",
         #     timeout=10
         # )
-        response = requests.get(
-            f"{API_URL}/api/audio-url/{book_id}/{chapter_title}",  # No encoding
+        response = api_client.get(
+            f"/api/audio-url/{book_id}/{chapter_title}",  # No encoding
+            params={"quality": audio_quality()},
             timeout=10
         )
         
@@ -234,21 +276,36 @@ def get_signed_audio_url(book_id, chapter_title):
         print(f"Exception: {str(e)}")
         return None
 
+######## browse_books - get_download_url ########
+def get_download_url(book_id, chapter_title, file_name):
+    """Signed URL that makes the browser save the chapter as file_name"""
+    try:
+        response = api_client.get(
+            f"/api/audio-url/{book_id}/{chapter_title}",
+            params={"download": 1, "filename": file_name}
+        )
+        if response.status_code == 200:
+            return response.json().get('url')
+        print(f"Failed to get download URL: {response.status_code} - {response.text}")
+        return None
+    except Exception as e:
+        print(f"Exception: {str(e)}")
+        return None
+
 ######## my_library - record_audio_play ########
 ######## browse_books - record_audio_play ########
 def record_audio_play(user_id, book_id, chapter_id=None, duration=0, progress=0):
     """Call Flask API to record audio play"""
     try:
-        response = requests.post(
-            f"{API_URL}/api/record-play",
+        response = api_client.post(
+            "/api/record-play",
             json={
                 "user_id": user_id,
                 "book_id": book_id,
                 "chapter_id": chapter_id,
                 "duration": duration,
                 "progress": progress
-            },
-            timeout=5
+            }
         )
         return response.status_code == 200
     except Exception as e:
@@ -2,11 +2,11 @@
 #########################
 import streamlit as st
 import streamlit.components.v1 as components
-import requests
 from datetime import datetime
 # from components.helpers import format_date
-from components.helpers import format_date, audio_player, get_signed_audio_url
-from config import API_URL, DEBUG
+from components.helpers import format_date, audio_player, get_signed_audio_url, get_book_audio_urls
+from components import api_client
+from config import DEBUG
 
 def my_library():
     """Personal library with working audio tracking"""
@@ -40,6 +40,10 @@ def show_recently_played():
             st.info("You haven't played any books yet. Start listening to see them here!")
             return
         
+        # One batch call per book instead of one call per chapter
+        for book_id in {book["id"] for book in recent_books}:
+            get_book_audio_urls(book_id)
+
         for i, book in enumerate(recent_books):
             display_recent_book(book, i)
             
@@ -52,11 +56,10 @@ def show_recently_played():
 def get_recently_played(user_id, limit=10):
     """Streamlit function to get recently played books from API"""
     try:
-        response = requests.get(
-            f"{API_URL}/api/get_recently-played",
+        response = api_client.get(
+            "/api/get_recently-played",
             params={"user_id": user_id,
-                    "limit": limit},
-            timeout=10
+                    "limit": limit}
         )
         
         if response.status_code == 200:
@@ -70,7 +73,7 @@ def get_recently_played(user_id, limit=10):
             st.error(f"Failed to fetch recently played: {response.status_code}")
             return None
             
-    except requests.exceptions.RequestException as e:
+    except api_client.exceptions.RequestException as e:
         st.error(f"Connection error: {str(e)}")
         return None
     except Exception as e:
@@ -0,0 +1,153 @@
+# tests/test_register.py
+# POST /api/register against a fake PostgreSQL pool, so the real transaction()
+# handling in base.py runs.
+#   python -m unittest discover tests
+import os
+import sys
+import unittest
+
+os.environ.setdefault('DB_TYPE', 'postgresql')
+os.environ.setdefault('MIGRATE_ON_START', 'false')
+os.environ.setdefault('JWT_SECRET', 'test-secret')
+os.environ.setdefault('B2_BUCKET', 'test-bucket')
+os.environ.setdefault('B2_KEY_ID', 'test')
+os.environ.setdefault('B2_APP_KEY', 'test')
+os.environ.setdefault('region_name', 'us-west-004')
+os.environ.setdefault('B2_ENDPOINT', 'https://s3.us-west-004.backblazeb2.com')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+from psycopg2.extensions import (TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS,
+                                 TRANSACTION_STATUS_INERROR)
+
+import base as b
+import app as a
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+        self.rowcount = 0
+
+    def execute(self, query, params=None):
+        self.connection.statements.append(' '.join(query.split()))
+        if self.connection.status == TRANSACTION_STATUS_INERROR:
+            raise psycopg2.errors.InFailedSqlTransaction("current transaction is aborted")
+        self.connection.status = TRANSACTION_STATUS_INTRANS
+        try:
+            self.rows, self.rowcount = self.connection.handler(query, params)
+        except Exception:
+            self.connection.status = TRANSACTION_STATUS_INERROR
+            raise
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, handler):
+        self.handler = handler
+        self.status = TRANSACTION_STATUS_IDLE
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self, cursor_factory=None):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return self.status
+
+    def commit(self):
+        self.commits += 1
+        self.status = TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        pass
+
+
+class FakePool:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def acquire(self):
+        return self.connection
+
+
+class RegisterTest(unittest.TestCase):
+    def setUp(self):
+        self._get_pool = b.get_pool
+        self._bump_dashboard_counters = a.bump_dashboard_counters
+        self.client = a.app.test_client()
+
+    def tearDown(self):
+        b.get_pool = self._get_pool
+        a.bump_dashboard_counters = self._bump_dashboard_counters
+
+    def use_database(self, handler):
+        connection = FakeConnection(handler)
+        b.get_pool = lambda: FakePool(connection)
+        return connection
+
+    def register(self):
+        return self.client.post('/api/register', json={
+            'name': 'Ann', 'email': 'ann@example.com', 'password': 'secret1', 'role': 'member'
+        })
+
+    def test_duplicate_insert_returns_409_and_rolls_back(self):
+        # The email check passes (registered concurrently), then the unique index rejects the insert
+        def handler(query, params):
+            if query.strip().startswith('INSERT'):
+                raise psycopg2.IntegrityError('duplicate key value violates unique constraint "users_email_key"')
+            return [], 0
+        connection = self.use_database(handler)
+
+        response = self.register()
+
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(response.get_json()['success'])
+        self.assertEqual(connection.commits, 0)
+        self.assertGreaterEqual(connection.rollbacks, 1)
+        self.assertEqual(connection.status, TRANSACTION_STATUS_IDLE)
+
+    def test_existing_email_returns_409(self):
+        connection = self.use_database(lambda query, params: ([{'id': 7}], 1))
+
+        response = self.register()
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.get_json()['error'], 'Email already exists')
+        self.assertFalse(any(s.startswith('INSERT') for s in connection.statements))
+
+    def test_new_user_is_committed(self):
+        user = {'id': 9, 'name': 'Ann', 'email': 'ann@example.com', 'role': 'member', 'membership_number': None}
+        inserted = []
+
+        def handler(query, params):
+            if query.strip().startswith('INSERT'):
+                inserted.append(params)
+                return [], 1
+            return ([user], 1) if inserted else ([], 0)
+        connection = self.use_database(handler)
+        a.bump_dashboard_counters = lambda **counts: None
+
+        response = self.register()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['user']['id'], 9)
+        self.assertEqual(connection.commits, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()